@@ -0,0 +1,308 @@
+"""
+Cache delle risposte davanti alla catena RAG.
+
+`ExactAnswerCache` è persistente su disco (SQLite) e risponde alle domande
+identiche a meno di maiuscole, accenti, punteggiatura e spazi, per la
+stessa versione dell'indice, lo stesso modello e lo stesso prompt.
+
+`SemanticAnswerCache` copre le riformulazioni: le domande già risposte
+sono tenute in un piccolo indice FAISS a prodotto interno su vettori
+normalizzati (similarità coseno). Una nuova domanda senza storia della
+chat riceve la risposta salvata della domanda più simile, se la
+similarità supera la soglia. Le voci scadono dopo `ttl` secondi e oltre
+`max_entries` vengono eliminate in ordine LRU. Questo cache vive in
+memoria ed è legato a una versione dell'indice principale: quando
+l'indice viene rigenerato il contenuto è scartato.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import faiss
+import numpy as np
+
+from chain_layers import LayeredChain
+from lexical_index import match_title
+
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]", re.UNICODE)
+# Ordinali normalizzati (senza accenti) → numero, così "primo anno" e "1 anno" coincidono
+_ORDINALS = {
+    word: str(number)
+    for number, words in enumerate([
+        ("primo", "prima", "primi", "prime", "first"),
+        ("secondo", "seconda", "secondi", "seconde", "second"),
+        ("terzo", "terza", "terzi", "terze", "third"),
+        ("quarto", "quarta", "fourth"),
+        ("quinto", "quinta", "fifth"),
+        ("sesto", "sesta", "sixth"),
+    ], start=1)
+    for word in words
+}
+SEMANTIC_CANDIDATES = 4  # domande simili esaminate per trovarne una con le stesse entità
+
+
+def normalize_query(text):
+    """Minuscole, senza accenti né punteggiatura, spazi compattati."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+    return " ".join(_PUNCTUATION_RE.sub(" ", text).split())
+
+
+def query_entities(question, titles=()):
+    """
+    Entità della domanda che devono coincidere per riusare una risposta:
+    numeri e ordinali (come numeri) più il titolo di `titles` citato.
+    """
+    entities = set()
+    for token in normalize_query(question).split():
+        if token.isdigit():
+            entities.add(str(int(token)))
+        elif token in _ORDINALS:
+            entities.add(_ORDINALS[token])
+    title = match_title(question, titles) if titles else None
+    if title is not None:
+        entities.add(f"titolo:{title}")
+    return frozenset(entities)
+
+
+def history_fingerprint(chat_history):
+    """Rappresentazione stabile della storia della chat da includere nella chiave."""
+    return json.dumps([(message.type, message.content) for message in chat_history or []], ensure_ascii=False)
+
+
+class ExactAnswerCache:
+    """
+    Archivio SQLite (WAL) delle risposte con eviction LRU oltre `max_entries`.
+
+    La chiave è lo sha256 di (domanda normalizzata, storia della chat,
+    versione dell'indice, modello, hash del prompt). Thread-safe.
+    """
+
+    def __init__(self, path, max_entries=10_000):
+        self.path = path
+        self.max_entries = max_entries
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " key TEXT PRIMARY KEY,"
+            " query TEXT NOT NULL,"
+            " answer TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_last_used ON answers (last_used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(query, chat_history, index_version, model_name, prompt_hash):
+        parts = [normalize_query(query), history_fingerprint(chat_history), index_version, model_name, prompt_hash]
+        return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key, record_miss=True):
+        """Risposta salvata per `key`, o None; `record_miss=False` non conta il miss."""
+        with self._lock:
+            row = self._conn.execute("SELECT answer FROM answers WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                if record_miss:
+                    self.misses += 1
+                return None
+            self._conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, query, answer):
+        now = time.time()
+        with self._lock:
+            updated = self._conn.execute(
+                "UPDATE answers SET query = ?, answer = ?, created = ?, last_used = ? WHERE key = ?",
+                (query, answer, now, now, key),
+            ).rowcount
+            if not updated:
+                # Solo le chiavi nuove contano per il limite di dimensione
+                self._conn.execute(
+                    "INSERT INTO answers (key, query, answer, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                    (key, query, answer, now, now),
+                )
+                self._count += 1
+            if self.max_entries and self._count > self.max_entries:
+                # Libera un 10% in più per non ripetere l'eviction a ogni inserimento
+                excess = self._count - int(self.max_entries * 0.9)
+                self._conn.execute(
+                    "DELETE FROM answers WHERE rowid IN "
+                    "(SELECT rowid FROM answers ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+                self._count = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            self._conn.commit()
+
+    def __len__(self):
+        return self._count
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def wrap(self, rag_chain, index_version, model_name, prompt_hash):
+        """Restituisce la catena `rag_chain` con il cache davanti."""
+        def key_for(input):
+            return self.make_key(input["input"], input.get("chat_history"), index_version, model_name, prompt_hash)
+        return LayeredChain(
+            lambda input: self.get(key_for(input)),
+            rag_chain,
+            lambda input, answer: self.put(key_for(input), input["input"], answer),
+        )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SemanticAnswerCache:
+    """
+    Cache domanda → risposta per similarità degli embedding. Thread-safe.
+
+    `titles` sono i titoli dei corsi noti, usati per riconoscere il corso
+    citato dalla domanda (vedi query_entities).
+    """
+
+    def __init__(self, embeddings, threshold=0.95, ttl=24 * 3600, max_entries=1000, titles=()):
+        self.embeddings = embeddings
+        self.titles = list(titles)
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._index = None  # creato al primo inserimento, quando si conosce la dimensione
+        self._entries = OrderedDict()  # id → (domanda, risposta, creazione, entità); ordine LRU
+        self._next_id = 0
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+
+    def _vector(self, question):
+        vector = np.asarray([self.embeddings.embed_query(question)], dtype="float32")
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _remove(self, entry_ids):
+        for entry_id in entry_ids:
+            self._entries.pop(entry_id, None)
+        if entry_ids:
+            self._index.remove_ids(np.asarray(entry_ids, dtype="int64"))
+
+    def set_version(self, version, titles=None):
+        """
+        Svuota il cache se `version` (firma dell'indice principale) è cambiata;
+        `titles` aggiorna i titoli dei corsi noti.
+        """
+        with self._lock:
+            if version != self._version:
+                self._clear_locked()
+                self._version = version
+            if titles is not None:
+                self.titles = list(titles)
+
+    def _clear_locked(self):
+        self._index = None
+        self._entries.clear()
+
+    def clear(self):
+        with self._lock:
+            self._clear_locked()
+
+    def lookup(self, question):
+        """Risposta salvata per una domanda simile, o None."""
+        vector = self._vector(question)
+        entities = query_entities(question, self.titles)
+        with self._lock:
+            if self._index is None or not self._entries:
+                self.misses += 1
+                return None
+            scores, ids = self._index.search(vector, min(SEMANTIC_CANDIDATES, len(self._entries)))
+            expired = []
+            answer = None
+            for entry_id, score in zip(ids[0].tolist(), scores[0].tolist()):
+                entry = self._entries.get(entry_id)
+                if entry_id < 0 or score < self.threshold:
+                    break
+                if entry is None:
+                    continue
+                if time.time() - entry[2] > self.ttl:
+                    expired.append(entry_id)
+                    continue
+                if entry[3] == entities:
+                    self._entries.move_to_end(entry_id)
+                    answer = entry[1]
+                    break
+            self._remove(expired)
+            if answer is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return answer
+
+    def store(self, question, answer):
+        vector = self._vector(question)
+        entities = query_entities(question, self.titles)
+        with self._lock:
+            if self._index is None:
+                self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(vector, np.asarray([entry_id], dtype="int64"))
+            self._entries[entry_id] = (question, answer, time.time(), entities)
+            if len(self._entries) > self.max_entries:
+                excess = len(self._entries) - self.max_entries
+                self._remove(list(self._entries)[:excess])
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def wrap(self, rag_chain, skip=None):
+        """
+        Restituisce la catena `rag_chain` con il cache davanti.
+
+        Le domande per cui `skip(domanda)` è vero non passano dal cache: è il
+        caso di quelle servite dal solo indice lessicale, che altrimenti
+        pagherebbero l'embedding che il percorso lessicale evita.
+        """
+        def bypass(input):
+            # Con una conversazione in corso la risposta dipende dal contesto
+            return bool(input.get("chat_history")) or (skip is not None and skip(input["input"]))
+
+        def lookup(input):
+            return None if bypass(input) else self.lookup(input["input"])
+
+        def store(input, answer):
+            if not bypass(input):
+                self.store(input["input"], answer)
+        return LayeredChain(lookup, rag_chain, store)
@@ -9,12 +9,20 @@ import sys
 import os
 import json
 import csv
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from dotenv import load_dotenv
-import pandas as pd
 
 # Import the query function from bot_review
-from bot_review import query_chatbot
+from bot_review import get_engine, print_answer_cache_stats, query_chatbot
+from rate_limit import RateLimiter, call_with_backoff, estimate_tokens
+
+# Token stimati per ogni query oltre al testo della domanda:
+# system prompt + 10 chunk di contesto + risposta
+PROMPT_TOKEN_ESTIMATE = 8000
+MAX_RETRIES = 5
 
 def load_questions_from_excel(file_path):
     """Carica le domande e le risposte corrette da un file Excel con colonne 'query' e 'true_answer'."""
@@ -23,6 +31,8 @@ def load_questions_from_excel(file_path):
     if not file_path.endswith(('.xlsx', '.xls')):
         raise ValueError("Il file deve essere in formato Excel (.xlsx o .xls)")
     
+    # pandas è lento da importare: serve solo qui, non per --help
+    import pandas as pd
     try:
         # Load Excel file
         df = pd.read_excel(file_path)
@@ -68,65 +78,215 @@ def save_results(results, output_file):
             for result in results:
                 writer.writerow(result)
 
-def batch_query(data, verbose=False, save_to=None):
+def query_hash(query):
+    """Chiave stabile di una query, usata per riconoscerla nel checkpoint."""
+    return hashlib.sha256(query.strip().encode('utf-8')).hexdigest()[:16]
+
+def checkpoint_path(output_file):
+    """Percorso del checkpoint JSONL associato al file di output."""
+    base, ext = os.path.splitext(output_file)
+    return output_file if ext == '.jsonl' else base + '.jsonl'
+
+def load_checkpoint(path):
+    """
+    Legge un checkpoint JSONL e restituisce {query_hash: risultato}.
+    Le righe troncate (es. da un crash durante la scrittura) vengono ignorate.
+    """
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            done[record.get('query_hash') or query_hash(record['query'])] = record
+    return done
+
+class CheckpointWriter:
+    """Aggiunge un risultato per riga al checkpoint JSONL, con flush immediato."""
+
+    def __init__(self, path, append=False):
+        self.path = path
+        self._lock = threading.Lock()
+        needs_newline = False
+        if append and os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b'\n'
+        self._file = open(path, 'a' if append else 'w', encoding='utf-8')
+        if needs_newline:
+            # Chiude una riga lasciata a metà da un'esecuzione interrotta
+            self._file.write('\n')
+
+    def write(self, result):
+        record = dict(result, query_hash=query_hash(result['query']))
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+def compact_checkpoint(checkpoint_file, data, output_file):
+    """
+    Produce il file finale {timestamp, total_queries, results} (o CSV) a partire
+    dal checkpoint JSONL, nell'ordine delle query in `data`.
+    Restituisce la lista dei risultati compattati.
+    """
+    done = load_checkpoint(checkpoint_file)
+    results = []
+    for item in data:
+        record = done.get(query_hash(item['query']))
+        if record is not None:
+            results.append({key: record.get(key, '') for key in ('query', 'answer', 'true_answer', 'timestamp')})
+    save_results(results, output_file)
+    return results
+
+def run_single_query(item, verbose=False, rate_limiter=None, max_retries=MAX_RETRIES):
+    """
+    Esegue una singola query rispettando il rate limiter e ritentando con
+    backoff esponenziale su 429/5xx. Restituisce il dict del risultato.
+    """
+    query = item['query']
+
+    def attempt():
+        # Le risposte già in cache non consumano il budget del rate limiter
+        try:
+            answer = get_engine().cached_answer(query)
+        except FileNotFoundError:
+            answer = None
+        if answer is not None:
+            return answer
+        if rate_limiter:
+            rate_limiter.acquire(estimate_tokens(query) + PROMPT_TOKEN_ESTIMATE)
+        return query_chatbot(query, verbose=verbose, raise_errors=True)
+
+    def on_retry(error, attempt_number, delay):
+        print(f"⟳ Retry {attempt_number}/{max_retries} tra {delay:.1f}s per '{query}': {error}")
+
+    try:
+        answer = call_with_backoff(attempt, max_retries=max_retries, on_retry=on_retry)
+    except Exception as e:
+        print(f"✗ Errore per la query '{query}': {e}")
+        answer = f"ERRORE: {e}"
+    return {
+        'query': query,
+        'answer': answer,
+        'true_answer': item['true_answer'],
+        'timestamp': datetime.now().isoformat()
+    }
+
+def batch_query(data, verbose=False, save_to=None, workers=1, rate_limiter=None, resume=False):
     """
     Esegue query massive al chatbot.
     
+    Se `save_to` è indicato, ogni risultato viene aggiunto appena pronto al
+    checkpoint JSONL accanto al file di output; a fine elaborazione il
+    checkpoint viene compattato nel formato finale (.json o .csv).
+    
     Args:
         data (list): Lista di dict con 'query' e 'true_answer'
         verbose (bool): Se stampare informazioni dettagliate
         save_to (str): Percorso file dove salvare i risultati
+        workers (int): Numero di query eseguite in parallelo
+        rate_limiter (RateLimiter): Limitatore condiviso tra i worker (opzionale)
+        resume (bool): Salta le query già risposte nel checkpoint esistente
         
     Returns:
-        list: Lista di risultati con query, answer e true_answer
+        list: Lista di risultati con query, answer e true_answer, nell'ordine di input
     """
-    results = []
     total = len(data)
+    results = [None] * total
+    writer = None
+    
+    if save_to:
+        checkpoint = checkpoint_path(save_to)
+        if resume:
+            # Le query finite in errore vengono rieseguite
+            done = load_checkpoint(checkpoint)
+            for index, item in enumerate(data):
+                record = done.get(query_hash(item['query']))
+                if record and not record.get('answer', '').startswith('ERRORE:'):
+                    results[index] = {key: record.get(key, '') for key in ('query', 'answer', 'true_answer', 'timestamp')}
+        writer = CheckpointWriter(checkpoint, append=resume)
     
-    print(f"Inizio elaborazione di {total} query...")
+    pending = [index for index in range(total) if results[index] is None]
+    if resume and save_to:
+        print(f"Ripresa da {checkpoint}: {total - len(pending)} query già completate, {len(pending)} da eseguire.")
     
-    for i, item in enumerate(data, 1):
-        query = item['query']
-        true_answer = item['true_answer']
-        
-        if verbose:
-            print(f"\n[{i}/{total}] Elaborando: {query}")
+    print(f"Inizio elaborazione di {len(pending)} query con {workers} worker...")
+    
+    def record(index, result):
+        results[index] = result
+        if writer:
+            writer.write(result)
+    
+    try:
+        if workers <= 1:
+            for done_count, index in enumerate(pending, 1):
+                item = data[index]
+                if verbose:
+                    print(f"\n[{index + 1}/{total}] Elaborando: {item['query']}")
+                else:
+                    print(f"Progresso: {done_count}/{len(pending)}")
+                record(index, run_single_query(item, verbose=verbose, rate_limiter=rate_limiter))
+                if not verbose:
+                    print(f"✓ Risposta ottenuta per query {index + 1}")
         else:
-            print(f"Progresso: {i}/{total}")
-        
-        try:
-            answer = query_chatbot(query, verbose=verbose)
-            result = {
-                'query': query,
-                'answer': answer,
-                'true_answer': true_answer,
-                'timestamp': datetime.now().isoformat()
-            }
-            results.append(result)
-            
-            if not verbose:
-                print(f"✓ Risposta ottenuta per query {i}")
-            
-        except Exception as e:
-            error_msg = f"Errore per la query '{query}': {e}"
-            print(f"✗ {error_msg}")
-            result = {
-                'query': query,
-                'answer': f"ERRORE: {e}",
-                'true_answer': true_answer,
-                'timestamp': datetime.now().isoformat()
-            }
-            results.append(result)
+            # Il vectorstore è condiviso tra i thread tramite il RAGEngine di bot_review
+            executor = ThreadPoolExecutor(max_workers=workers)
+            try:
+                futures = {
+                    executor.submit(run_single_query, data[index], verbose, rate_limiter): index
+                    for index in pending
+                }
+                for done_count, future in enumerate(as_completed(futures), 1):
+                    index = futures[future]
+                    record(index, future.result())
+                    print(f"✓ [{done_count}/{len(pending)}] Risposta ottenuta per query {index + 1}")
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+    except KeyboardInterrupt:
+        if writer:
+            print(f"\nInterrotto. Risultati parziali in {writer.path}: rilanciare con --resume per continuare.")
+        raise
+    finally:
+        if writer:
+            writer.close()
     
+    results = [result for result in results if result is not None]
     print(f"\nElaborazione completata. {len(results)} risultati ottenuti.")
     
-    # Salva risultati se richiesto
-    if save_to:
-        save_results(results, save_to)
+    # Compatta il checkpoint nel formato finale
+    if save_to and checkpoint != save_to:
+        results = compact_checkpoint(checkpoint, data, save_to)
+        print(f"Risultati salvati in: {save_to}")
+    elif save_to:
         print(f"Risultati salvati in: {save_to}")
 
     return results
 
+def parse_positive_int_option(name):
+    """Legge da sys.argv il valore intero positivo dell'opzione `name`, se presente."""
+    if name not in sys.argv:
+        return None
+    try:
+        option_index = sys.argv.index(name)
+        if option_index + 1 < len(sys.argv):
+            value = int(sys.argv[option_index + 1])
+            if value <= 0:
+                print(f"Errore: il valore di {name} deve essere un numero positivo.")
+                sys.exit(1)
+            return value
+        print(f"Errore: {name} richiede un numero.")
+        sys.exit(1)
+    except ValueError:
+        print(f"Errore: il valore di {name} deve essere un numero valido.")
+        sys.exit(1)
+
 def main():
     """Funzione principale per uso da linea di comando."""
     load_dotenv()
@@ -134,12 +294,17 @@ def main():
     if len(sys.argv) < 2 or '--help' in sys.argv or '-h' in sys.argv:
         print("Batch Query Tool per StudentsBot")
         print("\nUSO:")
-        print("  python batch_query.py <file_excel> [output_file] [--verbose] [--limit N]")
+        print("  python batch_query.py <file_excel> [output_file] [--verbose] [--limit N] [--workers N] [--resume]")
         print("\nFORMATO SUPPORTATO:")
         print("  .xlsx, .xls - File Excel con colonne 'query' e 'true_answer'")
         print("\nPARAMETRI:")
         print("  --verbose     Mostra output dettagliato durante l'elaborazione")
         print("  --limit N     Elabora solo le prime N query del file")
+        print("  --workers N   Esegue N query in parallelo (default: 1)")
+        print("  --rpm N       Limite client di richieste al minuto verso Gemini")
+        print("  --tpm N       Limite client di token al minuto verso Gemini")
+        print("  --resume      Riprende un'esecuzione interrotta saltando le query già")
+        print("                salvate nel checkpoint <output_file>.jsonl")
         print("  --help, -h    Mostra questo aiuto")
         print("\nESEMPI:")
         print("  python batch_query.py data/queries.xlsx")
@@ -147,6 +312,8 @@ def main():
         print("  python batch_query.py data/queries.xlsx risultati.json --verbose")
         print("  python batch_query.py data/queries.xlsx risultati.json --limit 10")
         print("  python batch_query.py data/queries.xlsx risultati.json --limit 5 --verbose")
+        print("  python batch_query.py data/queries.xlsx risultati.json --workers 8 --rpm 60")
+        print("  python batch_query.py data/queries.xlsx risultati.json --resume")
         print("\nESEMPI SUBSET TESTING:")
         print("  python batch_query.py data/queries.xlsx test_5.json --limit 5      # Prime 5 query")
         print("  python batch_query.py data/queries.xlsx test_10.json --limit 10    # Prime 10 query")
@@ -156,23 +323,18 @@ def main():
     excel_file = sys.argv[1]
     output_file = sys.argv[2] if len(sys.argv) > 2 and not sys.argv[2].startswith('--') else None
     verbose = '--verbose' in sys.argv
+    resume = '--resume' in sys.argv
+    if resume and not output_file:
+        print("Errore: --resume richiede un file di output.")
+        sys.exit(1)
     
-    # Parse limit parameter
-    limit = None
-    if '--limit' in sys.argv:
-        try:
-            limit_index = sys.argv.index('--limit')
-            if limit_index + 1 < len(sys.argv):
-                limit = int(sys.argv[limit_index + 1])
-                if limit <= 0:
-                    print("Errore: il valore di --limit deve essere un numero positivo.")
-                    sys.exit(1)
-            else:
-                print("Errore: --limit richiede un numero.")
-                sys.exit(1)
-        except ValueError:
-            print("Errore: il valore di --limit deve essere un numero valido.")
-            sys.exit(1)
+    limit = parse_positive_int_option('--limit')
+    workers = parse_positive_int_option('--workers') or 1
+    requests_per_minute = parse_positive_int_option('--rpm')
+    tokens_per_minute = parse_positive_int_option('--tpm')
+    rate_limiter = None
+    if requests_per_minute or tokens_per_minute:
+        rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
     
     if not os.path.exists(excel_file):
         print(f"Errore: File {excel_file} non trovato.")
@@ -196,7 +358,8 @@ def main():
         sys.exit(1)
     
     # Esegui batch query
-    results = batch_query(data, verbose=verbose, save_to=output_file)
+    results = batch_query(data, verbose=verbose, save_to=output_file,
+                          workers=workers, rate_limiter=rate_limiter, resume=resume)
     
     # Mostra statistiche finali
     successful = len([r for r in results if not r['answer'].startswith('ERRORE:')])
@@ -208,6 +371,7 @@ def main():
         print(f"- Query elaborate: {len(results)}")
     print(f"- Risposte riuscite: {successful}")
     print(f"- Errori: {len(results) - successful}")
+    print_answer_cache_stats()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
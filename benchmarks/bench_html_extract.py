@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark del tempo CPU per pagina dell'estrazione HTML del crawler.
+
+Confronta il vecchio percorso a tre parsing (BeautifulSoup html.parser,
+str() + markdownify, find_all dei link) con gli estrattori di
+html_extract disponibili, sulle fixture HTML salvate.
+
+USO:
+  python benchmarks/bench_html_extract.py [cartella_fixture] [--repeat N]
+
+Per generare fixture reali impostare SAVE_RAW_HTML_DIR in crawler.py.
+"""
+
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup
+from markdownify import markdownify as md
+
+from html_extract import MAIN_CONTENT_SELECTORS, available_extractors, get_extractor, normalize_link
+
+DEFAULT_FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+BASE_URL = "https://studenticattolica.unicatt.it/"
+
+
+def baseline_extract(html_content, url):
+    """Percorso originale di parse_and_save: tre passaggi sull'HTML."""
+    soup = BeautifulSoup(html_content, 'html.parser')
+    content_element = None
+    for selector in MAIN_CONTENT_SELECTORS:
+        content_element = soup.select_one(selector)
+        if content_element:
+            break
+    if not content_element:
+        content_element = soup.body
+    markdown_content = md(str(content_element), heading_style='atx')
+    links = [normalize_link(url, a_tag['href']) for a_tag in soup.find_all('a', href=True)]
+    return markdown_content, links
+
+
+def make_extract(name):
+    extractor = get_extractor(name)
+
+    def extract(html_content, url):
+        document = extractor.parse(html_content)
+        return extractor.content_markdown(document), extractor.links(document, url)
+    return extract
+
+
+def cpu_ms_per_page(extract, pages, repeat):
+    extract(pages[0], BASE_URL)  # warm-up
+    started = time.process_time()
+    for _ in range(repeat):
+        for html_content in pages:
+            extract(html_content, BASE_URL)
+    return (time.process_time() - started) * 1000 / (repeat * len(pages))
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    repeat = 20
+    if '--repeat' in sys.argv:
+        repeat = int(sys.argv[sys.argv.index('--repeat') + 1])
+        args = [a for a in args if a != str(repeat)]
+    fixtures_dir = args[0] if args else DEFAULT_FIXTURES_DIR
+    paths = sorted(glob.glob(os.path.join(fixtures_dir, "*.html")))
+    if not paths:
+        print(f"Nessuna fixture .html trovata in {fixtures_dir}")
+        sys.exit(1)
+    pages = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            pages.append(f.read())
+    total_kb = sum(len(p) for p in pages) / 1024
+    print(f"{len(pages)} pagine ({total_kb:.0f} KB), {repeat} ripetizioni")
+
+    candidates = [("baseline (3 parsing)", baseline_extract)]
+    candidates += [(name, make_extract(name)) for name in available_extractors()]
+    baseline_links = len(baseline_extract(pages[0], BASE_URL)[1])
+
+    print(f"\n{'estrattore':<22}{'ms/pagina':>12}{'speedup':>10}{'link':>8}")
+    reference = None
+    for label, extract in candidates:
+        ms = cpu_ms_per_page(extract, pages, repeat)
+        reference = reference or ms
+        links = len(extract(pages[0], BASE_URL)[1])
+        print(f"{label:<22}{ms:>12.2f}{reference / ms:>9.1f}x{links:>8}")
+    print(f"\n(link attesi sulla prima pagina: {baseline_links})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark del tempo di avvio dei moduli e dei comandi da linea di comando.
+
+Per ogni modulo misura, in un processo Python nuovo, il tempo di import
+(`-X importtime`, cumulativo) e riporta le dipendenze più costose caricate;
+per ogni comando misura il tempo reale di `--help`.
+
+USO:
+  python benchmarks/bench_startup.py [modulo ...] [--repeat N] [--top N]
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MODULES = [
+    "bot_review", "batch_query", "query_service", "rageval", "llm_as_judge", "extract_queries", "crawler",
+]
+COMMANDS = [
+    ["bot_review.py", "--help"],
+    ["batch_query.py", "--help"],
+    ["query_service.py", "--help"],
+    ["rageval.py", "--help"],
+    ["llm_as_judge.py", "--help"],
+]
+
+
+def import_times(module):
+    """
+    Importa `module` in un processo nuovo e restituisce (totale, {pacchetto: cumulativo})
+    in secondi, dai dati di `-X importtime`.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "errore")
+    total, packages = 0.0, {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        seconds = int(cumulative) / 1e6
+        if name.strip() == module:
+            total = seconds
+        top_level = name.strip().split(".")[0]
+        # Il cumulativo del pacchetto radice include già i sottomoduli
+        if name.strip() == top_level and top_level != module:
+            packages[top_level] = max(packages.get(top_level, 0.0), seconds)
+    return total, packages
+
+
+def command_seconds(command, repeat):
+    """Tempo reale minimo su `repeat` esecuzioni di `python <command>`."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable] + command, cwd=ROOT, capture_output=True)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    repeat, top = 3, 5
+    if '--repeat' in sys.argv:
+        repeat = int(sys.argv[sys.argv.index('--repeat') + 1])
+        args = [a for a in args if a != str(repeat)]
+    if '--top' in sys.argv:
+        top = int(sys.argv[sys.argv.index('--top') + 1])
+        args = [a for a in args if a != str(top)]
+    modules = args or DEFAULT_MODULES
+
+    print("Tempo di import per modulo (processo nuovo, -X importtime)")
+    for module in modules:
+        try:
+            total, packages = import_times(module)
+        except RuntimeError as e:
+            print(f"  {module:<16} non importabile: {e}")
+            continue
+        heaviest = sorted(packages.items(), key=lambda item: -item[1])[:top]
+        detail = ", ".join(f"{name} {seconds * 1000:.0f}" for name, seconds in heaviest)
+        print(f"  {module:<16} {total * 1000:8.0f} ms   ({detail})")
+
+    if not args:
+        print(f"\nTempo reale dei comandi (minimo su {repeat} esecuzioni)")
+        for command in COMMANDS:
+            seconds = command_seconds(command, repeat)
+            print(f"  python {' '.join(command):<28} {seconds * 1000:8.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
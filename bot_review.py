@@ -1,18 +1,19 @@
+import asyncio
 import os
 import re
-import shutil
-import time
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
-from langchain.globals import set_verbose
-set_verbose(True)
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
-from langchain.docstore.document import Document
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
-from langchain_community.vectorstores import FAISS
-from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_community.chat_message_histories import ChatMessageHistory
+# LangChain, Gemini, FAISS e numpy sono importati nelle funzioni che li usano:
+# `--help` e gli script che importano questo modulo partono subito.
+from chain_layers import ainvoke_chain, stream_answer
+from chat_sessions import ChatSessions
+from dedup import collapse_near_duplicates
+from index_manifest import (
+    build_source_entry, chunk_ids, content_hash, group_by_source, load_manifest, new_manifest, plan_update, save_manifest,
+)
 
 # === CONFIG ===
 MARKDOWN_DIR = "output_crawler"
@@ -20,46 +21,43 @@ VECTORSTORE_PATH = "index"
 MODEL_NAME_LLM = "gemini-2.0-flash"
 MODEL_NAME_EMBEDDINGS = "models/embedding-001"
 BATCH_SIZE = 100
-BATCH_WAIT = 2  # secondi
-
-def parse_clean_exams(text):
-    results = {}
-    anno = None
-    tipo = "obbligatori"
-    lines = text.splitlines()
-    for idx, line in enumerate(lines):
-        l = line.strip()
-        if not l:
-            continue
-        # Anno riconosciuto
-        m_anno = re.search(r"(primo|secondo|terzo|1°|2°|3°|first|second|third)[^\w]{0,5}(anno|year)", l, re.I)
-        if m_anno:
-            anno = m_anno.group(0).lower()
-        # Tipo (elective)
-        if any(x in l.lower() for x in ["a scelta", "elective", "opzionali"]):
-            tipo = "a scelta"
-        if any(x in l.lower() for x in ["obbligatori", "required"]):
-            tipo = "obbligatori"
-        # Riga esame pulito
-        m_exam = re.match(r"-\s*([^\|].+?)(\([A-Z\-\/\d]+\))?$", l)
-        if m_exam and not any(xx in m_exam.group(1).lower() for xx in ["credits", "programme", "thesis", "seminar", "cfu", "download"]):
-            key = (anno or "generico", tipo)
-            results.setdefault(key, []).append(m_exam.group(1).strip())
-        # Riga tabella "| Course | nome"
-        if "|" in l and not l.startswith("| ---"):
-            items = [x.strip() for x in l.split("|") if x.strip()]
-            if len(items) >= 2 and not any(xx in items[1].lower() for xx in ["credits", "programme", "download", "thesis", "seminar", "cfu"]):
-                key = (anno or "generico", tipo)
-                if items[1] and len(items[1]) > 3 and not items[1].isdigit():
-                    results.setdefault(key, []).append(items[1])
-    for k in results:
-        seen = set()
-        results[k] = [x for x in results[k] if not (x in seen or seen.add(x))]
-    return results
-
-from langchain.text_splitter import MarkdownHeaderTextSplitter
+FAISS_INDEX_FACTORY = "Flat"  # tipo di indice per faiss.index_factory: "Flat", "HNSW32", "IVF{nlist},PQ32", "SQfp16", "SQ8"
+FAISS_INDEX_DIM = None  # dimensioni dopo la riduzione PCA dentro l'indice (None per disattivare)
+FAISS_TRAIN_SAMPLE = 50_000  # vettori usati per addestrare gli indici IVF/PQ/SQ8/PCA
+FAISS_NPROBE = 16  # liste visitate per query negli indici IVF
+FAISS_HNSW_EF_SEARCH = 64  # ampiezza della ricerca negli indici HNSW
+EMBEDDING_WORKERS = 4  # chiamate di embedding concorrenti durante l'indicizzazione
+EMBEDDING_CACHE_PATH = "cache/embeddings.sqlite"  # None per disattivare il cache
+EMBEDDING_CACHE_MAX_ENTRIES = 200_000
+QUERY_EMBEDDING_MEMO_SIZE = 1024  # vettori di query tenuti in memoria (0 per disattivare)
+ANSWER_CACHE_PATH = "cache/answers.sqlite"  # cache esatto delle risposte su disco (None per disattivare)
+ANSWER_CACHE_MAX_ENTRIES = 10_000
+SEMANTIC_CACHE_THRESHOLD = 0.95  # similarità coseno minima per riusare una risposta, con le stesse entità (None per disattivare)
+SEMANTIC_CACHE_TTL = 24 * 3600  # secondi di validità di una risposta in cache
+SEMANTIC_CACHE_MAX_ENTRIES = 1000
+RETRIEVAL_MODE = "hybrid"  # "hybrid" (BM25 + FAISS), "vector" (solo FAISS) o "lexical" (solo BM25)
+RETRIEVAL_K = 10
+CONTEXT_TOKEN_BUDGET = 6000  # token stimati massimi dei chunk passati al modello (None per disattivare)
+CONTEXT_MAX_CHUNK_TOKENS = 2000  # token stimati massimi di un singolo chunk
+ASYNC_SEARCH_WORKERS = 8  # thread per retrieval e ricerche FAISS delle query asincrone
+MAX_CHAT_SESSIONS = 10_000  # sessioni di chat tenute in memoria da aquery_chatbot
+CHAT_HISTORY_TURNS = 4  # ultimi turni della chat passati al modello testualmente
+CHAT_HISTORY_MAX_TOKENS = 2000  # token stimati massimi della storia nel prompt, riassunto compreso
+CHAT_SUMMARY_MAX_TOKENS = 300  # token stimati massimi del riassunto dei turni più vecchi
+# Riassunto scritto dal modello invece che estrattivo: ogni turno che esce dalla finestra aggiunge
+# una chiamata bloccante al modello, quindi la latenza di un giro in più per quel turno
+CHAT_SUMMARY_WITH_LLM = False
+STRUCTURED_ANSWERS = True  # risponde a domande su esami e catalogo dei corsi dagli indici strutturati, senza LLM
+NEAR_DUPLICATE_MAX_DISTANCE = 0  # bit di SimHash entro cui due chunk sono candidati quasi duplicati (None per disattivare la deduplicazione)
+NEAR_DUPLICATE_MIN_JACCARD = 1.0  # Jaccard minima degli shingle per fondere due candidati (1.0 = solo duplicati esatti)
+
+PAGE_URL_RE = re.compile(r"# Pagina: (\S+)")
 
 def load_and_split_documents():
+    from langchain.docstore.document import Document
+    from langchain.text_splitter import MarkdownHeaderTextSplitter
+    from langchain_community.document_loaders import DirectoryLoader, TextLoader
+
     os.makedirs(MARKDOWN_DIR, exist_ok=True)
     loader = DirectoryLoader(
         MARKDOWN_DIR,
@@ -71,10 +69,16 @@ def load_and_split_documents():
     if not documents:
         print("Nessun documento Markdown trovato.")
         return []
+    # Ordine stabile: tra due quasi duplicati il chunk canonico è sempre lo stesso
+    documents.sort(key=lambda doc: doc.metadata.get("source", ""))
     all_chunks = []
     # Chunking per intestazioni principali Markdown (più robusto)
     splitter = MarkdownHeaderTextSplitter(headers_to_split_on=["#", "##"])
     for doc in documents:
+        # Il crawler scrive l'URL della pagina nella prima riga del file
+        page_url = PAGE_URL_RE.match(doc.page_content)
+        if page_url:
+            doc.metadata["url"] = page_url.group(1).strip()
         try:
             chunks = splitter.split_text(doc.page_content)
             for chunk in chunks:
@@ -83,65 +87,356 @@ def load_and_split_documents():
         except Exception:
             # In caso di problemi fallback: tutto il file in un unico chunk
             all_chunks.append(doc)
+    if NEAR_DUPLICATE_MAX_DISTANCE is not None:
+        all_chunks, removed = collapse_near_duplicates(all_chunks, NEAR_DUPLICATE_MAX_DISTANCE,
+                                                       NEAR_DUPLICATE_MIN_JACCARD)
+        print(f"Chunk duplicati eliminati: {removed}")
     print(f"Totale chunk indicizzati: {len(all_chunks)}")
     return all_chunks
 
 
+_embedding_cache_store = None
+_query_vector_memo = None
+_embedding_cache_lock = threading.Lock()
+
+def make_embedding_model():
+    """Modello di embedding Gemini, senza cache."""
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    return GoogleGenerativeAIEmbeddings(model=MODEL_NAME_EMBEDDINGS)
+
+def make_chat_model(temperature=0.1):
+    """Modello Gemini per le risposte."""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model=MODEL_NAME_LLM, temperature=temperature, convert_system_message_to_human=False)
+
+def get_embeddings():
+    """Modello di embedding Gemini, dietro al LRU delle query e al cache su disco se abilitati."""
+    global _embedding_cache_store, _query_vector_memo
+    embeddings = make_embedding_model()
+    if not EMBEDDING_CACHE_PATH and not QUERY_EMBEDDING_MEMO_SIZE:
+        return embeddings
+    from embedding_cache import CachedEmbeddings, EmbeddingCacheStore, QueryVectorMemo
+    with _embedding_cache_lock:
+        if EMBEDDING_CACHE_PATH and _embedding_cache_store is None:
+            _embedding_cache_store = EmbeddingCacheStore(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES)
+        if QUERY_EMBEDDING_MEMO_SIZE and _query_vector_memo is None:
+            _query_vector_memo = QueryVectorMemo(QUERY_EMBEDDING_MEMO_SIZE)
+    return CachedEmbeddings(embeddings, MODEL_NAME_EMBEDDINGS, _embedding_cache_store, _query_vector_memo)
+
+def load_vectorstore(path=VECTORSTORE_PATH, writable=False):
+    """
+    Apre il vectorstore FAISS salvato in `path`: in sola lettura con l'indice
+    mappato in memoria, o tutto in memoria con `writable=True`.
+    """
+    from faiss_index import set_search_params
+    import vector_storage
+    vectorstore = vector_storage.load_vectorstore(path, get_embeddings(), writable)
+    set_search_params(vectorstore.index, FAISS_NPROBE, FAISS_HNSW_EF_SEARCH)
+    return vectorstore
+
+def embed_chunks(chunks, embeddings):
+    """Embedding parallelo dei chunk; stampa docs/s e vettori/s al termine."""
+    from embedding_pipeline import embed_texts
+    vectors, stats = embed_texts(
+        [chunk.page_content for chunk in chunks], embeddings,
+        batch_size=BATCH_SIZE, workers=EMBEDDING_WORKERS,
+    )
+    seconds = max(stats["seconds"], 1e-9)
+    sources = len(group_by_source(chunks))
+    print(f"Embedding completato in {seconds:.1f}s: {sources / seconds:.1f} docs/s, "
+          f"{stats['vectors'] / seconds:.1f} vettori/s "
+          f"({stats['embedded']} via API, {stats['cached']} dal cache, {stats['throttled']} rate limit)")
+    return vectors
+
+def build_vectorstore(documents, ids, vectors, embeddings):
+    """Costruisce un unico indice FAISS dai vettori già calcolati, senza merge intermedi."""
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    from faiss_index import build_index, index_memory_bytes, set_search_params
+    index, factory = build_index(vectors, FAISS_INDEX_FACTORY, FAISS_INDEX_DIM, FAISS_TRAIN_SAMPLE)
+    set_search_params(index, FAISS_NPROBE, FAISS_HNSW_EF_SEARCH)
+    print(f"Indice FAISS {factory}: {index.ntotal} vettori, {index_memory_bytes(index) / 2**20:.1f} MB")
+    docstore = InMemoryDocstore(dict(zip(ids, documents)))
+    return FAISS(embeddings, index, docstore, dict(enumerate(ids)))
+
 def get_vectorstore(force_recreate=False):
-    embeddings = GoogleGenerativeAIEmbeddings(model=MODEL_NAME_EMBEDDINGS)
+    from vector_storage import save_vectorstore
+    embeddings = get_embeddings()
     if os.path.exists(VECTORSTORE_PATH) and not force_recreate:
         try:
             print("Carico il vectorstore esistente...")
-            return FAISS.load_local(VECTORSTORE_PATH, embeddings, allow_dangerous_deserialization=True)
+            return load_vectorstore()
         except Exception as e:
+            # Nessuna cancellazione: la nuova versione affianca quella illeggibile
             print(f"Errore caricamento vectorstore: {e}, lo rigenero...")
-            shutil.rmtree(VECTORSTORE_PATH)
     documents = load_and_split_documents()
     if not documents:
         print("Nessun documento da indicizzare.")
         return None
-    batches = [documents[i:i+BATCH_SIZE] for i in range(0, len(documents), BATCH_SIZE)]
-    vs = None
-    for i, batch in enumerate(batches):
-        print(f"Indicizzazione batch {i+1}/{len(batches)} ({len(batch)} doc)")
-        batch_vs = FAISS.from_documents(batch, embeddings)
-        if vs is None:
-            vs = batch_vs
-        else:
-            vs.merge_from(batch_vs)
-        if i < len(batches) - 1:
-            print(f"Attendo {BATCH_WAIT} secondi per evitare rate limit...")
-            time.sleep(BATCH_WAIT)
-    if vs is None:
-        print("Errore: vectorstore non creato.")
-        return None
+    ids = [str(uuid.uuid4()) for _ in documents]
+    vectors = embed_chunks(documents, embeddings)
+    vs = build_vectorstore(documents, ids, vectors, embeddings)
     print("Indicizzazione completata, salvo e ritorno il vectorstore!")
-    vs.save_local(VECTORSTORE_PATH)
+    save_vectorstore(vs, VECTORSTORE_PATH)
+    manifest = new_manifest(MODEL_NAME_EMBEDDINGS, FAISS_INDEX_FACTORY, FAISS_INDEX_DIM)
+    ids_by_doc = dict(zip(map(id, documents), ids))
+    for source, chunks in group_by_source(documents).items():
+        manifest["sources"][source] = build_source_entry(chunks, [ids_by_doc[id(c)] for c in chunks])
+    save_manifest(VECTORSTORE_PATH, manifest)
+    save_side_indexes(documents, ids)
+    return vs
+
+def save_side_indexes(documents, ids):
+    """Costruisce e salva accanto all'indice FAISS l'indice BM25 dei chunk, quello degli esami e il catalogo."""
+    from catalog_index import CourseCatalog, catalog_path
+    from exam_index import ExamIndex, exam_index_path
+    from lexical_index import BM25Index, lexical_index_path
+    BM25Index.build(documents, ids).save(lexical_index_path(VECTORSTORE_PATH))
+    print(f"Indice BM25 salvato ({len(documents)} chunk)")
+    exam_index = ExamIndex.build(MARKDOWN_DIR)
+    exam_index.save(exam_index_path(VECTORSTORE_PATH))
+    print(f"Indice esami salvato ({len(exam_index)} corsi)")
+    catalog = CourseCatalog.build(MARKDOWN_DIR)
+    catalog.save(catalog_path(VECTORSTORE_PATH))
+    print(f"Catalogo dei corsi salvato ({len(catalog)} corsi)")
+
+def update_vectorstore():
+    """
+    Aggiorna l'indice in modo incrementale usando il manifest in `VECTORSTORE_PATH`.
+
+    Vengono embeddati solo i chunk nuovi o modificati e rimossi i vettori dei
+    chunk che non esistono più; se manca il manifest, o è stato creato con
+    un altro modello di embedding o un altro tipo di indice FAISS, l'indice
+    viene rigenerato da zero. Gli indici che non supportano la rimozione
+    (HNSW, IVF) vengono compattati ricostruendoli: i vettori dei chunk invariati
+    arrivano dal cache degli embedding.
+    """
+    from vector_storage import save_vectorstore
+    manifest = load_manifest(VECTORSTORE_PATH)
+    if (manifest is None or manifest.get("embedding_model") != MODEL_NAME_EMBEDDINGS
+            or manifest.get("index_factory", "Flat") != FAISS_INDEX_FACTORY
+            or manifest.get("index_dim") != FAISS_INDEX_DIM):
+        print("Manifest dell'indice assente o non compatibile: rigenerazione completa.")
+        return get_vectorstore(force_recreate=True)
+    try:
+        vs = load_vectorstore(writable=True)
+    except Exception as e:
+        print(f"Errore caricamento vectorstore: {e}, lo rigenero...")
+        return get_vectorstore(force_recreate=True)
+
+    documents = load_and_split_documents()
+    to_add, to_delete, sources = plan_update(manifest, documents)
+    print(f"Chunk da aggiungere: {len(to_add)}, da rimuovere: {len(to_delete)}, "
+          f"invariati: {len(documents) - len(to_add)}")
+    if not to_add and not to_delete:
+        print("L'indice è già aggiornato.")
+        from catalog_index import catalog_path
+        from exam_index import exam_index_path
+        from lexical_index import lexical_index_path
+        side_paths = [lexical_index_path(VECTORSTORE_PATH), exam_index_path(VECTORSTORE_PATH),
+                      catalog_path(VECTORSTORE_PATH)]
+        if not all(os.path.exists(path) for path in side_paths):
+            save_side_indexes(documents, chunk_ids(documents, sources))
+        return vs
+
+    if to_delete:
+        from faiss_index import supports_removal
+        if not supports_removal(vs.index):
+            print(f"L'indice {FAISS_INDEX_FACTORY} non supporta la rimozione: compattazione con ricostruzione.")
+            return get_vectorstore(force_recreate=True)
+        # Una sola rimozione: FAISS compatta l'indice in un unico passaggio
+        vs.delete(to_delete)
+    if to_add:
+        chunks = [chunk for _, _, chunk in to_add]
+        new_ids = [str(uuid.uuid4()) for _ in to_add]
+        vectors = embed_chunks(chunks, vs.embedding_function)
+        vs.add_embeddings(
+            zip([chunk.page_content for chunk in chunks], vectors.tolist()),
+            metadatas=[chunk.metadata for chunk in chunks],
+            ids=new_ids,
+        )
+        for (source, position, _), doc_id in zip(to_add, new_ids):
+            sources[source]["chunks"][position]["id"] = doc_id
+
+    save_vectorstore(vs, VECTORSTORE_PATH)
+    manifest["sources"] = sources
+    save_manifest(VECTORSTORE_PATH, manifest)
+    save_side_indexes(documents, chunk_ids(documents, sources))
+    print("Aggiornamento incrementale completato!")
     return vs
 
-def query_chatbot(question, vectorstore=None, chat_history=None, verbose=False):
+class RAGEngine:
+    """
+    Vectorstore e catena RAG caricati una sola volta e riusati tra le query.
+
+    L'indice viene ricaricato solo quando i file in `vectorstore_path` cambiano
+    (nome, dimensione o mtime). Un'istanza può essere condivisa tra thread:
+    il ricaricamento avviene sotto lock e sostituisce la coppia
+    (vectorstore, catena) in un colpo solo, quindi chi ha già ottenuto la
+    coppia precedente continua a usarla senza interferenze.
+
+    La catena è preceduta, nell'ordine, dal cache esatto delle risposte
+    (persistente, con la firma dell'indice nella chiave), dalle risposte
+    deterministiche dell'indice degli esami e del catalogo dei corsi e dal
+    cache semantico, che viene svuotato a ogni ricaricamento dell'indice.
+    """
+
+    def __init__(self, vectorstore_path=VECTORSTORE_PATH):
+        self.vectorstore_path = vectorstore_path
+        self._lock = threading.Lock()
+        self._loaded = None  # (signature, vectorstore, rag_chain)
+        self.answer_cache = None
+        self.exact_cache = None
+
+    def index_signature(self):
+        """Restituisce una firma dei file dell'indice, o None se l'indice non esiste."""
+        try:
+            entries = sorted(os.scandir(self.vectorstore_path), key=lambda e: e.name)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        signature = []
+        for entry in entries:
+            if entry.is_file():
+                st = entry.stat()
+                signature.append((entry.name, st.st_size, st.st_mtime_ns))
+        return tuple(signature) or None
+
+    @staticmethod
+    def index_version(signature):
+        """Versione dell'indice da usare nelle chiavi dei cache persistenti."""
+        return content_hash(repr(signature))
+
+    def cached_answer(self, question):
+        """
+        Risposta già nel cache esatto per `question` senza storia della chat,
+        o None; non chiama né il modello né gli embedding.
+        """
+        self.get()
+        loaded = self._loaded
+        if self.exact_cache is None or loaded is None:
+            return None
+        key = self.exact_cache.make_key(
+            question, [], self.index_version(loaded[0]), MODEL_NAME_LLM, answer_logic_hash()
+        )
+        # Un miss qui è seguito dalla query vera, che lo conta già
+        return self.exact_cache.get(key, record_miss=False)
+
+    def get(self):
+        """
+        Restituisce la coppia (vectorstore, rag_chain), caricandola se necessario.
+
+        Raises:
+            FileNotFoundError: se l'indice non esiste su disco.
+        """
+        signature = self.index_signature()
+        if signature is None:
+            raise FileNotFoundError(f"Nessun vectorstore trovato in {self.vectorstore_path}")
+        loaded = self._loaded
+        if loaded is not None and loaded[0] == signature:
+            return loaded[1], loaded[2]
+        with self._lock:
+            loaded = self._loaded
+            if loaded is None or loaded[0] != signature:
+                from answer_cache import ExactAnswerCache, SemanticAnswerCache
+                from catalog_index import load_catalog
+                from exam_index import load_exam_index
+                from lexical_index import load_lexical_index
+                vectorstore = load_vectorstore(self.vectorstore_path)
+                lexical_index = load_lexical_index(self.vectorstore_path)
+                rag_chain = create_rag_chain(vectorstore, lexical_index)
+                catalog = load_catalog(self.vectorstore_path)
+                exam_index = load_exam_index(self.vectorstore_path)
+                if SEMANTIC_CACHE_THRESHOLD is not None:
+                    # Titoli dei corsi noti: una risposta non viene riusata per un corso diverso
+                    titles = (catalog.columns["name"] if catalog is not None else []) + \
+                        (list(exam_index.courses) if exam_index is not None else [])
+                    if self.answer_cache is None:
+                        self.answer_cache = SemanticAnswerCache(
+                            get_embeddings(), SEMANTIC_CACHE_THRESHOLD,
+                            SEMANTIC_CACHE_TTL, SEMANTIC_CACHE_MAX_ENTRIES,
+                        )
+                    self.answer_cache.set_version(signature, titles)
+                    # Le domande del percorso solo lessicale non pagano l'embedding per il cache;
+                    # per le altre il vettore della query resta nel LRU e il retriever lo riusa
+                    skip = None
+                    if lexical_index is not None and RETRIEVAL_MODE != "vector":
+                        from lexical_index import embedding_free
+                        skip = lambda question: embedding_free(lexical_index, question, RETRIEVAL_MODE)
+                    rag_chain = self.answer_cache.wrap(rag_chain, skip)
+                if STRUCTURED_ANSWERS:
+                    # Prima del cache semantico: non serve l'embedding della domanda
+                    for structured in (catalog, exam_index):
+                        if structured is not None:
+                            rag_chain = structured.wrap(rag_chain)
+                if ANSWER_CACHE_PATH is not None:
+                    if self.exact_cache is None:
+                        self.exact_cache = ExactAnswerCache(ANSWER_CACHE_PATH, ANSWER_CACHE_MAX_ENTRIES)
+                    rag_chain = self.exact_cache.wrap(
+                        rag_chain, self.index_version(signature), MODEL_NAME_LLM, answer_logic_hash()
+                    )
+                loaded = (signature, vectorstore, rag_chain)
+                self._loaded = loaded
+        return loaded[1], loaded[2]
+
+    def invalidate(self):
+        """Forza il ricaricamento dell'indice alla prossima chiamata di get()."""
+        with self._lock:
+            self._loaded = None
+
+def answer_logic_hash():
+    """Hash di prompt e regole delle risposte strutturate, per le chiavi del cache esatto."""
+    from catalog_index import CATALOG_ANSWER_VERSION
+    from exam_index import EXAM_ANSWER_VERSION
+    return content_hash(f"{SYSTEM_PROMPT}\0esami:{EXAM_ANSWER_VERSION}\0catalogo:{CATALOG_ANSWER_VERSION}")
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """Restituisce il RAGEngine condiviso dal processo."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = RAGEngine()
+    return _engine
+
+def print_answer_cache_stats():
+    """Stampa le statistiche dei cache delle risposte attivi."""
+    engine = get_engine()
+    for label, cache in (("esatto", engine.exact_cache), ("semantico", engine.answer_cache)):
+        if cache is None:
+            continue
+        stats = cache.stats()
+        lookups = stats["hits"] + stats["misses"]
+        if lookups:
+            print(f"Cache risposte {label}: {stats['hits']}/{lookups} hit ({stats['hit_rate']:.0%}), {stats['entries']} voci")
+
+def query_chatbot(question, vectorstore=None, chat_history=None, verbose=False, raise_errors=False):
     """
     Query the chatbot with a question.
     
     Args:
         question (str): The question to ask
-        vectorstore: FAISS vectorstore (if None, will try to load existing one)
+        vectorstore: FAISS vectorstore (if None, uses the process-wide RAGEngine)
         chat_history: List of chat history messages (optional)
         verbose (bool): Whether to print debug information
+        raise_errors (bool): Re-raise exceptions instead of returning an error message
         
     Returns:
         str: The bot's answer
     """
     try:
-        # Load vectorstore if not provided
         if vectorstore is None:
-            if not os.path.exists(VECTORSTORE_PATH):
+            # Vectorstore e catena condivisi, caricati una sola volta per processo
+            try:
+                vectorstore, rag_chain = get_engine().get()
+            except FileNotFoundError:
+                if raise_errors:
+                    raise
                 return "Errore: Nessun vectorstore trovato. Eseguire prima l'indicizzazione."
-            embeddings = GoogleGenerativeAIEmbeddings(model=MODEL_NAME_EMBEDDINGS)
-            vectorstore = FAISS.load_local(VECTORSTORE_PATH, embeddings, allow_dangerous_deserialization=True)
-        
-        # Create RAG chain
-        rag_chain = create_rag_chain(vectorstore)
+        else:
+            rag_chain = create_rag_chain(vectorstore)
         
         # Prepare input
         input_data = {
@@ -162,95 +457,230 @@ def query_chatbot(question, vectorstore=None, chat_history=None, verbose=False):
         return answer
         
     except Exception as e:
+        if raise_errors:
+            raise
         error_msg = f"Errore durante l'elaborazione della query: {e}"
         if verbose:
             print(error_msg)
         return error_msg
 
-def create_rag_chain(vectorstore):
-    llm = ChatGoogleGenerativeAI(model=MODEL_NAME_LLM, temperature=0.1, convert_system_message_to_human=False)
-    retriever = vectorstore.as_retriever(search_kwargs={"k": 10})
-    system_prompt = (
-        "Sei un assistente AI dei corsi magistrali Unicattolica"
-        "Quando ti chiedono quali esami ci sono in un corso/curriculum/anno:\n"
-        "- Elenca solo i nomi veri degli esami, divisi per anno e per tipo ('obbligatori', 'a scelta'), senza ripetizioni e senza colonne extra ('credits', 'programme', ecc).\n"
-        "- Rispondi in forma di elenco PULITO: niente markdown, niente tabelle, niente intestazioni inutili.\n"
-        "- Raggruppa sempre per anno e curriculum. Se chiedono solo 'a scelta' o solo 'obbligatori', mostra solo quelli richiesti.\n"
-        "- Se la domanda è sugli sbocchi lavorativi o che lavoro si può fare dopo un corso, cerca una sezione 'sbocchi professionali', altrimenti ragiona sui possibili settori lavorativi basandoti sulle materie presenti.\n"
-        "- Se chiedono un consiglio su quale corso scegliere per una professione, suggerisci almeno 2 corsi pertinenti spiegando perché.\n"
-        "- MAI mostrare output in inglese o tabelle markdown. Solo elenco, in italiano chiaro e ordinato."
-        "Riconosci che curriculum, indirizzi, rami, track, percorsi, profili sono la stessa cosa. "
-        "Se ti chiedono quali esami ha un corso, devi guardare le tabelle nel curriculum corrispondente all'indirizzo che ti viene chiesto. Se non ti viene specificato l'indirizzo/curriculum , chiedilo."
-        "Usa **esclusivamente** le informazioni nei documenti forniti (context)."
-        "Dai priorità ai dati concreti, anche se sono in piccole parti dei documenti."
-        "Se trovi risposte in tabelle o elenchi, estrai e mostra la lista."
-        "Quando il context contiene tabelle o elenchi di esami, mostra la lista esattamente come presente nei documenti, indicando anno/curriculum/corso. "
-        "Quando chiedono 'quanti esami' conta il numero di esami (una riga per ciascun esame in tabella o elenco puntato '-'). Trovi queste info nel file elenco_magistrali.md nella cartella output1. "
-        "I corsi sia in italiano sia in inglese hanno scritto 'Italiano English'."
-        "Quando chiedono 'quali esami', mostra la tabella esami. Trovi queste info nel file elenco_magistrali.md nella cartella output1. "
-        "Rispondi in italiano semplice, spiega i termini tecnici se servono. "
-        "Capisci e rispondi a domande con sinonimi (esami/materie/rami/indirizzi/curriculum/specializzazioni/tracks/profili). "
-        "Non dire mai che non lo sai: se puoi, mostra comunque ciò che hai trovato, anche solo parzialmente. "
-        "Sei un assistente AI progettato per aiutare studenti e persone esterne a comprendere informazioni sull’Università Cattolica. "
-        "Quando nei documenti compaiono indirizzi o sedi specifiche, indicale sempre come risposta, anche se la domanda non chiede esplicitamente l’indirizzo. "
-        "Dai sempre priorità ai dati concreti trovati nel testo, anche se appaiono in piccole parti dei documenti. "
-        "Ignora eventuali errori ortografici e interpreta sempre il senso generale della domanda. "
-        "Se trovi risposte in tabelle o elenchi, estrai puntualmente la lista. "
-        "Non dire mai che non hai trovato la risposta se anche solo una parte della risposta è presente nei documenti. "
-        "Se la domanda è generica, chiedi gentilmente di specificare meglio. "
-        "Capisci e rispondi a domande poste in modo informale, con errori di scrittura, parafrasi, esempi, abbreviazioni o sinonimi, come farebbe uno studente inesperto o una persona esterna. "
-        "Quando trovi dati tabellari, spiegali sempre a parole. "
-        "Se ci sono immagini descritte, riporta sempre la descrizione. "
-        "Se trovi parole tecniche, spiega il significato in modo semplice e adatto a chi non conosce il mondo universitario. "
-        "Se nella domanda si fa riferimento a tabelle, dati o immagini, descrivi il contenuto in modo semplice e immediato. "
-        "Rispondi SEMPRE in italiano chiaro e semplice, anche usando esempi pratici. "
-        "Distingui bene tra primo/secondo/terzo anno e curriculum (ramo/indirizzo). "
-        "Quando ti chiedono quali e quanti corsi sono in inglese/italiano, guarda il campo 'lingua/language' presente in ogni pagina del corso specificato o in elenco_magistrale.md alla fine di ogni riga del corso. "
-        "Attenzione: alcuni corsi sono sia in italiano sia in inglese, e alla fine della riga in elenco_magistrale.,md c'è scritto 'Italiano English', devi riportare anche questi se ti vengono chiesti quali e quanti corsi sono in inglese/italiano."
-        "Se la domanda riguarda l’elenco dei corsi magistrali (anche per lingua), rispondi leggendo il file ‘elenco_magistrali.md’ senza chiedere di specificare altro. Se la domanda è generica, mostra comunque tutti i corsi disponibili per la lingua richiesta."
-        "Quando qualcuno ti chiede quali esami ci sono in un certo corso (o curriculum, indirizzo, ramo, percorso) tu devi guardare il curriculum ed elencare quella tabella."
-        "Quando il context contiene tabelle o elenchi di esami, estrai e mostra la lista esattamente come presente nei documenti, indicando anno/curriculum/corso. Se sono presenti più alternative (es: esami a scelta), indicale chiaramente."
-        "Se ti chiedono quali esami ci sono in un certo anno scolastico, tu rispondi guardando il curriculum dell'anno richiesto (primo, secondo o terzo). "
-        "Fai attenzione al terzo anno perché potrebbe avere diversi curriculum, lo trovi nel piano di studi. "
-        "Se la domanda riguarda un anno o un curriculum specifico, mostra solo gli esami dell’anno/curriculum richiesto. "
-        "Quando ti chiedono curriculum, indirizzi, rami, percorsi, profili o track considerali sinonimi. "
-        "Se ti chiedono quanti esami ci sono in un corso (o curriculum, indirizzo, ramo) conta TUTTI gli esami trovati anche fuori dalle tabelle. Se non c’è una lista completa, conta ogni elemento che sembra un esame in tutto il documento (tabelle, elenchi, testo), senza mai rispondere che il dato non è presente."
-        "Quando ti chiedono quanti esami sono obbligatori o a scelta, se riesci cerca di distinguere. Se non si capisce, mostra comunque il conteggio totale e spiega eventuali limiti."
-        "Rispondi solo sui dati presenti nei documenti (context). "
-        "Curriculum/indirizzo/ramo/track/specializzazione = sinonimi. "
-        "Dai sempre elenchi, conteggi, dettagli tabelle. "
-        "Indica sempre sede/facoltà/lingua/campus se ci sono. "
-        "Quando chiedono 'quanti' conta, quando 'quali' mostra lista, filtra per anno/indirizzo. "
-        "Rispondi in italiano semplice, anche con esempi. "
-        "Non dire mai 'non lo so': mostra sempre ciò che hai trovato, anche parziale. "
-        "Se il corso richiesto non è presente nei dati, cerca e mostra la risposta riferita al corso col nome più simile (usando fuzzy match), avvisando sempre l’utente. "
-        "Per domande su professioni, consiglia i corsi con più esami e argomenti pertinenti, spiegando con un breve ragionamento. "
-        "Non limitarti mai a dire “non trovato”: se trovi anche solo esami simili o curriculum affini, mostra l’elenco e spiega che il consiglio si basa su questo."
-        "Quando qualcuno ti chiede quale corso seguire per poter fare un certo lavoro, cerca nei vari sbocchi professionali dei corsi, e se non c'è ragiona sulla risposta in base agli esami di ogni corso più attinenti al lavoro in questione richiesto nella domanda. "
-        "Se la domanda riguarda la possibilità di svolgere uno stage, un lavoro o una professione con una certa laurea, e nei documenti non c’è una risposta esatta, allora analizza le materie e le competenze indicate nel corso (esami, curriculum, sbocchi professionali). Se il corso tratta materie di economia, gestione, contabilità, o simili, spiega che in generale con competenze economiche si può lavorare anche nell’ambito contabile/burocratico di settori diversi (es. farmacia, azienda, enti pubblici). Spiega in modo trasparente che la risposta è dedotta sulla base del profilo del corso, non è una garanzia formale. Se possibile, suggerisci di verificare sempre presso l’ente/azienda di interesse o l’ufficio stage."
-        "\n<context>\n{context}\n</context>"
-    )
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", system_prompt),
-        MessagesPlaceholder(variable_name="chat_history"),
-        ("human", "{input}"),
-    ])
-    question_answer_chain = create_stuff_documents_chain(llm, prompt)
-    def custom_chain(input):
+SYSTEM_PROMPT = (
+    "Sei un assistente AI dei corsi magistrali Unicattolica"
+    "Quando ti chiedono quali esami ci sono in un corso/curriculum/anno:\n"
+    "- Elenca solo i nomi veri degli esami, divisi per anno e per tipo ('obbligatori', 'a scelta'), senza ripetizioni e senza colonne extra ('credits', 'programme', ecc).\n"
+    "- Rispondi in forma di elenco PULITO: niente markdown, niente tabelle, niente intestazioni inutili.\n"
+    "- Raggruppa sempre per anno e curriculum. Se chiedono solo 'a scelta' o solo 'obbligatori', mostra solo quelli richiesti.\n"
+    "- Se la domanda è sugli sbocchi lavorativi o che lavoro si può fare dopo un corso, cerca una sezione 'sbocchi professionali', altrimenti ragiona sui possibili settori lavorativi basandoti sulle materie presenti.\n"
+    "- Se chiedono un consiglio su quale corso scegliere per una professione, suggerisci almeno 2 corsi pertinenti spiegando perché.\n"
+    "- MAI mostrare output in inglese o tabelle markdown. Solo elenco, in italiano chiaro e ordinato."
+    "Riconosci che curriculum, indirizzi, rami, track, percorsi, profili sono la stessa cosa. "
+    "Se ti chiedono quali esami ha un corso, devi guardare le tabelle nel curriculum corrispondente all'indirizzo che ti viene chiesto. Se non ti viene specificato l'indirizzo/curriculum , chiedilo."
+    "Usa **esclusivamente** le informazioni nei documenti forniti (context)."
+    "Dai priorità ai dati concreti, anche se sono in piccole parti dei documenti."
+    "Se trovi risposte in tabelle o elenchi, estrai e mostra la lista."
+    "Quando il context contiene tabelle o elenchi di esami, mostra la lista esattamente come presente nei documenti, indicando anno/curriculum/corso. "
+    "Quando chiedono 'quanti esami' conta il numero di esami (una riga per ciascun esame in tabella o elenco puntato '-'). Trovi queste info nel file elenco_magistrali.md nella cartella output1. "
+    "I corsi sia in italiano sia in inglese hanno scritto 'Italiano English'."
+    "Quando chiedono 'quali esami', mostra la tabella esami. Trovi queste info nel file elenco_magistrali.md nella cartella output1. "
+    "Rispondi in italiano semplice, spiega i termini tecnici se servono. "
+    "Capisci e rispondi a domande con sinonimi (esami/materie/rami/indirizzi/curriculum/specializzazioni/tracks/profili). "
+    "Non dire mai che non lo sai: se puoi, mostra comunque ciò che hai trovato, anche solo parzialmente. "
+    "Sei un assistente AI progettato per aiutare studenti e persone esterne a comprendere informazioni sull’Università Cattolica. "
+    "Quando nei documenti compaiono indirizzi o sedi specifiche, indicale sempre come risposta, anche se la domanda non chiede esplicitamente l’indirizzo. "
+    "Dai sempre priorità ai dati concreti trovati nel testo, anche se appaiono in piccole parti dei documenti. "
+    "Ignora eventuali errori ortografici e interpreta sempre il senso generale della domanda. "
+    "Se trovi risposte in tabelle o elenchi, estrai puntualmente la lista. "
+    "Non dire mai che non hai trovato la risposta se anche solo una parte della risposta è presente nei documenti. "
+    "Se la domanda è generica, chiedi gentilmente di specificare meglio. "
+    "Capisci e rispondi a domande poste in modo informale, con errori di scrittura, parafrasi, esempi, abbreviazioni o sinonimi, come farebbe uno studente inesperto o una persona esterna. "
+    "Quando trovi dati tabellari, spiegali sempre a parole. "
+    "Se ci sono immagini descritte, riporta sempre la descrizione. "
+    "Se trovi parole tecniche, spiega il significato in modo semplice e adatto a chi non conosce il mondo universitario. "
+    "Se nella domanda si fa riferimento a tabelle, dati o immagini, descrivi il contenuto in modo semplice e immediato. "
+    "Rispondi SEMPRE in italiano chiaro e semplice, anche usando esempi pratici. "
+    "Distingui bene tra primo/secondo/terzo anno e curriculum (ramo/indirizzo). "
+    "Quando ti chiedono quali e quanti corsi sono in inglese/italiano, guarda il campo 'lingua/language' presente in ogni pagina del corso specificato o in elenco_magistrale.md alla fine di ogni riga del corso. "
+    "Attenzione: alcuni corsi sono sia in italiano sia in inglese, e alla fine della riga in elenco_magistrale.,md c'è scritto 'Italiano English', devi riportare anche questi se ti vengono chiesti quali e quanti corsi sono in inglese/italiano."
+    "Se la domanda riguarda l’elenco dei corsi magistrali (anche per lingua), rispondi leggendo il file ‘elenco_magistrali.md’ senza chiedere di specificare altro. Se la domanda è generica, mostra comunque tutti i corsi disponibili per la lingua richiesta."
+    "Quando qualcuno ti chiede quali esami ci sono in un certo corso (o curriculum, indirizzo, ramo, percorso) tu devi guardare il curriculum ed elencare quella tabella."
+    "Quando il context contiene tabelle o elenchi di esami, estrai e mostra la lista esattamente come presente nei documenti, indicando anno/curriculum/corso. Se sono presenti più alternative (es: esami a scelta), indicale chiaramente."
+    "Se ti chiedono quali esami ci sono in un certo anno scolastico, tu rispondi guardando il curriculum dell'anno richiesto (primo, secondo o terzo). "
+    "Fai attenzione al terzo anno perché potrebbe avere diversi curriculum, lo trovi nel piano di studi. "
+    "Se la domanda riguarda un anno o un curriculum specifico, mostra solo gli esami dell’anno/curriculum richiesto. "
+    "Quando ti chiedono curriculum, indirizzi, rami, percorsi, profili o track considerali sinonimi. "
+    "Se ti chiedono quanti esami ci sono in un corso (o curriculum, indirizzo, ramo) conta TUTTI gli esami trovati anche fuori dalle tabelle. Se non c’è una lista completa, conta ogni elemento che sembra un esame in tutto il documento (tabelle, elenchi, testo), senza mai rispondere che il dato non è presente."
+    "Quando ti chiedono quanti esami sono obbligatori o a scelta, se riesci cerca di distinguere. Se non si capisce, mostra comunque il conteggio totale e spiega eventuali limiti."
+    "Rispondi solo sui dati presenti nei documenti (context). "
+    "Curriculum/indirizzo/ramo/track/specializzazione = sinonimi. "
+    "Dai sempre elenchi, conteggi, dettagli tabelle. "
+    "Indica sempre sede/facoltà/lingua/campus se ci sono. "
+    "Quando chiedono 'quanti' conta, quando 'quali' mostra lista, filtra per anno/indirizzo. "
+    "Rispondi in italiano semplice, anche con esempi. "
+    "Non dire mai 'non lo so': mostra sempre ciò che hai trovato, anche parziale. "
+    "Se il corso richiesto non è presente nei dati, cerca e mostra la risposta riferita al corso col nome più simile (usando fuzzy match), avvisando sempre l’utente. "
+    "Per domande su professioni, consiglia i corsi con più esami e argomenti pertinenti, spiegando con un breve ragionamento. "
+    "Non limitarti mai a dire “non trovato”: se trovi anche solo esami simili o curriculum affini, mostra l’elenco e spiega che il consiglio si basa su questo."
+    "Quando qualcuno ti chiede quale corso seguire per poter fare un certo lavoro, cerca nei vari sbocchi professionali dei corsi, e se non c'è ragiona sulla risposta in base agli esami di ogni corso più attinenti al lavoro in questione richiesto nella domanda. "
+    "Se la domanda riguarda la possibilità di svolgere uno stage, un lavoro o una professione con una certa laurea, e nei documenti non c’è una risposta esatta, allora analizza le materie e le competenze indicate nel corso (esami, curriculum, sbocchi professionali). Se il corso tratta materie di economia, gestione, contabilità, o simili, spiega che in generale con competenze economiche si può lavorare anche nell’ambito contabile/burocratico di settori diversi (es. farmacia, azienda, enti pubblici). Spiega in modo trasparente che la risposta è dedotta sulla base del profilo del corso, non è una garanzia formale. Se possibile, suggerisci di verificare sempre presso l’ente/azienda di interesse o l’ufficio stage."
+    "\n<context>\n{context}\n</context>"
+)
+
+class RAGChain:
+    """
+    Catena RAG: retrieval, impacchettamento del contesto e generazione.
+
+    `chain(input)` restituisce {"answer": ...}; `chain.stream(input)` produce
+    i pezzi della risposta man mano che il modello li genera.
+    """
+
+    def __init__(self, retriever, question_answer_chain):
+        self.retriever = retriever
+        self.question_answer_chain = question_answer_chain
+
+    def _chain_input(self, input):
         query = input["input"]
         chat_history = input.get("chat_history", [])
-        docs = retriever.invoke(query)
+        docs = self.retriever.invoke(query)
+        if CONTEXT_TOKEN_BUDGET is not None:
+            from context_packer import pack_context
+            docs, packing = pack_context(docs, query, CONTEXT_TOKEN_BUDGET, CONTEXT_MAX_CHUNK_TOKENS)
         print(query)
         print("invoking Mr. Google..")
         for i, doc in enumerate(docs):
             print("*", doc.metadata["source"])
-        output = question_answer_chain.invoke({"input": query, "context": docs, "chat_history": chat_history})
-        
+        if CONTEXT_TOKEN_BUDGET is not None:
+            print(f"contesto: {packing['packed']}/{packing['retrieved']} chunk, ~{packing['tokens']} token "
+                  f"({packing['duplicates']} duplicati, {packing['trimmed']} accorciati, {packing['dropped']} esclusi)")
+        return {"input": query, "context": docs, "chat_history": chat_history}
+
+    def __call__(self, input):
+        output = self.question_answer_chain.invoke(self._chain_input(input))
         if isinstance(output, dict):
             return output
         else:
             return {"answer": output}
-    return custom_chain
+
+    def stream(self, input):
+        for chunk in self.question_answer_chain.stream(self._chain_input(input)):
+            if chunk:
+                yield chunk
+
+    async def ainvoke(self, input):
+        # Retrieval e ricerca FAISS sono sincroni: girano nel pool dedicato
+        loop = asyncio.get_running_loop()
+        chain_input = await loop.run_in_executor(get_search_executor(), self._chain_input, input)
+        output = await self.question_answer_chain.ainvoke(chain_input)
+        if isinstance(output, dict):
+            return output
+        return {"answer": output}
+
+_search_executor = None
+_search_executor_lock = threading.Lock()
+
+def get_search_executor():
+    """Pool di thread condiviso per il retrieval delle query asincrone."""
+    global _search_executor
+    if _search_executor is None:
+        with _search_executor_lock:
+            if _search_executor is None:
+                _search_executor = ThreadPoolExecutor(max_workers=ASYNC_SEARCH_WORKERS, thread_name_prefix="faiss-search")
+    return _search_executor
+
+def new_chat_history():
+    """Storia della chat limitata a finestra, riassunto e budget di token configurati."""
+    from chat_history import BoundedChatHistory, llm_summarizer
+    summarizer = None
+    if CHAT_SUMMARY_WITH_LLM:
+        summarizer = llm_summarizer(make_chat_model(temperature=0))
+    return BoundedChatHistory(CHAT_HISTORY_TURNS, CHAT_HISTORY_MAX_TOKENS, CHAT_SUMMARY_MAX_TOKENS, summarizer)
+
+_chat_sessions = ChatSessions(MAX_CHAT_SESSIONS, history_factory=new_chat_history)
+
+async def aquery_chatbot(question, session_id=None, chat_history=None, verbose=False, raise_errors=False):
+    """
+    Versione asincrona di query_chatbot, per server basati su event loop.
+
+    Con `session_id` la storia della chat è quella della sessione (creata
+    al primo uso) e la risposta viene aggiunta alla storia; i turni della
+    stessa sessione sono serializzati, sessioni diverse procedono in
+    parallelo sullo stesso indice caricato.
+
+    Args:
+        question (str): The question to ask
+        session_id (str): Conversation id (optional)
+        chat_history: List of chat history messages, used when session_id is None
+        verbose (bool): Whether to print debug information
+        raise_errors (bool): Re-raise exceptions instead of returning an error message
+
+    Returns:
+        str: The bot's answer
+    """
+    try:
+        try:
+            _, rag_chain = await asyncio.to_thread(get_engine().get)
+        except FileNotFoundError:
+            if raise_errors:
+                raise
+            return "Errore: Nessun vectorstore trovato. Eseguire prima l'indicizzazione."
+        if verbose:
+            print(f"Query [{session_id}]: {question}")
+        if session_id is None:
+            response = await ainvoke_chain(rag_chain, {"input": question, "chat_history": chat_history or []})
+            answer = response.get("answer", "Non ho trovato una risposta.")
+        else:
+            history, lock = _chat_sessions.get(session_id)
+            async with lock:
+                response = await ainvoke_chain(rag_chain, {"input": question, "chat_history": history.messages})
+                answer = response.get("answer", "Non ho trovato una risposta.")
+                history.add_user_message(question)
+                # Con CHAT_SUMMARY_WITH_LLM la compattazione chiama il modello in modo
+                # bloccante: va eseguita fuori dall'event loop
+                await asyncio.to_thread(history.add_ai_message, answer)
+        if verbose:
+            print(f"Answer: {answer}")
+        return answer
+    except Exception as e:
+        if raise_errors:
+            raise
+        error_msg = f"Errore durante l'elaborazione della query: {e}"
+        if verbose:
+            print(error_msg)
+        return error_msg
+
+def create_rag_chain(vectorstore, lexical_index=None):
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+    from langchain.globals import set_verbose
+    from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from lexical_index import HybridRetriever
+
+    set_verbose(True)
+    llm = make_chat_model()
+    if RETRIEVAL_MODE == "vector" or lexical_index is None:
+        retriever = vectorstore.as_retriever(search_kwargs={"k": RETRIEVAL_K})
+    else:
+        retriever = HybridRetriever(vectorstore, lexical_index, k=RETRIEVAL_K, mode=RETRIEVAL_MODE)
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", SYSTEM_PROMPT),
+        MessagesPlaceholder(variable_name="chat_history"),
+        ("human", "{input}"),
+    ])
+    question_answer_chain = create_stuff_documents_chain(llm, prompt)
+    return RAGChain(retriever, question_answer_chain)
+
+def print_streamed_answer(rag_chain, input):
+    """Stampa la risposta man mano che arriva e la restituisce completa."""
+    parts = []
+    for piece in stream_answer(rag_chain, input):
+        if not parts:
+            print("Chatbot: ", end="", flush=True)
+        parts.append(piece)
+        print(piece, end="", flush=True)
+    answer = "".join(parts)
+    if not answer:
+        answer = "Non ho trovato una risposta."
+        print(f"Chatbot: {answer}", end="")
+    print("\n")
+    return answer
 
 def run_interactive_chat():
     """Avvia la modalità chat interattiva senza prompt di configurazione."""
@@ -263,20 +693,17 @@ def run_interactive_chat():
         return
     
     try:
-        embeddings = GoogleGenerativeAIEmbeddings(model=MODEL_NAME_EMBEDDINGS)
-        vectorstore = FAISS.load_local(VECTORSTORE_PATH, embeddings, allow_dangerous_deserialization=True)
+        vectorstore, rag_chain = get_engine().get()
         print("Vectorstore caricato con successo!")
     except Exception as e:
         print(f"Errore nel caricamento del vectorstore: {e}")
         return
     
-    # Create RAG chain
-    rag_chain = create_rag_chain(vectorstore)
     if rag_chain is None:
         print("Errore interno: la catena RAG non è inizializzata!")
         return
     
-    chat_history = ChatMessageHistory()
+    chat_history = new_chat_history()
     
     print("\nChatbot pronta. Scrivi 'esci' per terminare.")
     print("----------------------------------------------------")
@@ -290,9 +717,7 @@ def run_interactive_chat():
                 continue
             
             print("Chatbot: Sto pensando...")
-            response = rag_chain({"input": query, "chat_history": chat_history.messages})
-            answer = response.get("answer", "Non ho trovato una risposta.")
-            print(f"Chatbot: {answer}\n")
+            answer = print_streamed_answer(rag_chain, {"input": query, "chat_history": chat_history.messages})
             chat_history.add_user_message(query)
             chat_history.add_ai_message(answer)
         except KeyboardInterrupt:
@@ -301,18 +726,23 @@ def run_interactive_chat():
         except Exception as e:
             print(f"Errore: {e}")
         print("----------------------------------------------------")
+    print_answer_cache_stats()
 
 def main_chat():
     import sys
     
     # Check for parameters
     index_only = '--index_only' in sys.argv
+    full_rebuild = '--full_rebuild' in sys.argv
     interactive = '--interactive' in sys.argv
     
     if index_only:
         print("Modalità solo indicizzazione attivata.")
         print("Creazione/aggiornamento del vectorstore...")
-        vectorstore = get_vectorstore(force_recreate=True)
+        if full_rebuild:
+            vectorstore = get_vectorstore(force_recreate=True)
+        else:
+            vectorstore = update_vectorstore()
         if vectorstore:
             print("Indicizzazione completata con successo!")
         else:
@@ -357,7 +787,7 @@ def main_chat():
     else:
         rag_chain = None
 
-    chat_history = ChatMessageHistory()
+    chat_history = new_chat_history()
 
     print("\nChatbot pronta. Scrivi 'esci' per terminare.")
     if not enable_indexing:
@@ -377,9 +807,7 @@ def main_chat():
                 print("Chatbot: Per abilitare le risposte, riavvia il bot e abilita l'indicizzazione.")
             else:
                 print("Chatbot: Sto pensando...")
-                response = rag_chain({"input": query, "chat_history": chat_history.messages})
-                answer = response.get("answer", "Non ho trovato una risposta.")
-                print(f"Chatbot: {answer}\n")
+                answer = print_streamed_answer(rag_chain, {"input": query, "chat_history": chat_history.messages})
                 chat_history.add_user_message(query)
                 chat_history.add_ai_message(answer)
         except Exception as e:
@@ -399,12 +827,14 @@ if __name__ == "__main__":
         print("  python bot_review.py                    # Modalità configurazione guidata")
         print("  python bot_review.py --interactive      # Chat diretto (richiede vectorstore)")
         print("  python bot_review.py --index_only       # Solo indicizzazione (senza chat)")
+        print("  python bot_review.py --index_only --full_rebuild  # Rigenera tutto l'indice")
         print("  python bot_review.py --help             # Mostra questo aiuto")
         print("\nPARAMETRI:")
         print("  --interactive   Avvia direttamente il chat senza prompt di configurazione")
         print("                  Richiede un vectorstore già esistente")
         print("  --index_only    Crea/aggiorna solo il vectorstore senza avviare il chat")
-        print("                  Forza la rigenerazione completa dell'indice")
+        print("                  Embedda solo i chunk nuovi o modificati (vedi index/manifest.json)")
+        print("  --full_rebuild  Con --index_only, rigenera l'indice da zero")
         print("  --help, -h      Mostra questo messaggio di aiuto")
         print("\nFILE DI CONFIGURAZIONE:")
         print(f"  📁 Documenti markdown: {MARKDOWN_DIR}/")
@@ -0,0 +1,344 @@
+"""
+Catalogo dei corsi magistrali materializzato in fase di indicizzazione.
+
+Il catalogo è ricavato dalle tabelle delle pagine di elenco dei corsi
+(colonne corso, sede, lingua, facoltà, durata, doppio titolo) e completato
+con i campi "**Sede:** ..." delle singole pagine di corso. È salvato per
+colonne in `index/catalog.json`. Le domande di elenco e conteggio in forma
+esplicita ("quali corsi ci sono in inglese", "quanti corsi a Piacenza") e
+quelle su un attributo di un corso ("in che lingua è il corso X", "dove si
+tiene X") ricevono una risposta deterministica senza retrieval né LLM. Le
+richieste di consiglio o sugli sbocchi proseguono nella catena RAG anche
+quando citano lingue, sedi o corsi.
+"""
+
+import glob
+import json
+import os
+import re
+import unicodedata
+
+from chain_layers import LayeredChain
+from lexical_index import match_title, page_title
+
+CATALOG_FILENAME = "catalog.json"
+CATALOG_VERSION = 1
+CATALOG_ANSWER_VERSION = 3  # versione delle regole di risposta, nella chiave del cache esatto
+COLUMNS = ("name", "campus", "language", "faculty", "duration", "double_degree", "source")
+
+# Intestazioni di tabella ed etichette "**Etichetta:**" riconosciute per ogni colonna,
+# in minuscolo e senza accenti
+_HEADER_COLUMNS = {
+    "corso": "name", "corsi": "name", "course": "name", "nome": "name", "corso di laurea": "name",
+    "sede": "campus", "sedi": "campus", "campus": "campus", "citta": "campus",
+    "lingua": "language", "language": "language", "lingue": "language",
+    "facolta": "faculty", "faculty": "faculty",
+    "durata": "duration", "duration": "duration",
+    "doppio titolo": "double_degree", "double degree": "double_degree", "doppia laurea": "double_degree",
+}
+_LANGUAGES = {"italiano": "italiano", "italian": "italiano", "inglese": "inglese", "english": "inglese"}
+_FIELD_RE = re.compile(r"^\*\*([^*:]+):?\*\*:?\s*(.+)$")
+_DOUBLE_DEGREE_RE = re.compile(r"doppio titolo|double degree|doppia laurea", re.I)
+_YES_VALUES = {"si", "sì", "yes", "x", "✓", "✔", "true"}
+
+_COURSE_WORD_RE = re.compile(r"\bcors[oi]\b", re.I)
+_COURSES_RE = re.compile(r"\bcorsi\b", re.I)
+_COUNT_RE = re.compile(r"\b(quanti|quante|numero)\b", re.I)
+# Forme esplicite di elenco: "quali sono i corsi ...", "quali corsi ci sono/sono ...", "elenca i corsi"
+_LIST_RE = re.compile(
+    r"\bquali\s+sono\s+(tutti\s+)?i\s+corsi\b"
+    r"|\bquali\s+corsi\b.*\b(ci sono|sono|esistono|si tengono|si svolgono)\b"
+    r"|\b(elenca|elenco|lista|mostra)\b.{0,20}\bcorsi\b", re.I
+)
+# Richieste di consiglio o sugli sbocchi: servono ragionamento e contesto, risponde la catena RAG
+_ADVISORY_RE = re.compile(
+    r"\b(consigl\w*|lavor\w*|sbocch\w*|carriera|professione|diventare|fare il|fare la|conviene|meglio|"
+    r"adatt\w*|dovrei|posso|potrei)\b", re.I
+)
+# Domande su altro che citano un corso, una lingua o una sede (costi, accesso, requisiti,
+# studenti, ...): il catalogo non ha la risposta, risponde la catena RAG
+_OTHER_CATALOG_TOPIC_RE = re.compile(
+    r"\b(cost\w*|tass[ae]|rett[ae]|prezz\w*|pag\w*|borse?|accede\w*|accesso|ammission\w*|ammess\w*|requisit\w*|"
+    r"test|bando|scadenz\w*|iscri\w*|immatricol\w*|student\w*|iscritti|docent\w*|professor\w*|orari\w*|"
+    r"lezion\w*|frequen\w*|stage|tirocin\w*|alloggi\w*|come|quando|perch[eé])\b", re.I
+)
+# "sia in italiano che in inglese", "in entrambe le lingue": le lingue vanno richieste tutte insieme
+_BOTH_RE = re.compile(r"\bsia\b.+\b(che|sia)\b|\bentramb[ei]\b", re.I)
+_ALL_RE = re.compile(r"\b(tutti|attivi|disponibili|offerti)\b", re.I)
+_EXAM_RE = re.compile(r"\b(esami|esame|exams?|insegnamenti|materie)\b", re.I)
+_ATTRIBUTE_RES = {
+    "language": re.compile(
+        r"\b(in (che|quale|quali) lingu[ae]|lingua|lingue)\b"
+        r"|\b(è|e'|viene (erogato|insegnato)|si svolge|tenuto|taught) in (inglese|italiano|english)\b", re.I
+    ),
+    "campus": re.compile(
+        r"\bdove si (svolge|tiene|trova)\b|\bin (che|quale|quali) sed[ei]\b|\b(la|le) sed[ei] del\b"
+        r"|\b(qual è|quale è|qual e) la sede\b", re.I
+    ),
+    "duration": re.compile(r"\b(durata|dura|quanti anni)\b", re.I),
+    "faculty": re.compile(r"\bfacoltà\b", re.I),
+    "double_degree": _DOUBLE_DEGREE_RE,
+}
+
+
+def _fold(text):
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in text if not unicodedata.combining(c)).lower().strip()
+
+
+def _split_values(value):
+    return [v.strip() for v in re.split(r",|/|;|\be\b|\band\b", value) if v.strip()]
+
+
+def parse_languages(value):
+    """Lingue di un campo testuale ("Italiano English") come lista normalizzata."""
+    found = []
+    for token in re.findall(r"\w+", _fold(value)):
+        language = _LANGUAGES.get(token)
+        if language and language not in found:
+            found.append(language)
+    return found
+
+
+def _cell_value(column, value):
+    if column == "language":
+        return parse_languages(value)
+    if column == "campus":
+        return _split_values(value)
+    if column == "double_degree":
+        return _fold(value) in _YES_VALUES or bool(_DOUBLE_DEGREE_RE.search(value))
+    return value.strip()
+
+
+def parse_listing_tables(text):
+    """Righe delle tabelle di elenco dei corsi come lista di dict colonna → valore."""
+    rows = []
+    lines = [line.strip() for line in text.splitlines()]
+    columns = None
+    for idx, line in enumerate(lines):
+        if not line.startswith("|"):
+            columns = None
+            continue
+        if line.startswith("| ---"):
+            continue
+        cells = [cell.strip() for cell in line.strip("|").split("|")]
+        next_line = lines[idx + 1] if idx + 1 < len(lines) else ""
+        if next_line.startswith("| ---"):
+            mapped = [_HEADER_COLUMNS.get(_fold(cell).rstrip(":")) for cell in cells]
+            # Tabella di elenco: colonna del nome più almeno un'altra colonna nota
+            columns = mapped if "name" in mapped and len(set(mapped) - {None}) >= 2 else None
+            continue
+        if columns is None:
+            continue
+        row = {}
+        for column, cell in zip(columns, cells):
+            if column and cell:
+                row[column] = _cell_value(column, re.sub(r"\[([^\]]*)\]\([^)]*\)", r"\1", cell))
+        if row.get("name"):
+            rows.append(row)
+    return rows
+
+
+def parse_course_fields(text):
+    """Campi "**Etichetta:** valore" di una pagina di corso."""
+    fields = {}
+    for line in text.splitlines():
+        match = _FIELD_RE.match(line.strip())
+        if not match:
+            continue
+        column = _HEADER_COLUMNS.get(_fold(match.group(1)))
+        if column and column != "name" and column not in fields:
+            fields[column] = _cell_value(column, match.group(2))
+    return fields
+
+
+def catalog_path(vectorstore_path):
+    return os.path.join(vectorstore_path, CATALOG_FILENAME)
+
+
+class CourseCatalog:
+    """Catalogo per colonne: ogni colonna è una lista allineata ai nomi dei corsi."""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self._campuses = sorted({c for values in columns["campus"] for c in values}, key=len, reverse=True)
+
+    @classmethod
+    def build(cls, markdown_dir):
+        courses = {}  # nome normalizzato → record
+
+        def record_for(name):
+            return courses.setdefault(_fold(name), {
+                "name": name, "campus": [], "language": [], "faculty": "", "duration": "",
+                "double_degree": False, "source": "",
+            })
+
+        pages = []
+        for path in sorted(glob.glob(os.path.join(markdown_dir, "**", "*.md"), recursive=True)):
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            pages.append((path, text))
+            for row in parse_listing_tables(text):
+                record = record_for(row["name"])
+                for column, value in row.items():
+                    if column != "name" and value:
+                        record[column] = value
+                record["source"] = record["source"] or path
+        # Le pagine dei singoli corsi completano i campi mancanti dell'elenco
+        for path, text in pages:
+            title = page_title(text)
+            fields = parse_course_fields(text)
+            if not title or not ({"campus", "language"} & set(fields)):
+                continue
+            record = record_for(title)
+            for column, value in fields.items():
+                if not record[column]:
+                    record[column] = value
+            if not record["double_degree"] and _DOUBLE_DEGREE_RE.search(text):
+                record["double_degree"] = True
+            record["source"] = record["source"] or path
+        records = sorted(courses.values(), key=lambda r: _fold(r["name"]))
+        return cls({column: [r[column] for r in records] for column in COLUMNS})
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": CATALOG_VERSION, "columns": self.columns}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != CATALOG_VERSION:
+            raise ValueError(f"Versione del catalogo non supportata: {data.get('version')}")
+        return cls(data["columns"])
+
+    def __len__(self):
+        return len(self.columns["name"])
+
+    def filter(self, language=None, campus=None, faculty=None, double_degree=None):
+        """
+        Posizioni dei corsi che soddisfano tutti i filtri indicati; `language`
+        può essere una lingua o una lista di lingue richieste tutte insieme.
+        """
+        c = self.columns
+        languages = [language] if isinstance(language, str) else language or []
+        return [
+            i for i in range(len(self))
+            if all(lang in c["language"][i] for lang in languages)
+            and (campus is None or any(_fold(campus) == _fold(x) for x in c["campus"][i]))
+            and (faculty is None or _fold(faculty) in _fold(c["faculty"][i]))
+            and (double_degree is None or c["double_degree"][i] == double_degree)
+        ]
+
+    def _question_filters(self, question):
+        """Filtri citati nella domanda, o None se la combinazione di lingue è ambigua."""
+        folded = _fold(question)
+        words = re.findall(r"\w+", folded)
+        filters = {}
+        languages = list(dict.fromkeys(_LANGUAGES[t] for t in words if t in _LANGUAGES))
+        if len(languages) == 1:
+            filters["language"] = languages[0]
+        elif languages:
+            if not _BOTH_RE.search(question):
+                return None  # "in italiano o in inglese": decide la catena RAG
+            filters["language"] = languages
+        for campus in self._campuses:
+            if re.search(rf"\b{re.escape(_fold(campus))}\b", folded):
+                filters["campus"] = campus
+                break
+        if _DOUBLE_DEGREE_RE.search(question):
+            filters["double_degree"] = True
+        faculty = re.search(r"facolt[aà] di ([\w ]+?)(?:[?,.]|$)", folded)
+        if faculty:
+            filters["faculty"] = faculty.group(1).strip()
+        return filters
+
+    def _describe(self, i):
+        c = self.columns
+        details = [", ".join(c["campus"][i]), " e ".join(c["language"][i])]
+        if c["double_degree"][i]:
+            details.append("doppio titolo")
+        details = [d for d in details if d]
+        return f"{c['name'][i]} ({'; '.join(details)})" if details else c["name"][i]
+
+    def _course_answer(self, i, question):
+        """Risposta su un attributo di un singolo corso, o None."""
+        c = self.columns
+        name = c["name"][i]
+        # Solo gli attributi chiesti: citare una lingua o una sede non basta
+        asked = [column for column, regex in _ATTRIBUTE_RES.items() if regex.search(question)]
+        lines = []
+        for column in asked:
+            value = c[column][i]
+            if column == "language" and value:
+                lines.append(f"Il corso {name} si svolge in {' e '.join(value)}.")
+            elif column == "campus" and value:
+                lines.append(f"Il corso {name} si tiene a {', '.join(value)}.")
+            elif column == "duration" and value:
+                lines.append(f"La durata del corso {name} è {value}.")
+            elif column == "faculty" and value:
+                lines.append(f"Il corso {name} appartiene alla facoltà di {value}.")
+            elif column == "double_degree":
+                lines.append(f"Il corso {name} {'prevede' if value else 'non prevede'} un doppio titolo.")
+        return "\n".join(lines) or None
+
+    def answer(self, question):
+        """
+        Risposta deterministica a una domanda sul catalogo, o None se la domanda
+        non è di filtro/conteggio o il catalogo non basta a rispondere.
+        """
+        if (not len(self) or _EXAM_RE.search(question) or _ADVISORY_RE.search(question)
+                or _OTHER_CATALOG_TOPIC_RE.search(question)):
+            return None
+        counting = bool(_COUNT_RE.search(question))
+        listing = counting or bool(_LIST_RE.search(question))
+        # "Quali corsi di management ..." è un filtro, non una domanda sul corso "Management"
+        if not _COURSES_RE.search(question):
+            course = match_title(question, self.columns["name"])
+            if course is not None:
+                return self._course_answer(self.columns["name"].index(course), question)
+        if not listing or not _COURSE_WORD_RE.search(question):
+            return None
+        filters = self._question_filters(question)
+        if filters is None or (not filters and not _ALL_RE.search(question)):
+            return None
+        matches = self.filter(**filters)
+        if not matches:
+            return None  # il catalogo potrebbe essere incompleto: decide la catena RAG
+        description = []
+        if isinstance(filters.get("language"), list):
+            description.append(f"sia in {' che in '.join(filters['language'])}")
+        elif "language" in filters:
+            description.append(f"in {filters['language']}")
+        if "campus" in filters:
+            description.append(f"a {filters['campus']}")
+        if "faculty" in filters:
+            description.append(f"della facoltà di {filters['faculty']}")
+        if filters.get("double_degree"):
+            description.append("con doppio titolo")
+        subject = " ".join(["corsi magistrali"] + description)
+        if counting and len(matches) == 1:
+            header = " ".join(["C'è 1 corso magistrale"] + description) + ":"
+        elif counting:
+            header = f"Ci sono {len(matches)} {subject}:"
+        else:
+            header = f"Questi sono i {subject} ({len(matches)}):"
+        return "\n".join([header] + [f"- {self._describe(i)}" for i in matches])
+
+    def wrap(self, rag_chain):
+        """Restituisce la catena `rag_chain` preceduta dalle risposte dal catalogo."""
+        return LayeredChain(lambda input: self.answer(input["input"]), rag_chain)
+
+
+def load_catalog(vectorstore_path):
+    """Carica il catalogo salvato accanto all'indice FAISS, o None se assente."""
+    path = catalog_path(vectorstore_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        return CourseCatalog.load(path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Catalogo dei corsi non utilizzabile ({e}): le domande sul catalogo passano dalla catena RAG.")
+        return None
@@ -0,0 +1,74 @@
+"""
+Strati davanti alla catena RAG (cache, risposte strutturate) con supporto
+allo streaming.
+
+Una catena è un callable `chain(input) -> {"answer": ...}`; se ha anche un
+metodo `stream(input)` produce la risposta a pezzi man mano che il modello
+la genera. Ogni strato prova prima a rispondere da sé (`lookup`) e
+altrimenti passa alla catena interna, eventualmente salvando la risposta
+completa (`store`). Il metodo asincrono `ainvoke` esegue lookup e store
+in un thread, per non bloccare l'event loop con SQLite o FAISS.
+"""
+
+import asyncio
+
+
+def stream_answer(chain, input):
+    """Pezzi della risposta di `chain`: in streaming se supportato, altrimenti in un colpo solo."""
+    stream = getattr(chain, "stream", None)
+    if stream is not None:
+        yield from stream(input)
+        return
+    yield chain(input).get("answer", "")
+
+
+async def ainvoke_chain(chain, input):
+    """Esegue `chain` in modo asincrono: nativo se supportato, altrimenti in un thread."""
+    ainvoke = getattr(chain, "ainvoke", None)
+    if ainvoke is not None:
+        return await ainvoke(input)
+    return await asyncio.to_thread(chain, input)
+
+
+class LayeredChain:
+    """
+    Strato davanti a `inner`.
+
+    `lookup(input)` restituisce una risposta o None; `store(input, answer)`,
+    se dato, riceve la risposta completa della catena interna.
+    """
+
+    def __init__(self, lookup, inner, store=None):
+        self.lookup = lookup
+        self.inner = inner
+        self.store = store
+
+    def __call__(self, input):
+        answer = self.lookup(input)
+        if answer is not None:
+            return {"answer": answer}
+        output = self.inner(input)
+        if self.store is not None and output.get("answer"):
+            self.store(input, output["answer"])
+        return output
+
+    def stream(self, input):
+        answer = self.lookup(input)
+        if answer is not None:
+            yield answer
+            return
+        parts = []
+        for piece in stream_answer(self.inner, input):
+            parts.append(piece)
+            yield piece
+        if self.store is not None and parts:
+            self.store(input, "".join(parts))
+
+    async def ainvoke(self, input):
+        answer = await asyncio.to_thread(self.lookup, input)
+        if answer is not None:
+            return {"answer": answer}
+        output = await ainvoke_chain(self.inner, input)
+        if self.store is not None and output.get("answer"):
+            await asyncio.to_thread(self.store, input, output["answer"])
+        return output
@@ -0,0 +1,131 @@
+"""
+Storia della chat a dimensione limitata.
+
+Gli ultimi `max_turns` turni (domanda + risposta) restano testuali; i turni
+più vecchi confluiscono in un riassunto progressivo e il totale non supera
+`max_tokens` token stimati. Così il prompt, e con lui latenza e costo, non
+cresce con la lunghezza della sessione.
+
+Il riassunto di default è estrattivo e locale (domanda e prima frase della
+risposta di ogni turno, i più vecchi scartati per primi); con
+`llm_summarizer` lo aggiorna il modello, con una chiamata sincrona dentro
+`add_ai_message` per ogni turno che esce dalla finestra. Quella chiamata
+si somma alla latenza del turno, e dal codice asincrono `add_ai_message`
+va eseguito in un thread (asyncio.to_thread), non sull'event loop.
+"""
+
+import re
+from collections import deque
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from context_packer import trim_to_tokens
+from lexical_index import tokenize
+from rate_limit import estimate_tokens
+
+SUMMARY_PREFIX = "Riassunto della conversazione precedente:\n"
+SUMMARY_ACK = "D'accordo, ne terrò conto."
+ANSWER_PREVIEW_CHARS = 200
+
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s")
+
+SUMMARY_PROMPT = (
+    "Aggiorna il riassunto di una conversazione tra uno studente e l'assistente dei corsi "
+    "magistrali Unicattolica. Mantieni corsi, curriculum, anni e preferenze citati, in italiano, "
+    "in al massimo {max_words} parole. Rispondi solo con il nuovo riassunto.\n\n"
+    "Riassunto attuale:\n{summary}\n\nNuovi scambi:\n{turns}"
+)
+
+
+def extractive_summary(summary, turns, max_tokens):
+    """Aggiunge a `summary` una riga per turno e scarta le righe più vecchie oltre `max_tokens`."""
+    lines = summary.splitlines() if summary else []
+    for question, answer in turns:
+        first_sentence = _SENTENCE_END_RE.split(" ".join(answer.split()), maxsplit=1)[0]
+        lines.append(f"- {' '.join(question.split())} → {first_sentence[:ANSWER_PREVIEW_CHARS]}")
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def llm_summarizer(llm):
+    """Riassunto aggiornato dal modello `llm`; se la chiamata fallisce si ripiega su quello estrattivo."""
+    def summarize(summary, turns, max_tokens):
+        exchanges = "\n".join(f"Studente: {question}\nAssistente: {answer}" for question, answer in turns)
+        prompt = SUMMARY_PROMPT.format(max_words=max(20, max_tokens * 3 // 4), summary=summary or "(vuoto)",
+                                       turns=exchanges)
+        try:
+            text = llm.invoke(prompt).content.strip()
+        except Exception as e:
+            print(f"Riassunto della chat non disponibile ({e}): uso quello estrattivo.")
+            return extractive_summary(summary, turns, max_tokens)
+        return trim_to_tokens(text, max_tokens)
+    return summarize
+
+
+class BoundedChatHistory:
+    """
+    Storia della chat con finestra sugli ultimi turni e riassunto dei precedenti.
+
+    Espone la stessa interfaccia di ChatMessageHistory usata dal bot
+    (`messages`, `add_user_message`, `add_ai_message`, `clear`).
+    """
+
+    def __init__(self, max_turns=4, max_tokens=2000, summary_max_tokens=300, summarizer=None):
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.summarizer = summarizer or extractive_summary
+        self.summary = ""
+        self._turns = deque()  # (domanda, risposta)
+        self._pending = None  # domanda in attesa della risposta
+
+    @property
+    def messages(self):
+        messages = []
+        if self.summary:
+            messages += [HumanMessage(content=SUMMARY_PREFIX + self.summary), AIMessage(content=SUMMARY_ACK)]
+        for question, answer in self._turns:
+            messages += [HumanMessage(content=question), AIMessage(content=answer)]
+        if self._pending is not None:
+            messages.append(HumanMessage(content=self._pending))
+        return messages
+
+    def add_user_message(self, message):
+        self._pending = _text(message)
+
+    def add_ai_message(self, message):
+        self._turns.append((self._pending or "", _text(message)))
+        self._pending = None
+        self._compact()
+
+    def clear(self):
+        self.summary = ""
+        self._turns.clear()
+        self._pending = None
+
+    def tokens(self):
+        """Token stimati dei messaggi passati al prompt."""
+        return sum(estimate_tokens(message.content) for message in self.messages)
+
+    def _compact(self):
+        evicted = []
+        while len(self._turns) > self.max_turns:
+            evicted.append(self._turns.popleft())
+        summary_budget = self.summary_max_tokens + estimate_tokens(SUMMARY_PREFIX + SUMMARY_ACK)
+        while len(self._turns) > 1 and self._turns_tokens() + summary_budget > self.max_tokens:
+            evicted.append(self._turns.popleft())
+        if evicted:
+            self.summary = self.summarizer(self.summary, evicted, self.summary_max_tokens)
+        if len(self._turns) == 1 and self.tokens() > self.max_tokens:
+            # Un solo turno oltre il limite: la risposta tiene i paragrafi più vicini alla domanda
+            question, answer = self._turns[0]
+            half = max(1, (self.max_tokens - summary_budget) // 2)
+            self._turns[0] = (trim_to_tokens(question, half), trim_to_tokens(answer, half, tokenize(question)))
+
+    def _turns_tokens(self):
+        return sum(estimate_tokens(question) + estimate_tokens(answer) for question, answer in self._turns)
+
+
+def _text(message):
+    return message if isinstance(message, str) else message.content
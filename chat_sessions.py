@@ -0,0 +1,52 @@
+"""
+Storie di chat per sessione, condivise da un unico processo.
+
+Ogni sessione ha la sua storia (creata da `history_factory`) e un lock che
+serializza i turni della stessa conversazione, mentre sessioni diverse
+procedono in parallelo.
+Il lock è un asyncio.Lock per l'API asincrona o un threading.Lock per il
+servizio HTTP (`lock_factory`). Oltre `max_sessions` viene eliminata la
+sessione usata meno di recente.
+"""
+
+import asyncio
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_SESSIONS = 10_000
+
+
+class ChatSessions:
+    """Registro LRU delle sessioni: id → (storia, lock)."""
+
+    def __init__(self, max_sessions=DEFAULT_MAX_SESSIONS, lock_factory=asyncio.Lock,
+                 history_factory=None):
+        self.max_sessions = max_sessions
+        self.lock_factory = lock_factory
+        if history_factory is None:
+            from langchain_community.chat_message_histories import ChatMessageHistory
+            history_factory = ChatMessageHistory
+        self.history_factory = history_factory
+        self._sessions = OrderedDict()
+        self._registry_lock = threading.Lock()
+
+    def get(self, session_id):
+        """Restituisce (storia, lock) della sessione, creandola se serve."""
+        with self._registry_lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = (self.history_factory(), self.lock_factory())
+                self._sessions[session_id] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def reset(self, session_id):
+        """Dimentica la sessione; restituisce True se esisteva."""
+        with self._registry_lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self):
+        return len(self._sessions)
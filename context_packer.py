@@ -0,0 +1,85 @@
+"""
+Impacchettamento del contesto per la catena stuff-documents entro un budget
+di token.
+
+I chunk recuperati arrivano in ordine di rilevanza. Quelli il cui testo è
+già contenuto quasi per intero in un chunk più rilevante vengono scartati;
+gli altri entrano nel contesto finché c'è budget, ciascuno al massimo di
+`max_chunk_tokens`. Un chunk troppo lungo viene ridotto ai paragrafi che
+condividono più parole con la domanda, mantenendone l'ordine originale.
+I token sono stimati localmente, senza chiamate all'API.
+"""
+
+from langchain_core.documents import Document
+
+from lexical_index import tokenize
+from rate_limit import estimate_tokens
+
+SHINGLE_SIZE = 5
+OVERLAP_THRESHOLD = 0.8  # frazione di shingle già presenti oltre cui un chunk è ridondante
+MIN_CHUNK_TOKENS = 64  # sotto questa disponibilità non si aggiungono altri chunk
+
+
+def _shingles(text):
+    words = text.lower().split()
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def trim_to_tokens(text, max_tokens, query_tokens=()):
+    """
+    Riduce `text` a circa `max_tokens` token tenendo i paragrafi più vicini
+    alla domanda, nell'ordine in cui compaiono.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    paragraphs = [p for p in text.split("\n\n") if p.strip()]
+    query_tokens = set(query_tokens)
+    ranked = sorted(
+        range(len(paragraphs)),
+        key=lambda i: (-len(query_tokens.intersection(tokenize(paragraphs[i]))), i),
+    )
+    kept, used = set(), 0
+    for i in ranked:
+        cost = estimate_tokens(paragraphs[i])
+        if used + cost <= max_tokens:
+            kept.add(i)
+            used += cost
+    if not kept:
+        # Un solo paragrafo più lungo del budget: taglio netto
+        return paragraphs[ranked[0]][:max_tokens * 4]
+    return "\n\n".join(paragraphs[i] for i in sorted(kept))
+
+
+def pack_context(docs, query, budget_tokens, max_chunk_tokens):
+    """
+    Seleziona e accorcia i chunk `docs` (in ordine di rilevanza) entro
+    `budget_tokens`.
+
+    Returns:
+        tuple: (documenti da passare alla catena, statistiche come dict)
+    """
+    query_tokens = tokenize(query)
+    packed = []
+    seen_shingles = set()
+    used = 0
+    stats = {"retrieved": len(docs), "duplicates": 0, "trimmed": 0, "dropped": 0}
+    for doc in docs:
+        shingles = _shingles(doc.page_content)
+        if shingles and len(shingles & seen_shingles) >= OVERLAP_THRESHOLD * len(shingles):
+            stats["duplicates"] += 1
+            continue
+        available = min(max_chunk_tokens, budget_tokens - used)
+        if available < MIN_CHUNK_TOKENS:
+            stats["dropped"] += 1
+            continue
+        content = trim_to_tokens(doc.page_content, available, query_tokens)
+        if content != doc.page_content:
+            stats["trimmed"] += 1
+        seen_shingles |= shingles
+        used += estimate_tokens(content)
+        packed.append(Document(page_content=content, metadata=doc.metadata))
+    stats["packed"] = len(packed)
+    stats["tokens"] = used
+    return packed, stats
@@ -0,0 +1,237 @@
+"""
+Stato persistente del crawler in SQLite.
+
+Per ogni pagina registra ETag, Last-Modified, hash del contenuto, ultimo
+fetch e link in uscita, così che un nuovo crawl possa usare richieste
+condizionali e saltare conversione e scrittura delle pagine invariate.
+La frontiera del crawl (URL da visitare e già visti) può essere tenuta su
+disco per riprendere un crawl interrotto.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import deque
+
+CRAWL_STATE_PATH = "crawl_state.sqlite"
+# File separato: i checkpoint periodici della frontiera tengono aperta una
+# transazione di scrittura che bloccherebbe gli aggiornamenti delle pagine
+CRAWL_FRONTIER_PATH = "crawl_frontier.sqlite"
+CHECKPOINT_EVERY = 200  # operazioni sulla frontiera tra due commit
+CHECKPOINT_SECONDS = 10
+
+
+class PageStateStore:
+    """Tabella `pages` con lo stato dell'ultimo fetch di ogni URL. Thread-safe."""
+
+    def __init__(self, path=CRAWL_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " url TEXT PRIMARY KEY,"
+            " etag TEXT,"
+            " last_modified TEXT,"
+            " content_hash TEXT,"
+            " links TEXT,"
+            " last_fetch REAL,"
+            " last_seen_run TEXT)"
+        )
+        self._conn.commit()
+
+    def get(self, url):
+        """Stato salvato per `url` come dict, o None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, content_hash, links FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, content_hash, links = row
+        return {
+            "etag": etag,
+            "last_modified": last_modified,
+            "content_hash": content_hash,
+            "links": json.loads(links) if links else [],
+        }
+
+    def save(self, url, run_id, etag=None, last_modified=None, content_hash=None, links=None):
+        """Registra un fetch riuscito; i campi a None mantengono il valore precedente."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO pages (url, etag, last_modified, content_hash, links, last_fetch, last_seen_run)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(url) DO UPDATE SET"
+                " etag = COALESCE(excluded.etag, etag),"
+                " last_modified = COALESCE(excluded.last_modified, last_modified),"
+                " content_hash = COALESCE(excluded.content_hash, content_hash),"
+                " links = COALESCE(excluded.links, links),"
+                " last_fetch = excluded.last_fetch,"
+                " last_seen_run = excluded.last_seen_run",
+                (url, etag, last_modified, content_hash,
+                 json.dumps(links) if links is not None else None, time.time(), run_id),
+            )
+            self._conn.commit()
+
+    def delete(self, url):
+        """Dimentica `url`; restituisce True se era noto."""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+            self._conn.commit()
+        return cursor.rowcount > 0
+
+    def urls_not_seen_in(self, run_id):
+        """URL noti che non sono stati scaricati con successo nel run `run_id`."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT url FROM pages WHERE last_seen_run IS NOT ? ORDER BY url", (run_id,)
+            ).fetchall()
+        return [url for (url,) in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class MemoryFrontier:
+    """Frontiera in memoria: deque FIFO più insieme degli URL già visti."""
+
+    def __init__(self):
+        self._queue = deque()
+        self._seen = set()
+
+    def add(self, url, depth):
+        """Accoda `url` se non è mai stato visto; restituisce True se accodato."""
+        if url in self._seen:
+            return False
+        self._seen.add(url)
+        self._queue.append((url, depth))
+        return True
+
+    def pop(self):
+        """Prossimo (url, depth) da visitare, o None se la coda è vuota."""
+        return self._queue.popleft() if self._queue else None
+
+    def requeue(self, url, depth):
+        """Rimette in fondo alla coda un URL già estratto (es. dopo un 429)."""
+        self._queue.append((url, depth))
+
+    def done(self, url):
+        pass
+
+    def maybe_checkpoint(self):
+        pass
+
+    def seen_count(self):
+        return len(self._seen)
+
+    def close(self):
+        pass
+
+
+class SQLiteFrontier:
+    """
+    Frontiera persistente in SQLite (WAL).
+
+    Coda e insieme dei visti stanno nella stessa tabella, quindi la memoria
+    resta limitata agli URL in elaborazione anche su siti con centinaia di
+    migliaia di pagine. Le modifiche vengono salvate con un commit ogni
+    CHECKPOINT_EVERY operazioni o CHECKPOINT_SECONDS secondi, solo quando il
+    crawler chiama `maybe_checkpoint` tra una pagina elaborata e l'altra;
+    alla ripresa gli URL rimasti "in corso" tornano in coda.
+    """
+
+    QUEUED, IN_PROGRESS, DONE = 0, 1, 2
+
+    def __init__(self, path=CRAWL_FRONTIER_PATH, resume=False, run_id=None):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS frontier ("
+            " url TEXT PRIMARY KEY,"
+            " depth INTEGER NOT NULL,"
+            " status INTEGER NOT NULL,"
+            " priority INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_frontier_queue ON frontier (status, priority)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        saved_run = self._conn.execute("SELECT value FROM meta WHERE key = 'run_id'").fetchone()
+        if resume and saved_run:
+            # Il run ripreso mantiene il suo id, così il report delle pagine
+            # rimosse tiene conto anche di quelle scaricate prima dell'interruzione
+            self.run_id = saved_run[0]
+            self._conn.execute("UPDATE frontier SET status = ? WHERE status = ?", (self.QUEUED, self.IN_PROGRESS))
+        else:
+            self.run_id = run_id or str(time.time())
+            self._conn.execute("DELETE FROM frontier")
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('run_id', ?)", (self.run_id,))
+        self._conn.commit()
+        self._next_priority = (self._conn.execute("SELECT MAX(priority) FROM frontier").fetchone()[0] or 0) + 1
+        self._pending_ops = 0
+        self._last_checkpoint = time.monotonic()
+
+    def _touched(self):
+        self._pending_ops += 1
+
+    def maybe_checkpoint(self):
+        """
+        Commit se sono passate CHECKPOINT_EVERY operazioni o CHECKPOINT_SECONDS
+        secondi. Va chiamato solo tra due unità di lavoro complete (pagina
+        segnata come fatta e suoi link accodati), mai a metà: altrimenti un
+        crash potrebbe lasciare una pagina fatta con i link mai accodati.
+        """
+        if (self._pending_ops >= CHECKPOINT_EVERY
+                or time.monotonic() - self._last_checkpoint >= CHECKPOINT_SECONDS):
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Rende persistenti le modifiche accumulate."""
+        self._conn.commit()
+        self._pending_ops = 0
+        self._last_checkpoint = time.monotonic()
+
+    def add(self, url, depth):
+        cursor = self._conn.execute(
+            "INSERT OR IGNORE INTO frontier (url, depth, status, priority) VALUES (?, ?, ?, ?)",
+            (url, depth, self.QUEUED, self._next_priority),
+        )
+        if cursor.rowcount == 0:
+            return False
+        self._next_priority += 1
+        self._touched()
+        return True
+
+    def pop(self):
+        row = self._conn.execute(
+            "SELECT url, depth FROM frontier WHERE status = ? ORDER BY priority LIMIT 1", (self.QUEUED,)
+        ).fetchone()
+        if row is None:
+            return None
+        self._conn.execute("UPDATE frontier SET status = ? WHERE url = ?", (self.IN_PROGRESS, row[0]))
+        self._touched()
+        return row[0], row[1]
+
+    def requeue(self, url, depth):
+        self._conn.execute(
+            "UPDATE frontier SET status = ?, priority = ? WHERE url = ?",
+            (self.QUEUED, self._next_priority, url),
+        )
+        self._next_priority += 1
+        self._touched()
+
+    def done(self, url):
+        self._conn.execute("UPDATE frontier SET status = ? WHERE url = ?", (self.DONE, url))
+        self._touched()
+
+    def seen_count(self):
+        return self._conn.execute("SELECT COUNT(*) FROM frontier").fetchone()[0]
+
+    def close(self):
+        self.checkpoint()
+        self._conn.close()
@@ -1,169 +1,448 @@
-import requests
-from bs4 import BeautifulSoup
-from markdownify import markdownify as md
-from urllib.parse import urljoin, urlparse
-import os
-import re
-import time
-import logging
-
-# Configurazione del logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# --- Configurazione del Crawler ---
-START_URL = "https://studenticattolica.unicatt.it/"
-ALLOWED_DOMAIN = urlparse(START_URL).netloc
-MAX_DEPTH = 10
-OUTPUT_DIR = "output_crawler"
-REQUEST_DELAY = 1  # Secondi di attesa tra le richieste per essere gentili con il server
-USER_AGENT = "MySimplePythonCrawler/1.0 (+http://example.com/botinfo)" # Cambia con info reali se necessario
-# ----------------------------------
-
-def sanitize_filename(url_path):
-    """Crea un nome file sicuro da un percorso URL."""
-    if not url_path or url_path == "/":
-        filename = "index"
-    else:
-        # Rimuovi lo schema e il netloc se presenti per errore (dovrebbe essere solo il path)
-        parsed_url = urlparse(url_path)
-        path = parsed_url.path
-        
-        # Rimuovi slash iniziali/finali
-        filename = path.strip('/')
-        # Sostituisci slash con underscore
-        filename = filename.replace('/', '_')
-        # Rimuovi caratteri non alfanumerici o non underscore/punto/trattino
-        filename = re.sub(r'[^\w_.-]', '', filename)
-        # Rimuovi estensioni comuni come .html, .php, .asp se presenti alla fine
-        filename = re.sub(r'\.(html|php|asp|aspx)$', '', filename, flags=re.IGNORECASE)
-        if not filename: # Se dopo la pulizia è vuoto
-            filename = "page_" + str(hash(url_path))[:8] # fallback
-
-    return f"{filename}.md"
-
-def fetch_page(url):
-    """Scarica il contenuto di una pagina web."""
-    headers = {'User-Agent': USER_AGENT}
-    try:
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()  # Solleva un'eccezione per codici di errore HTTP (4xx o 5xx)
-        # Assicurati che il contenuto sia testo/html prima di procedere
-        if 'text/html' in response.headers.get('Content-Type', '').lower():
-            return response.text
-        else:
-            logging.warning(f"Contenuto non HTML per {url}: {response.headers.get('Content-Type')}")
-            return None
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Errore durante il fetch di {url}: {e}")
-        return None
-    except Exception as e:
-        logging.error(f"Errore generico durante il fetch di {url}: {e}")
-        return None
-
-
-def parse_and_save(html_content, url, current_depth):
-    """
-    Analizza il contenuto HTML, salva in Markdown e restituisce i link trovati.
-    """
-    if not html_content:
-        return []
-
-    soup = BeautifulSoup(html_content, 'html.parser')
-    
-    # --- Estrazione del contenuto principale (da personalizzare se necessario) ---
-    # Prova con tag comuni per il contenuto principale
-    main_content_tags = ['main', 'article', 'div[class*="content"]', 'div[id*="content"]']
-    content_element = None
-    for tag_selector in main_content_tags:
-        content_element = soup.select_one(tag_selector)
-        if content_element:
-            break
-    
-    if not content_element: # Fallback al body se non trova un main specifico
-        content_element = soup.body
-    
-    if not content_element:
-        logging.warning(f"Nessun elemento <body> trovato in {url}")
-        return []
-        
-    html_to_convert = str(content_element)
-    # ---------------------------------------------------------------------------
-
-    try:
-        markdown_content = md(html_to_convert, heading_style='atx')
-    except Exception as e:
-        logging.error(f"Errore durante la conversione in Markdown per {url}: {e}")
-        markdown_content = f"# Errore durante la conversione\n\nURL: {url}\nErrore: {e}"
-
-    filename = sanitize_filename(urlparse(url).path)
-    filepath = os.path.join(OUTPUT_DIR, filename)
-    
-    try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(f"# Pagina: {url}\n\n")
-            f.write(f"## Profondità: {current_depth}\n\n")
-            f.write(markdown_content)
-        logging.info(f"Salvato: {filepath} (Profondità: {current_depth})")
-    except IOError as e:
-        logging.error(f"Errore durante il salvataggio di {filepath}: {e}")
-        return [] # Non continuare se non si può salvare
-
-    # Estrazione dei link
-    links = []
-    for a_tag in soup.find_all('a', href=True):
-        href = a_tag['href']
-        # Costruisci URL assoluto
-        absolute_url = urljoin(url, href)
-        # Rimuovi frammenti (#section) e parametri opzionali se non necessari
-        absolute_url = urlparse(absolute_url)._replace(query='', fragment='').geturl()
-        links.append(absolute_url)
-    
-    return links
-
-def crawl():
-    """Funzione principale del crawler."""
-    if not os.path.exists(OUTPUT_DIR):
-        os.makedirs(OUTPUT_DIR)
-        logging.info(f"Cartella di output creata: {OUTPUT_DIR}")
-
-    queue = [(START_URL, 0)]  # (url, depth)
-    visited_urls = set()
-    pages_crawled_count = 0
-
-    while queue:
-        current_url, current_depth = queue.pop(0)
-
-        if current_url in visited_urls:
-            logging.debug(f"Già visitato: {current_url}")
-            continue
-
-        if current_depth > MAX_DEPTH:
-            logging.info(f"Profondità massima raggiunta per il ramo di {current_url}")
-            continue
-        
-        parsed_url = urlparse(current_url)
-        if parsed_url.netloc != ALLOWED_DOMAIN:
-            logging.debug(f"Dominio non consentito: {current_url}")
-            continue
-
-        logging.info(f"Crawling: {current_url} (Profondità: {current_depth})")
-        visited_urls.add(current_url)
-        
-        html_content = fetch_page(current_url)
-        
-        if html_content:
-            pages_crawled_count += 1
-            new_links = parse_and_save(html_content, current_url, current_depth)
-            
-            for link in new_links:
-                if link not in visited_urls and urlparse(link).netloc == ALLOWED_DOMAIN:
-                    queue.append((link, current_depth + 1))
-        
-        # Sii gentile con il server
-        time.sleep(REQUEST_DELAY)
-
-    logging.info(f"Crawling completato. Pagine totali analizzate: {pages_crawled_count}")
-    logging.info(f"Pagine uniche visitate (o tentate): {len(visited_urls)}")
-
-if __name__ == "__main__":
-    crawl()
\ No newline at end of file
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+import hashlib
+import json
+import os
+import sys
+import re
+import threading
+import time
+import logging
+
+from crawl_state import CRAWL_FRONTIER_PATH, CRAWL_STATE_PATH, MemoryFrontier, PageStateStore, SQLiteFrontier
+from html_extract import get_extractor
+
+# Configurazione del logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# --- Configurazione del Crawler ---
+START_URL = "https://studenticattolica.unicatt.it/"
+ALLOWED_DOMAIN = urlparse(START_URL).netloc
+MAX_DEPTH = 10
+OUTPUT_DIR = "output_crawler"
+REQUEST_DELAY = 1  # Secondi iniziali tra due richieste allo stesso host
+MIN_REQUEST_DELAY = 0.2  # Intervallo minimo per host, anche se il server risponde velocemente
+MAX_REQUEST_DELAY = 30  # Intervallo massimo per host dopo rallentamenti o Retry-After
+TARGET_CONCURRENCY_PER_HOST = 2.0  # Richieste "in volo" mediamente tollerate da un host
+CONCURRENT_REQUESTS = 8  # Fetch concorrenti in totale
+MAX_RETRIES = 3  # Tentativi per URL su 429/503
+HTML_EXTRACTOR = "auto"  # "bs4", "lxml", "selectolax" o "auto" (lxml se installato, vedi html_extract)
+SAVE_RAW_HTML_DIR = None  # Cartella dove salvare anche l'HTML grezzo (fixture per i benchmark)
+CRAWL_REPORT_PATH = "crawl_report.json"  # Report pagine aggiunte/modificate/rimosse/fallite
+GONE_STATUS_CODES = (404, 410)  # Pagine rimosse dal sito: stato e file Markdown vengono eliminati
+USER_AGENT = "MySimplePythonCrawler/1.0 (+http://example.com/botinfo)" # Cambia con info reali se necessario
+# ----------------------------------
+
+def sanitize_filename(url_path):
+    """Crea un nome file sicuro da un percorso URL."""
+    if not url_path or url_path == "/":
+        filename = "index"
+    else:
+        # Rimuovi lo schema e il netloc se presenti per errore (dovrebbe essere solo il path)
+        parsed_url = urlparse(url_path)
+        path = parsed_url.path
+        
+        # Rimuovi slash iniziali/finali
+        filename = path.strip('/')
+        # Sostituisci slash con underscore
+        filename = filename.replace('/', '_')
+        # Rimuovi caratteri non alfanumerici o non underscore/punto/trattino
+        filename = re.sub(r'[^\w_.-]', '', filename)
+        # Rimuovi estensioni comuni come .html, .php, .asp se presenti alla fine
+        filename = re.sub(r'\.(html|php|asp|aspx)$', '', filename, flags=re.IGNORECASE)
+        if not filename: # Se dopo la pulizia è vuoto
+            filename = "page_" + str(hash(url_path))[:8] # fallback
+
+    return f"{filename}.md"
+
+_thread_local = threading.local()
+
+def get_session():
+    """Sessione HTTP per thread, con connessioni keep-alive riusate."""
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.headers['User-Agent'] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _thread_local.session = session
+    return session
+
+def parse_retry_after(value):
+    """Converte l'header Retry-After (secondi o data HTTP) in secondi di attesa."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def fetch_response(url, headers=None):
+    """
+    Scarica una pagina e restituisce la risposta HTTP (anche se 4xx/5xx),
+    o None in caso di errore di rete.
+    """
+    try:
+        return get_session().get(url, headers=headers, timeout=10)
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Errore durante il fetch di {url}: {e}")
+        return None
+
+def html_from_response(response, url):
+    """Estrae il testo HTML da una risposta, o None se è un errore o non è HTML."""
+    try:
+        response.raise_for_status()  # Solleva un'eccezione per codici di errore HTTP (4xx o 5xx)
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Errore durante il fetch di {url}: {e}")
+        return None
+    # Assicurati che il contenuto sia testo/html prima di procedere
+    if 'text/html' in response.headers.get('Content-Type', '').lower():
+        return response.text
+    logging.warning(f"Contenuto non HTML per {url}: {response.headers.get('Content-Type')}")
+    return None
+
+def fetch_page(url):
+    """Scarica il contenuto di una pagina web."""
+    response = fetch_response(url)
+    if response is None:
+        return None
+    return html_from_response(response, url)
+
+
+class HostThrottle:
+    """
+    Token bucket per host con intervallo adattivo.
+
+    L'intervallo tra due richieste allo stesso host tende a
+    latenza / TARGET_CONCURRENCY_PER_HOST (come l'AutoThrottle di Scrapy):
+    se il server rallenta, il crawler rallenta con lui. Un Retry-After
+    blocca l'host fino alla scadenza indicata.
+    """
+
+    def __init__(self, delay=REQUEST_DELAY, min_delay=MIN_REQUEST_DELAY, max_delay=MAX_REQUEST_DELAY,
+                 target_concurrency=TARGET_CONCURRENCY_PER_HOST):
+        self.initial_delay = delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.target_concurrency = target_concurrency
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _state(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = {"delay": self.initial_delay, "tokens": 1.0,
+                     "updated": time.monotonic(), "blocked_until": 0.0}
+            self._hosts[host] = state
+        return state
+
+    def acquire(self, host):
+        """Attende finché l'host può ricevere una nuova richiesta."""
+        while True:
+            with self._lock:
+                state = self._state(host)
+                now = time.monotonic()
+                if state["delay"] > 0:
+                    state["tokens"] = min(1.0, state["tokens"] + (now - state["updated"]) / state["delay"])
+                else:
+                    state["tokens"] = 1.0
+                state["updated"] = now
+                if now < state["blocked_until"]:
+                    pause = state["blocked_until"] - now
+                elif state["tokens"] >= 1.0:
+                    state["tokens"] -= 1.0
+                    return
+                else:
+                    pause = (1.0 - state["tokens"]) * state["delay"]
+            time.sleep(pause)
+
+    def record_latency(self, host, latency):
+        with self._lock:
+            state = self._state(host)
+            target = latency / self.target_concurrency
+            state["delay"] = min(self.max_delay, max(self.min_delay, (state["delay"] + target) / 2))
+
+    def record_retry_after(self, host, seconds):
+        with self._lock:
+            state = self._state(host)
+            seconds = self.initial_delay if seconds is None else seconds
+            state["blocked_until"] = max(state["blocked_until"], time.monotonic() + seconds)
+            state["delay"] = min(self.max_delay, max(state["delay"] * 2, self.initial_delay))
+
+
+_extractor = None
+
+def get_html_extractor():
+    """Estrattore HTML configurato in HTML_EXTRACTOR, creato alla prima pagina."""
+    global _extractor
+    if _extractor is None:
+        _extractor = get_extractor(HTML_EXTRACTOR)
+        logging.info(f"Estrattore HTML: {_extractor.name}")
+    return _extractor
+
+def parse_and_save(html_content, url, current_depth):
+    """
+    Analizza il contenuto HTML, salva in Markdown e restituisce i link trovati.
+
+    La pagina viene analizzata una sola volta: contenuto principale e link
+    sono estratti dallo stesso albero (vedi html_extract).
+    """
+    if not html_content:
+        return []
+
+    if SAVE_RAW_HTML_DIR:
+        save_raw_html(html_content, url)
+
+    extractor = get_html_extractor()
+    document = extractor.parse(html_content)
+
+    try:
+        markdown_content = extractor.content_markdown(document)
+    except Exception as e:
+        logging.error(f"Errore durante la conversione in Markdown per {url}: {e}")
+        markdown_content = f"# Errore durante la conversione\n\nURL: {url}\nErrore: {e}"
+
+    if markdown_content is None:
+        logging.warning(f"Nessun elemento <body> trovato in {url}")
+        return []
+
+    filename = sanitize_filename(urlparse(url).path)
+    filepath = os.path.join(OUTPUT_DIR, filename)
+    
+    try:
+        with open(filepath, 'w', encoding='utf-8') as f:
+            f.write(f"# Pagina: {url}\n\n")
+            f.write(f"## Profondità: {current_depth}\n\n")
+            f.write(markdown_content)
+        logging.info(f"Salvato: {filepath} (Profondità: {current_depth})")
+    except IOError as e:
+        logging.error(f"Errore durante il salvataggio di {filepath}: {e}")
+        return [] # Non continuare se non si può salvare
+
+    # Estrazione dei link (URL assoluti, senza query string né frammenti)
+    return extractor.links(document, url)
+
+def save_raw_html(html_content, url):
+    """Salva l'HTML grezzo della pagina, utile come fixture per i benchmark."""
+    os.makedirs(SAVE_RAW_HTML_DIR, exist_ok=True)
+    filename = sanitize_filename(urlparse(url).path)[:-len('.md')] + '.html'
+    with open(os.path.join(SAVE_RAW_HTML_DIR, filename), 'w', encoding='utf-8') as f:
+        f.write(html_content)
+
+class CrawlerEngine:
+    """
+    Crawler concorrente in ampiezza.
+
+    La frontiera (in memoria o `SQLiteFrontier` su disco) deduplica gli URL
+    al momento dell'inserimento; fino a `concurrency` fetch sono in corso
+    insieme, ma ogni host riceve richieste al ritmo deciso da `HostThrottle`.
+    """
+
+    def __init__(self, start_url=START_URL, max_depth=MAX_DEPTH, concurrency=CONCURRENT_REQUESTS,
+                 throttle=None, state=None, conditional=True, frontier=None):
+        self.start_url = start_url
+        self.allowed_domain = urlparse(start_url).netloc
+        self.max_depth = max_depth
+        self.concurrency = concurrency
+        self.throttle = throttle or HostThrottle()
+        self.frontier = frontier or MemoryFrontier()
+        self.retries = {}
+        self.pages_crawled_count = 0
+        # Stato delle pagine dei crawl precedenti (None = scarica sempre tutto)
+        self.state = state
+        self.conditional = conditional
+        self.run_id = getattr(self.frontier, "run_id", None) or datetime.now().isoformat()
+        self.report = {"added": [], "changed": [], "removed": [], "failed": [], "unchanged": 0}
+
+    def enqueue(self, url, depth):
+        """Aggiunge un URL alla frontiera se è nuovo, nel dominio e entro la profondità."""
+        if depth > self.max_depth:
+            logging.debug(f"Profondità massima raggiunta per il ramo di {url}")
+            return False
+        if urlparse(url).netloc != self.allowed_domain:
+            logging.debug(f"Dominio non consentito: {url}")
+            return False
+        return self.frontier.add(url, depth)
+
+    def process(self, url, depth):
+        """
+        Scarica e salva una pagina.
+
+        Returns:
+            tuple: (esito, link trovati o None se la pagina non è stata salvata).
+            L'esito è "added", "changed" o "unchanged" rispetto al crawl
+            precedente ("fetched" senza stato), "retry" se il server ha
+            chiesto di rallentare (429/503), "gone" se la pagina non esiste
+            più (404/410) e "failed" per gli altri errori.
+        """
+        host = urlparse(url).netloc
+        previous = self.state.get(url) if self.state else None
+        # Senza il file Markdown su disco la pagina va comunque riconvertita
+        reusable = self.conditional and previous is not None and os.path.exists(
+            os.path.join(OUTPUT_DIR, sanitize_filename(urlparse(url).path)))
+        headers = {}
+        if reusable:
+            if previous["etag"]:
+                headers['If-None-Match'] = previous["etag"]
+            if previous["last_modified"]:
+                headers['If-Modified-Since'] = previous["last_modified"]
+
+        self.throttle.acquire(host)
+        logging.info(f"Crawling: {url} (Profondità: {depth})")
+        started = time.monotonic()
+        response = fetch_response(url, headers or None)
+        self.throttle.record_latency(host, time.monotonic() - started)
+        if response is None:
+            return "failed", None
+        if response.status_code in (429, 503):
+            self.throttle.record_retry_after(host, parse_retry_after(response.headers.get('Retry-After')))
+            return "retry", None
+        if response.status_code in GONE_STATUS_CODES:
+            logging.warning(f"Pagina rimossa ({response.status_code}): {url}")
+            return "gone", None
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if response.status_code == 304 and reusable:
+            # Pagina invariata: niente download, conversione né scrittura
+            self.state.save(url, self.run_id, etag=etag, last_modified=last_modified)
+            return "unchanged", previous["links"]
+        html_content = html_from_response(response, url)
+        if not html_content:
+            return "failed", None
+        if not self.state:
+            return "fetched", parse_and_save(html_content, url, depth)
+
+        content_hash = hashlib.sha256(html_content.encode('utf-8')).hexdigest()
+        if reusable and previous["content_hash"] == content_hash:
+            self.state.save(url, self.run_id, etag=etag, last_modified=last_modified)
+            return "unchanged", previous["links"]
+        links = parse_and_save(html_content, url, depth)
+        self.state.save(url, self.run_id, etag=etag, last_modified=last_modified,
+                        content_hash=content_hash, links=links)
+        if previous is None:
+            return "added", links
+        return ("unchanged" if previous["content_hash"] == content_hash else "changed"), links
+
+    def handle_result(self, url, depth, status, links):
+        if status == "retry":
+            attempts = self.retries.get(url, 0) + 1
+            self.retries[url] = attempts
+            if attempts <= MAX_RETRIES:
+                logging.warning(f"Server sovraccarico, ritento più tardi: {url} (tentativo {attempts})")
+                self.frontier.requeue(url, depth)
+                return
+            logging.error(f"Rinuncio dopo {MAX_RETRIES} tentativi: {url}")
+            status = "failed"
+        self.frontier.done(url)
+        if status == "gone":
+            self.remove_page(url)
+            return
+        if links is None:
+            # Errore temporaneo (timeout, 5xx, ...): stato e file del crawl precedente restano validi
+            if status == "failed":
+                self.report["failed"].append(url)
+            return
+        self.pages_crawled_count += 1
+        if status in ("added", "changed"):
+            self.report[status].append(url)
+        elif status == "unchanged":
+            self.report["unchanged"] += 1
+        for link in links:
+            self.enqueue(link, depth + 1)
+
+    def remove_page(self, url):
+        """Elimina stato e file Markdown di una pagina che il sito non serve più (404/410)."""
+        filepath = os.path.join(OUTPUT_DIR, sanitize_filename(urlparse(url).path))
+        if os.path.exists(filepath):
+            os.remove(filepath)
+            logging.info(f"Eliminato: {filepath}")
+        if self.state and self.state.delete(url):
+            self.report["removed"].append(url)
+
+    def write_report(self, path=CRAWL_REPORT_PATH):
+        """
+        Scrive e riassume nel log le pagine aggiunte, modificate, rimosse
+        (404/410) e fallite (errori temporanei, stato precedente mantenuto).
+        Le pagine note non raggiunte in questo crawl, ad esempio perché
+        nessuna pagina le collega più, sono elencate in "not_reached" e
+        conservate.
+        """
+        failed = set(self.report["failed"])
+        not_reached = [url for url in self.state.urls_not_seen_in(self.run_id) if url not in failed]
+        report = {
+            "timestamp": self.run_id,
+            "added": self.report["added"],
+            "changed": self.report["changed"],
+            "removed": self.report["removed"],
+            "failed": self.report["failed"],
+            "not_reached": not_reached,
+            "unchanged": self.report["unchanged"],
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        logging.info(f"Pagine aggiunte: {len(report['added'])}, modificate: {len(report['changed'])}, "
+                     f"rimosse: {len(report['removed'])}, fallite: {len(report['failed'])}, "
+                     f"non raggiunte: {len(not_reached)}, invariate: {report['unchanged']} (report in {path})")
+
+    def run(self):
+        if not os.path.exists(OUTPUT_DIR):
+            os.makedirs(OUTPUT_DIR)
+            logging.info(f"Cartella di output creata: {OUTPUT_DIR}")
+
+        # Alla ripresa di un crawl lo START_URL è già noto e non viene riaccodato
+        self.enqueue(self.start_url, 0)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            in_flight = {}
+            while True:
+                while len(in_flight) < self.concurrency:
+                    item = self.frontier.pop()
+                    if item is None:
+                        break
+                    in_flight[executor.submit(self.process, *item)] = item
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url, depth = in_flight.pop(future)
+                    try:
+                        status, links = future.result()
+                    except Exception as e:
+                        logging.error(f"Errore durante l'elaborazione di {url}: {e}")
+                        status, links = "failed", None
+                    self.handle_result(url, depth, status, links)
+                    # Commit solo dopo che la pagina è segnata come fatta e i suoi link sono accodati
+                    self.frontier.maybe_checkpoint()
+
+        logging.info(f"Crawling completato. Pagine totali analizzate: {self.pages_crawled_count}")
+        logging.info(f"Pagine uniche visitate (o tentate): {self.frontier.seen_count()}")
+        if self.state:
+            self.write_report()
+
+def crawl(full=False, resume=False):
+    """
+    Funzione principale del crawler.
+
+    Di default usa lo stato in CRAWL_STATE_PATH per scaricare e convertire
+    solo le pagine cambiate; con `full=True` riscarica e riconverte tutto.
+    La frontiera è salvata in CRAWL_FRONTIER_PATH: con `resume=True` il crawl
+    riparte da dove si era interrotto invece che da START_URL.
+    """
+    state = PageStateStore(CRAWL_STATE_PATH)
+    frontier = SQLiteFrontier(CRAWL_FRONTIER_PATH, resume=resume, run_id=datetime.now().isoformat())
+    try:
+        CrawlerEngine(state=state, conditional=not full, frontier=frontier).run()
+    finally:
+        frontier.close()
+        state.close()
+
+if __name__ == "__main__":
+    crawl(full='--full' in sys.argv, resume='--resume' in sys.argv)
\ No newline at end of file
@@ -0,0 +1,157 @@
+"""
+Eliminazione dei chunk duplicati prima dell'embedding.
+
+Il sito serve gli stessi contenuti sotto più URL (varianti di stampa,
+percorsi che differiscono solo per la query string, sezioni ripetute in
+molte pagine). I chunk con lo stesso testo normalizzato (minuscole, senza
+punteggiatura né intestazione del crawler) sono collassati in un unico
+chunk canonico che conserva l'elenco delle sorgenti.
+
+Su richiesta si collassano anche i quasi duplicati: la SimHash a 64 bit
+degli shingle di parole trova i candidati entro una distanza di Hamming,
+e un candidato è accettato solo se la somiglianza di Jaccard esatta tra
+gli insiemi di shingle raggiunge `min_jaccard`. Con chunk grandi quanto
+una pagina la sola SimHash non basta: due piani di studio che differiscono
+per il nome di un esame distano 1-3 bit (Jaccard ≈ 0.97) e non vanno
+fusi, per questo di default si collassano solo i duplicati esatti.
+"""
+
+import hashlib
+import re
+
+SIMHASH_BITS = 64
+SHINGLE_SIZE = 3
+# Sotto questo numero di parole la SimHash non è affidabile: si collassano
+# solo i duplicati esatti (a meno di maiuscole, punteggiatura e spazi)
+MIN_TOKENS_FOR_SIMHASH = 20
+EXACT_ONLY = 1.0  # min_jaccard che disattiva i quasi duplicati
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+# Intestazione scritta dal crawler (URL e profondità): diversa per ogni
+# copia della stessa pagina, va esclusa dal confronto
+_CRAWLER_HEADER_RE = re.compile(r"\A# Pagina: \S+\s*(?:## Profondità: \d+\s*)?")
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def shingles(tokens, shingle_size=SHINGLE_SIZE):
+    """Shingle di `shingle_size` parole consecutive."""
+    if len(tokens) < shingle_size:
+        return [" ".join(tokens)]
+    return [" ".join(tokens[i:i + shingle_size]) for i in range(len(tokens) - shingle_size + 1)]
+
+
+def simhash(tokens, shingle_size=SHINGLE_SIZE):
+    """SimHash a 64 bit degli shingle di `shingle_size` parole."""
+    weights = [0] * SIMHASH_BITS
+    for shingle in shingles(tokens, shingle_size):
+        h = _hash64(shingle)
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if weight > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def jaccard(a, b):
+    """Somiglianza di Jaccard tra due insiemi."""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class SimHashIndex:
+    """
+    Ricerca di fingerprint entro `max_distance` bit.
+
+    La fingerprint è divisa in `max_distance + 1` bande: per il principio dei
+    cassetti due fingerprint entro la soglia coincidono in almeno una banda,
+    quindi basta confrontare i candidati che condividono una banda.
+    """
+
+    def __init__(self, max_distance=3):
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.band_bits = SIMHASH_BITS // self.bands
+        self._buckets = {}
+
+    def _band_keys(self, fingerprint):
+        mask = (1 << self.band_bits) - 1
+        return [(band, (fingerprint >> (band * self.band_bits)) & mask) for band in range(self.bands)]
+
+    def find(self, fingerprint, accept=None):
+        """
+        Valore associato alla prima fingerprint entro la soglia, o None.
+        Con `accept` la SimHash individua solo i candidati: viene restituito
+        il primo valore per cui `accept(valore)` è vero.
+        """
+        for key in self._band_keys(fingerprint):
+            for other, value in self._buckets.get(key, ()):
+                if hamming_distance(fingerprint, other) <= self.max_distance and (accept is None or accept(value)):
+                    return value
+        return None
+
+    def add(self, fingerprint, value):
+        for key in self._band_keys(fingerprint):
+            self._buckets.setdefault(key, []).append((fingerprint, value))
+
+
+def collapse_near_duplicates(documents, max_distance=0, min_jaccard=EXACT_ONLY):
+    """
+    Collassa i chunk duplicati e, con `min_jaccard` < 1, i quasi duplicati.
+
+    Un chunk è quasi duplicato di uno canonico se le SimHash distano al più
+    `max_distance` bit e gli insiemi di shingle hanno Jaccard almeno
+    `min_jaccard`. Il primo chunk incontrato diventa canonico; i suoi
+    metadati ottengono `sources` (e `urls`, se presenti) con l'elenco di
+    tutte le sorgenti dei duplicati. L'ordine dei chunk canonici è quello
+    di input.
+
+    Returns:
+        tuple: (chunk canonici, numero di chunk eliminati)
+    """
+    index = SimHashIndex(max_distance)
+    exact = {}
+    canonical = []
+    removed = 0
+    for doc in documents:
+        tokens = tokenize(_CRAWLER_HEADER_RE.sub("", doc.page_content))
+        key = " ".join(tokens)
+        match = exact.get(key)
+        fingerprint = None
+        if match is None and min_jaccard < EXACT_ONLY and len(tokens) >= MIN_TOKENS_FOR_SIMHASH:
+            doc_shingles = set(shingles(tokens))
+            fingerprint = simhash(tokens)
+            candidate = index.find(fingerprint, lambda value: jaccard(doc_shingles, value[1]) >= min_jaccard)
+            match = candidate[0] if candidate else None
+        if match is None:
+            # Copia: i chunk dello stesso file condividono il dict dei metadati
+            doc.metadata = dict(doc.metadata)
+            doc.metadata["sources"] = [doc.metadata.get("source", "")]
+            if "url" in doc.metadata:
+                doc.metadata["urls"] = [doc.metadata["url"]]
+            canonical.append(doc)
+            exact[key] = doc
+            if fingerprint is not None:
+                index.add(fingerprint, (doc, doc_shingles))
+            continue
+        removed += 1
+        source = doc.metadata.get("source", "")
+        if source not in match.metadata["sources"]:
+            match.metadata["sources"].append(source)
+        url = doc.metadata.get("url")
+        if url and url not in match.metadata.setdefault("urls", []):
+            match.metadata["urls"].append(url)
+    return canonical, removed
@@ -0,0 +1,228 @@
+"""
+Cache persistente degli embedding, indirizzata per contenuto.
+
+Ogni vettore è salvato in SQLite come blob float32, con chiave
+(modello, sha256 del testo). Il cache è condiviso tra indicizzazione e
+query: una rigenerazione dell'indice con corpus invariato non fa alcuna
+chiamata all'API degli embedding. I vettori delle query passano anche da
+un LRU in memoria, così che una domanda ripetuta non tocchi né la rete né
+il disco.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_MAX_ENTRIES = 200_000
+DEFAULT_QUERY_MEMO_SIZE = 1024
+
+
+def normalize_query_text(text):
+    """Chiave delle query: minuscole e spazi compattati."""
+    return " ".join(text.split()).casefold()
+
+
+class QueryVectorMemo:
+    """LRU in memoria dei vettori delle query, con chiave (modello, testo normalizzato). Thread-safe."""
+
+    def __init__(self, max_entries=DEFAULT_QUERY_MEMO_SIZE):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._vectors = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            vector = self._vectors.get(key)
+            if vector is not None:
+                self._vectors.move_to_end(key)
+            return vector
+
+    def put(self, key, vector):
+        with self._lock:
+            self._vectors[key] = tuple(vector)
+            self._vectors.move_to_end(key)
+            while len(self._vectors) > self.max_entries:
+                self._vectors.popitem(last=False)
+
+    def __len__(self):
+        return len(self._vectors)
+
+
+class EmbeddingCacheStore:
+    """
+    Archivio SQLite (WAL) dei vettori con eviction LRU oltre `max_entries`.
+
+    Thread-safe: una sola connessione protetta da lock.
+    """
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " namespace TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (namespace, text_hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, namespace, hashes):
+        """Restituisce {hash: vettore} per gli hash presenti nel cache."""
+        found = {}
+        if not hashes:
+            return found
+        now = time.time()
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            # SQLite limita il numero di parametri per query
+            for i in range(0, len(unique), 500):
+                chunk = unique[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE namespace = ? AND text_hash IN ({placeholders})",
+                    [namespace, *chunk],
+                ).fetchall()
+                for text_hash, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[text_hash] = vector.tolist()
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE namespace = ? AND text_hash = ?",
+                    [(now, namespace, h) for h in found],
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, namespace, items):
+        """Salva una lista di (hash, vettore) ed esegue l'eviction se necessario."""
+        if not items:
+            return
+        now = time.time()
+        rows = [(namespace, h, array("f", vector).tobytes(), now) for h, vector in items]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (namespace, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            # Solo le righe davvero nuove contano per il limite di dimensione
+            inserted = self._conn.total_changes - before
+            self._count += inserted
+            if inserted < len(rows):
+                # Chiavi già presenti (il vettore è lo stesso): si aggiorna solo l'uso
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE namespace = ? AND text_hash = ?",
+                    [(now, namespace, h) for h, _ in items],
+                )
+            if self.max_entries and self._count > self.max_entries:
+                # Libera un 10% in più per non ripetere l'eviction a ogni inserimento
+                excess = self._count - int(self.max_entries * 0.9)
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN "
+                    "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+                self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            self._conn.commit()
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wrapper di un modello di embedding che passa dal cache su disco.
+
+    I vettori di documenti e query sono tenuti in namespace distinti perché
+    Gemini usa task type diversi (RETRIEVAL_DOCUMENT / RETRIEVAL_QUERY) e
+    produce vettori diversi per lo stesso testo. Le query sono indicizzate
+    per testo normalizzato e, se `query_memo` è dato, passano prima dal
+    LRU in memoria. `store` può essere None per usare solo il LRU.
+    """
+
+    def __init__(self, underlying, model_name, store=None, query_memo=None):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.store = store
+        self.query_memo = query_memo
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def text_hash(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _embed_cached(self, namespace, texts, embed_fn):
+        hashes = [self.text_hash(text) for text in texts]
+        cached = self.store.get_many(namespace, hashes)
+        missing = {}
+        for text, h in zip(texts, hashes):
+            if h not in cached and h not in missing:
+                missing[h] = text
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            vectors = embed_fn(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            self.store.put_many(namespace, new_items)
+            cached.update(new_items)
+        return [list(cached[h]) for h in hashes]
+
+    def lookup_documents(self, texts):
+        """Vettori già in cache per `texts` (None dove mancano), senza chiamare l'API."""
+        if self.store is None:
+            return [None] * len(texts)
+        hashes = [self.text_hash(text) for text in texts]
+        cached = self.store.get_many(f"{self.model_name}:document", hashes)
+        return [cached.get(h) for h in hashes]
+
+    def embed_documents(self, texts):
+        if self.store is None:
+            return self.underlying.embed_documents(texts)
+        return self._embed_cached(f"{self.model_name}:document", texts, self.underlying.embed_documents)
+
+    def embed_query(self, text):
+        normalized = normalize_query_text(text)
+        memo_key = (self.model_name, normalized)
+        if self.query_memo is not None:
+            vector = self.query_memo.get(memo_key)
+            if vector is not None:
+                self.hits += 1
+                return list(vector)
+        vector = None
+        if self.store is not None:
+            namespace = f"{self.model_name}:query"
+            text_hash = self.text_hash(normalized)
+            vector = self.store.get_many(namespace, [text_hash]).get(text_hash)
+        if vector is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            vector = self.underlying.embed_query(text)
+            if self.store is not None:
+                self.store.put_many(namespace, [(text_hash, vector)])
+        if self.query_memo is not None:
+            self.query_memo.put(memo_key, vector)
+        return list(vector)
@@ -0,0 +1,99 @@
+"""
+Pipeline di embedding parallela per l'indicizzazione.
+
+Un produttore divide i testi in batch, un pool di worker chiama
+`embed_documents` in parallelo sotto un rate limiter adattivo guidato dai
+429, e un unico consumatore scrive i vettori in una matrice float32
+preallocata, pronta per essere aggiunta a un solo indice FAISS.
+"""
+
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+
+from embedding_cache import CachedEmbeddings
+from rate_limit import AdaptiveRateLimiter, call_with_backoff, is_retryable_error
+
+
+def _embed_batch(embeddings, texts, limiter, max_retries):
+    def attempt():
+        limiter.acquire()
+        return embeddings.embed_documents(texts)
+
+    def on_retry(error, attempt_number, delay):
+        limiter.on_throttle()
+        print(f"Rate limit sugli embedding (tentativo {attempt_number}/{max_retries}), "
+              f"intervallo portato a {limiter.interval:.2f}s: {error}")
+
+    vectors = call_with_backoff(attempt, max_retries=max_retries, on_retry=on_retry)
+    limiter.on_success()
+    return vectors
+
+
+def embed_texts(texts, embeddings, batch_size=100, workers=4, limiter=None, max_retries=5):
+    """
+    Calcola gli embedding di `texts` con `workers` chiamate concorrenti.
+
+    I testi già presenti nel cache degli embedding vengono letti subito e
+    non occupano il rate limiter.
+
+    Returns:
+        tuple: (matrice float32 n x dim nello stesso ordine di `texts`,
+        statistiche come dict)
+    """
+    limiter = limiter or AdaptiveRateLimiter()
+    started = time.perf_counter()
+    matrix = None
+    stats = {"vectors": len(texts), "embedded": 0, "cached": 0, "batches": 0}
+
+    def store(positions, vectors):
+        nonlocal matrix
+        if matrix is None:
+            matrix = np.empty((len(texts), len(vectors[0])), dtype=np.float32)
+        matrix[positions] = np.asarray(vectors, dtype=np.float32)
+
+    pending_positions = list(range(len(texts)))
+    if isinstance(embeddings, CachedEmbeddings):
+        cached = embeddings.lookup_documents(texts)
+        hit_positions = [i for i, vector in enumerate(cached) if vector is not None]
+        if hit_positions:
+            store(hit_positions, [cached[i] for i in hit_positions])
+        pending_positions = [i for i, vector in enumerate(cached) if vector is None]
+        stats["cached"] = len(hit_positions)
+
+    # Produttore: batch di posizioni ancora da embeddare
+    batches = iter(
+        pending_positions[i:i + batch_size] for i in range(0, len(pending_positions), batch_size)
+    )
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = {}
+
+        def submit_next():
+            positions = next(batches, None)
+            if positions is None:
+                return False
+            future = executor.submit(
+                _embed_batch, embeddings, [texts[i] for i in positions], limiter, max_retries
+            )
+            in_flight[future] = positions
+            return True
+
+        # Al massimo due batch per worker in coda, per limitare la memoria
+        while len(in_flight) < workers * 2 and submit_next():
+            pass
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                positions = in_flight.pop(future)
+                store(positions, future.result())
+                stats["embedded"] += len(positions)
+                stats["batches"] += 1
+                print(f"Embedding: {stats['cached'] + stats['embedded']}/{len(texts)} vettori")
+                submit_next()
+
+    stats["seconds"] = time.perf_counter() - started
+    stats["throttled"] = limiter.throttled
+    if matrix is None:
+        matrix = np.empty((0, 0), dtype=np.float32)
+    return matrix, stats
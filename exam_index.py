@@ -0,0 +1,283 @@
+"""
+Indice strutturato degli esami dei corsi, costruito in fase di indicizzazione.
+
+Per ogni pagina di corso le tabelle e gli elenchi del piano di studi sono
+estratti con `parse_clean_exams` e salvati in `index/exams.json` come
+corso → curriculum → anno → tipo → esami. Le domande che chiedono
+esplicitamente l'elenco o il numero degli esami di un corso ("quali
+esami", "quanti insegnamenti", "elenca le materie") ricevono una risposta
+deterministica da questa tabella, senza retrieval né LLM. Le altre
+domande che nominano gli esami (date, crediti, sbocchi, ...) proseguono
+nella catena RAG.
+"""
+
+import glob
+import json
+import os
+import re
+
+from chain_layers import LayeredChain
+from lexical_index import match_title, page_title, tokenize
+
+EXAM_INDEX_FILENAME = "exams.json"
+EXAM_INDEX_VERSION = 1
+# Versione delle regole di risposta: entra nella chiave del cache esatto delle risposte,
+# così una correzione delle regole non lascia in cache le risposte vecchie
+EXAM_ANSWER_VERSION = 2
+DEFAULT_CURRICULUM = "generale"
+DEFAULT_YEAR = "generico"
+
+YEAR_NAMES = {
+    "primo": "primo anno", "1°": "primo anno", "first": "primo anno",
+    "secondo": "secondo anno", "2°": "secondo anno", "second": "secondo anno",
+    "terzo": "terzo anno", "3°": "terzo anno", "third": "terzo anno",
+}
+YEAR_ORDER = ["primo anno", "secondo anno", "terzo anno", DEFAULT_YEAR]
+
+_YEAR_RE = re.compile(r"(primo|secondo|terzo|1°|2°|3°|first|second|third)[^\w]{0,5}(anno|year)", re.I)
+_CURRICULUM_HEADING_RE = re.compile(
+    r"^#{1,4}\s+(.*\b(curriculum|indirizzo|percorso|profilo|track|piano di studi|study plan)\b.*)$", re.I
+)
+# Richiesta esplicita di elenco o conteggio vicina al nome degli esami
+_EXAM_QUESTION_RE = re.compile(
+    r"\b(quali|quanti|quante|elenc\w*|lista|numero|which|how many|list)\b.{0,20}"
+    r"\b(esami|esame|exams?|insegnamenti|materie)\b", re.I
+)
+# Domande su altro che nominano gli esami: risponde la catena RAG
+_OTHER_EXAM_TOPIC_RE = re.compile(
+    r"\b(quando|date?|appell\w*|orari\w*|calendari\w*|sessione|cfu|crediti|credits|sbocch\w*|lavor\w*|"
+    r"voto|voti|iscri\w*|prenot\w*|come|perch[eé])\b", re.I
+)
+_COUNT_QUESTION_RE = re.compile(r"\b(quanti|quante|numero|how many)\b", re.I)
+_ELECTIVE_RE = re.compile(r"\b(a scelta|scelta libera|opzional\w*|elective\w*)\b", re.I)
+_MANDATORY_RE = re.compile(r"\b(obbligatori\w*|mandatory|required)\b", re.I)
+_NAME_COLUMNS = ("course", "insegnamento", "insegnamenti", "esame", "attività formativa", "nome")
+_SKIP_WORDS = ["credits", "programme", "thesis", "seminar", "cfu", "download"]
+
+
+def parse_clean_exams(text):
+    """
+    Esami di un testo Markdown raggruppati per (anno, tipo).
+
+    Sono raccolte le righe di elenco e di tabella che seguono un'indicazione
+    di anno o di tipo; un titolo che non parla di anni, tipi o esami (es.
+    "Sbocchi professionali") chiude la sezione degli esami.
+    """
+    results = {}
+    anno = None
+    tipo = "obbligatori"
+    in_exams = False
+    name_col = 1
+    lines = text.splitlines()
+    for idx, line in enumerate(lines):
+        l = line.strip()
+        if not l:
+            continue
+        lower = l.lower()
+        # Anno riconosciuto
+        m_anno = _YEAR_RE.search(l)
+        if m_anno:
+            anno = m_anno.group(0).lower()
+            in_exams = True
+        # Tipo (elective)
+        if any(x in lower for x in ["a scelta", "elective", "opzionali"]):
+            tipo = "a scelta"
+            in_exams = True
+        if any(x in lower for x in ["obbligatori", "required"]):
+            tipo = "obbligatori"
+            in_exams = True
+        if l.startswith("#"):
+            if not (m_anno or any(x in lower for x in ["a scelta", "elective", "opzionali", "obbligatori",
+                                                       "required", "esami", "insegnament", "exams"])):
+                in_exams = False
+            continue
+        # Riga tabella "| Course | nome"
+        if "|" in l:
+            if l.startswith("| ---"):
+                continue
+            items = [x.strip() for x in l.split("|") if x.strip()]
+            next_line = lines[idx + 1].strip() if idx + 1 < len(lines) else ""
+            if next_line.startswith("| ---"):
+                # Intestazione della tabella: la colonna con il nome dell'esame
+                header = [x.lower() for x in items]
+                name_columns = [i for i, x in enumerate(header) if x in _NAME_COLUMNS]
+                if name_columns:
+                    name_col = name_columns[0]
+                    in_exams = True
+                continue
+            if in_exams and len(items) > name_col and not any(xx in items[name_col].lower() for xx in _SKIP_WORDS):
+                key = (anno or DEFAULT_YEAR, tipo)
+                if items[name_col] and len(items[name_col]) > 3 and not items[name_col].isdigit():
+                    results.setdefault(key, []).append(items[name_col])
+            continue
+        # Riga esame pulito ("- Nome" o "* Nome", con SSD opzionale tra parentesi)
+        m_exam = re.match(r"[-*]\s+([^\|].+?)\s*(\([A-Z\-\/\d]+\))?$", l)
+        if in_exams and m_exam and not any(xx in m_exam.group(1).lower() for xx in _SKIP_WORDS):
+            key = (anno or DEFAULT_YEAR, tipo)
+            results.setdefault(key, []).append(m_exam.group(1).strip())
+    for k in results:
+        seen = set()
+        results[k] = [x for x in results[k] if not (x in seen or seen.add(x))]
+    return results
+
+
+def normalize_year(anno):
+    match = _YEAR_RE.search(anno)
+    return YEAR_NAMES.get(match.group(1).lower(), DEFAULT_YEAR) if match else DEFAULT_YEAR
+
+
+def split_curricula(text):
+    """Divide una pagina nelle sezioni dei curriculum / piani di studio: [(nome, testo)]."""
+    sections = []
+    name, lines = DEFAULT_CURRICULUM, []
+    for line in text.splitlines():
+        heading = _CURRICULUM_HEADING_RE.match(line.strip())
+        if heading:
+            if lines:
+                sections.append((name, "\n".join(lines)))
+            name, lines = heading.group(1).strip(), []
+        lines.append(line)
+    sections.append((name, "\n".join(lines)))
+    return sections
+
+
+def extract_course_exams(text):
+    """
+    Esami di una pagina di corso come {curriculum: {anno: {tipo: [esami]}}};
+    dict vuoto se la pagina non contiene esami.
+    """
+    curricula = {}
+    for name, section in split_curricula(text):
+        years = {}
+        for (anno, tipo), exams in parse_clean_exams(section).items():
+            types = years.setdefault(normalize_year(anno), {})
+            merged = types.setdefault(tipo, [])
+            merged.extend(exam for exam in exams if exam not in merged)
+        if years:
+            curricula[name] = years
+    return curricula
+
+
+def exam_index_path(vectorstore_path):
+    return os.path.join(vectorstore_path, EXAM_INDEX_FILENAME)
+
+
+class ExamIndex:
+    """Tabella corso → curriculum → anno → tipo → esami con le risposte deterministiche."""
+
+    def __init__(self, courses):
+        self.courses = courses  # {corso: {"source": file, "curricula": {...}}}
+
+    @classmethod
+    def build(cls, markdown_dir):
+        courses = {}
+        for path in sorted(glob.glob(os.path.join(markdown_dir, "**", "*.md"), recursive=True)):
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            title = page_title(text)
+            if not title:
+                continue
+            curricula = extract_course_exams(text)
+            # Con più pagine per lo stesso corso vince quella con più esami
+            if curricula and (title not in courses or _exam_count(curricula) > _exam_count(courses[title]["curricula"])):
+                courses[title] = {"source": path, "curricula": curricula}
+        return cls(courses)
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": EXAM_INDEX_VERSION, "courses": self.courses}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != EXAM_INDEX_VERSION:
+            raise ValueError(f"Versione dell'indice esami non supportata: {data.get('version')}")
+        return cls(data["courses"])
+
+    def __len__(self):
+        return len(self.courses)
+
+    def answer(self, question):
+        """
+        Risposta deterministica a una domanda sugli esami di un corso, o None
+        se la domanda non riguarda gli esami o non cita un corso noto.
+        """
+        if not _EXAM_QUESTION_RE.search(question) or _OTHER_EXAM_TOPIC_RE.search(question):
+            return None
+        course = match_title(question, self.courses)
+        if course is None:
+            return None
+        curricula = self.courses[course]["curricula"]
+        curriculum = _pick_curriculum(question, curricula)
+        if curriculum is None:
+            names = "\n".join(f"- {name}" for name in curricula)
+            return (f"Il corso {course} ha più curriculum:\n{names}\n"
+                    "Per quale curriculum vuoi conoscere gli esami?")
+        year_match = _YEAR_RE.search(question)
+        years = [normalize_year(year_match.group(0))] if year_match else YEAR_ORDER
+        if _ELECTIVE_RE.search(question):
+            types = ["a scelta"]
+        elif _MANDATORY_RE.search(question):
+            types = ["obbligatori"]
+        else:
+            types = ["obbligatori", "a scelta"]
+
+        groups = []
+        plan = curricula[curriculum]
+        for year in years:
+            for tipo in types:
+                exams = plan.get(year, {}).get(tipo)
+                if exams:
+                    groups.append((year, tipo, exams))
+        where = course if curriculum == DEFAULT_CURRICULUM else f"{course} ({curriculum})"
+        if not groups:
+            return None  # combinazione non presente nella tabella: decide la catena RAG
+        if _COUNT_QUESTION_RE.search(question):
+            # Gli esami a scelta offerti in più anni vanno contati una volta sola
+            total = len({exam.casefold() for _, _, exams in groups for exam in exams})
+            lines = [f"Nel corso {where} ci sono {total} esami diversi:"]
+            lines += [f"- {year}, {tipo}: {len(exams)}" for year, tipo, exams in groups]
+            return "\n".join(lines)
+        lines = [f"Esami del corso {where}:"]
+        for year, tipo, exams in groups:
+            label = year.capitalize() if year != DEFAULT_YEAR else "Senza anno indicato"
+            lines.append(f"\n{label} - esami {tipo}:")
+            lines += [f"- {exam}" for exam in exams]
+        return "\n".join(lines)
+
+    def wrap(self, rag_chain):
+        """Restituisce la catena `rag_chain` preceduta dalle risposte deterministiche."""
+        return LayeredChain(lambda input: self.answer(input["input"]), rag_chain)
+
+
+def _exam_count(curricula):
+    return sum(len(exams) for years in curricula.values() for types in years.values() for exams in types.values())
+
+
+def _pick_curriculum(question, curricula):
+    """Curriculum citato nella domanda, l'unico disponibile, o None se va chiesto."""
+    if len(curricula) == 1:
+        return next(iter(curricula))
+    question_tokens = set(tokenize(question))
+    scored = []
+    for name in curricula:
+        distinctive = set(tokenize(name)) - {"curriculum", "indirizzo", "percorso", "profilo", "track",
+                                             "piano", "studi", "study", "plan"}
+        if distinctive and distinctive <= question_tokens:
+            scored.append((len(distinctive), name))
+    return max(scored)[1] if scored else None
+
+
+def load_exam_index(vectorstore_path):
+    """Carica l'indice degli esami salvato accanto all'indice FAISS, o None se assente."""
+    path = exam_index_path(vectorstore_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        return ExamIndex.load(path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Indice esami non utilizzabile ({e}): le domande sugli esami passano dalla catena RAG.")
+        return None
@@ -0,0 +1,94 @@
+"""
+Costruzione degli indici FAISS del vectorstore a partire da una stringa di
+`faiss.index_factory`.
+
+Tipi tipici, tutti con distanza L2 come l'indice flat di LangChain:
+    "Flat"            ricerca esatta, un vettore float32 per chunk
+    "HNSW32"          grafo HNSW: ricerca sub-lineare, memoria un po' sopra il flat
+    "IVF{nlist},PQ32" liste invertite + product quantization: poca memoria, ricerca approssimata
+    "SQfp16", "SQ8"   quantizzazione scalare a 16 o 8 bit per componente
+
+`{nlist}` viene sostituito con un numero di liste adatto al numero di
+vettori. Con `dim` le componenti sono ridotte prima dell'indice da una PCA
+con rotazione (`PCAR`), applicata dentro FAISS anche ai vettori di query.
+Gli indici che richiedono addestramento sono addestrati su un campione dei
+vettori; se i vettori sono troppo pochi per addestrarli si ripiega sul flat.
+"""
+
+import faiss
+import numpy as np
+
+DEFAULT_FACTORY = "Flat"
+MIN_NLIST = 16
+MAX_NLIST = 65536
+
+
+def default_nlist(n_vectors):
+    """Numero di liste IVF: circa 4·√n, con almeno ~40 vettori di addestramento per lista."""
+    nlist = int(4 * np.sqrt(max(n_vectors, 1)))
+    return int(max(MIN_NLIST, min(MAX_NLIST, nlist, n_vectors // 39 or MIN_NLIST)))
+
+
+def factory_string(factory, n_vectors, dim=None):
+    """Stringa per faiss.index_factory con `{nlist}` risolto e la PCA opzionale in testa."""
+    factory = (factory or DEFAULT_FACTORY).format(nlist=default_nlist(n_vectors))
+    if dim:
+        factory = f"PCAR{dim},{factory}"
+    return factory
+
+
+def build_index(vectors, factory=DEFAULT_FACTORY, dim=None, train_sample=50_000, seed=0):
+    """
+    Crea, addestra se serve e popola un indice FAISS con `vectors` (float32, n × d).
+
+    Returns:
+        tuple: (indice, stringa factory effettivamente usata)
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    n_vectors, d = vectors.shape
+    spec = factory_string(factory, n_vectors, dim)
+    index = faiss.index_factory(d, spec, faiss.METRIC_L2)
+    if not index.is_trained:
+        sample = vectors
+        if n_vectors > train_sample:
+            rng = np.random.default_rng(seed)
+            sample = vectors[rng.choice(n_vectors, train_sample, replace=False)]
+        try:
+            index.train(sample)
+        except RuntimeError as e:
+            print(f"Addestramento dell'indice {spec} non possibile con {len(sample)} vettori ({e}): uso Flat.")
+            spec = factory_string(DEFAULT_FACTORY, n_vectors)
+            index = faiss.index_factory(d, spec, faiss.METRIC_L2)
+    index.add(vectors)
+    return index, spec
+
+
+def _base_index(index):
+    """Indice sotto eventuali trasformazioni (PCA), con il tipo concreto."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexPreTransform):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+def supports_removal(index):
+    """
+    True se l'indice compatta gli id dopo remove_ids, come si aspetta
+    FAISS.delete di LangChain: vale per gli indici a codici piatti (Flat,
+    SQ, PQ); HNSW non supporta la rimozione e IVF mantiene gli id originali.
+    """
+    return isinstance(_base_index(index), faiss.IndexFlatCodes)
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """Imposta i parametri di ricerca: liste visitate (IVF) e ampiezza della ricerca (HNSW)."""
+    base = _base_index(index)
+    if nprobe and isinstance(base, faiss.IndexIVF):
+        base.nprobe = min(nprobe, base.nlist)
+    if ef_search and isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = ef_search
+
+
+def index_memory_bytes(index):
+    """Byte occupati dall'indice serializzato (≈ memoria residente)."""
+    return int(faiss.serialize_index(index).size)
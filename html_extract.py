@@ -0,0 +1,134 @@
+"""
+Estrazione del contenuto principale e dei link da una pagina HTML con un
+solo parsing.
+
+Ogni estrattore analizza la pagina una volta e dallo stesso albero ricava
+sia il Markdown del contenuto principale sia i link. Sono disponibili:
+
+- "bs4": BeautifulSoup con il parser `html.parser` (sempre disponibile)
+- "lxml": BeautifulSoup con il parser C `lxml`
+- "selectolax": parser C Lexbor e conversione Markdown con `html_to_markdown`
+
+`get_extractor("auto")` usa lxml se installato, altrimenti bs4: entrambi
+producono lo stesso Markdown del crawler originale. "selectolax" è molto
+più veloce ma il suo Markdown è formattato in modo leggermente diverso
+(tabelle, spazi), quindi va scelto esplicitamente: cambiarlo comporta la
+reindicizzazione di tutte le pagine.
+"""
+
+from urllib.parse import urljoin, urlparse
+
+from bs4 import BeautifulSoup
+from markdownify import MarkdownConverter
+
+# Tag comuni per il contenuto principale, in ordine di preferenza
+MAIN_CONTENT_SELECTORS = ['main', 'article', 'div[class*="content"]', 'div[id*="content"]']
+
+
+def normalize_link(base_url, href):
+    """URL assoluto senza query string né frammento."""
+    absolute_url = urljoin(base_url, href)
+    return urlparse(absolute_url)._replace(query='', fragment='').geturl()
+
+
+class SoupExtractor:
+    """Estrattore BeautifulSoup + markdownify, con backend configurabile."""
+
+    def __init__(self, parser='html.parser'):
+        self.parser = parser
+        self.name = 'bs4' if parser == 'html.parser' else parser
+        self._converter = MarkdownConverter(heading_style='atx')
+
+    def parse(self, html_content):
+        return BeautifulSoup(html_content, self.parser)
+
+    def content_markdown(self, soup):
+        """Markdown del contenuto principale, o None se la pagina non ha un <body>."""
+        content_element = None
+        for selector in MAIN_CONTENT_SELECTORS:
+            content_element = soup.select_one(selector)
+            if content_element:
+                break
+        if not content_element:  # Fallback al body se non trova un main specifico
+            content_element = soup.body
+        if not content_element:
+            return None
+        # Converte direttamente il sottoalbero, senza serializzarlo e riparsarlo;
+        # come markdownify() sull'intero documento, rimuove gli a capo esterni
+        return self._converter.convert_soup(content_element).strip()
+
+    def links(self, soup, url):
+        return [normalize_link(url, a_tag['href']) for a_tag in soup.find_all('a', href=True)]
+
+
+def _fast_markdown(html_content):
+    """Converte HTML in Markdown con html_to_markdown (API v1/v2 o v3)."""
+    import html_to_markdown
+    if hasattr(html_to_markdown, 'convert_to_markdown'):
+        return html_to_markdown.convert_to_markdown(html_content, heading_style='atx')
+    options = html_to_markdown.ConversionOptions(heading_style='atx')
+    return html_to_markdown.convert(html_content, options).content
+
+
+class SelectolaxExtractor:
+    """Estrattore basato su selectolax (Lexbor) e html_to_markdown."""
+
+    name = 'selectolax'
+
+    def __init__(self):
+        from selectolax.lexbor import LexborHTMLParser
+        self._parser_cls = LexborHTMLParser
+
+    def parse(self, html_content):
+        return self._parser_cls(html_content)
+
+    def content_markdown(self, tree):
+        content_element = None
+        for selector in MAIN_CONTENT_SELECTORS:
+            content_element = tree.css_first(selector)
+            if content_element is not None:
+                break
+        if content_element is None:
+            content_element = tree.body
+        if content_element is None:
+            return None
+        return _fast_markdown(content_element.html)
+
+    def links(self, tree, url):
+        return [normalize_link(url, node.attributes['href'])
+                for node in tree.css('a[href]') if node.attributes.get('href') is not None]
+
+
+def _module_available(name):
+    try:
+        __import__(name)
+        return True
+    except ImportError:
+        return False
+
+
+def available_extractors():
+    """Nomi degli estrattori utilizzabili con i pacchetti installati."""
+    names = ['bs4']
+    if _module_available('lxml'):
+        names.append('lxml')
+    if _module_available('selectolax') and _module_available('html_to_markdown'):
+        names.append('selectolax')
+    return names
+
+
+def get_extractor(name='auto'):
+    """
+    Restituisce l'estrattore `name`; con "auto" lxml se installato, altrimenti bs4.
+
+    Raises:
+        ValueError: se l'estrattore richiesto non esiste o non è installato.
+    """
+    available = available_extractors()
+    if name == 'auto':
+        name = 'lxml' if 'lxml' in available else 'bs4'
+    if name not in available:
+        raise ValueError(f"Estrattore HTML non disponibile: {name} (disponibili: {', '.join(available)})")
+    if name == 'selectolax':
+        return SelectolaxExtractor()
+    return SoupExtractor('lxml' if name == 'lxml' else 'html.parser')
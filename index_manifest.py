@@ -0,0 +1,125 @@
+"""
+Manifest dell'indice FAISS: per ogni file sorgente e per ogni suo chunk
+registra l'hash del contenuto e l'id nel docstore, così che la
+reindicizzazione possa embeddare solo i chunk nuovi o modificati.
+"""
+
+import hashlib
+import json
+import os
+
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_VERSION = 2
+
+
+def content_hash(text):
+    """sha256 esadecimale di un testo."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_hash(chunk):
+    """
+    Hash di un chunk: contenuto più metadati, così che un cambiamento dei
+    metadati (es. nuove sorgenti di un chunk deduplicato) aggiorni il docstore.
+    """
+    metadata = json.dumps(chunk.metadata, sort_keys=True, ensure_ascii=False, default=str)
+    return content_hash(chunk.page_content + "\0" + metadata)
+
+
+def manifest_path(vectorstore_path):
+    return os.path.join(vectorstore_path, MANIFEST_FILENAME)
+
+
+def load_manifest(vectorstore_path):
+    """Carica il manifest dell'indice, o None se assente o illeggibile."""
+    try:
+        with open(manifest_path(vectorstore_path), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(vectorstore_path, manifest):
+    """Scrive il manifest in modo atomico accanto ai file dell'indice."""
+    os.makedirs(vectorstore_path, exist_ok=True)
+    path = manifest_path(vectorstore_path)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def new_manifest(embedding_model, index_factory="Flat", index_dim=None):
+    return {"version": MANIFEST_VERSION, "embedding_model": embedding_model,
+            "index_factory": index_factory, "index_dim": index_dim, "sources": {}}
+
+
+def group_by_source(documents):
+    """Raggruppa i chunk per file sorgente mantenendo l'ordine."""
+    grouped = {}
+    for doc in documents:
+        grouped.setdefault(doc.metadata.get("source", ""), []).append(doc)
+    return grouped
+
+
+def build_source_entry(chunks, ids=None):
+    """Voce del manifest per un file: hash complessivo e (hash, id) di ogni chunk."""
+    hashes = [chunk_hash(chunk) for chunk in chunks]
+    ids = ids or [None] * len(chunks)
+    return {
+        "hash": content_hash("\n".join(hashes)),
+        "chunks": [{"hash": h, "id": doc_id} for h, doc_id in zip(hashes, ids)],
+    }
+
+
+def plan_update(manifest, documents):
+    """
+    Confronta i chunk attuali con il manifest.
+
+    Returns:
+        tuple: (to_add, to_delete, sources) dove `to_add` è la lista di
+        (source, posizione, chunk) da embeddare, `to_delete` gli id del
+        docstore da rimuovere e `sources` la nuova sezione "sources" del
+        manifest, con id None per i chunk ancora da aggiungere.
+    """
+    old_sources = manifest.get("sources", {})
+    sources = {}
+    to_add = []
+    to_delete = []
+    for source, chunks in group_by_source(documents).items():
+        entry = build_source_entry(chunks)
+        old_entry = old_sources.get(source)
+        if old_entry and old_entry["hash"] == entry["hash"]:
+            sources[source] = old_entry
+            continue
+        # Riusa gli id dei chunk invariati (anche se spostati nel file)
+        reusable = {}
+        for old_chunk in (old_entry or {}).get("chunks", []):
+            reusable.setdefault(old_chunk["hash"], []).append(old_chunk["id"])
+        for position, (chunk, chunk_entry) in enumerate(zip(chunks, entry["chunks"])):
+            ids = reusable.get(chunk_entry["hash"])
+            if ids:
+                chunk_entry["id"] = ids.pop(0)
+            else:
+                to_add.append((source, position, chunk))
+        to_delete.extend(doc_id for ids in reusable.values() for doc_id in ids)
+        sources[source] = entry
+    for source, old_entry in old_sources.items():
+        if source not in sources:
+            to_delete.extend(chunk["id"] for chunk in old_entry["chunks"])
+    return to_add, to_delete, sources
+
+
+def chunk_ids(documents, sources):
+    """Id del docstore di ogni chunk di `documents`, secondo la sezione "sources" del manifest."""
+    positions = {}
+    ids = []
+    for doc in documents:
+        source = doc.metadata.get("source", "")
+        position = positions.get(source, 0)
+        positions[source] = position + 1
+        ids.append(sources[source]["chunks"][position]["id"])
+    return ids
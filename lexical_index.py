@@ -0,0 +1,247 @@
+"""
+Indice lessicale BM25 dei chunk e recupero ibrido lessicale + vettoriale.
+
+L'indice invertito è costruito sugli stessi chunk dell'indice FAISS, con
+gli stessi id del docstore, e salvato come JSON accanto ai file FAISS.
+Molte domande citano il nome esatto di un corso: quando la domanda
+contiene per intero il titolo di una pagina, il recupero usa solo BM25 e
+non chiama l'API degli embedding. Negli altri casi i risultati lessicali
+e vettoriali sono fusi con Reciprocal Rank Fusion.
+"""
+
+import json
+import math
+import os
+import re
+import unicodedata
+from difflib import SequenceMatcher
+
+import numpy as np
+
+LEXICAL_INDEX_FILENAME = "bm25.json"
+LEXICAL_INDEX_VERSION = 1
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_TITLE_RE = re.compile(r"^# (?!Pagina: )(.+)$", re.MULTILINE)
+STOPWORDS = frozenset(
+    "il lo la i gli le un uno una di del dello della dei degli delle a al allo alla ai agli alle "
+    "da dal dallo dalla dai dagli dalle in nel nello nella nei negli nelle su sul sullo sulla sui "
+    "sugli sulle con per tra fra e o ed che chi cosa come quale quali quanto quanti quante ci si "
+    "è sono c corso corsi the of and or for to in on at by with an a".split()
+)
+
+
+def tokenize(text):
+    """Token minuscoli senza accenti, senza stopword né token di un carattere."""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return [t for t in _TOKEN_RE.findall(text) if len(t) > 1 and t not in STOPWORDS]
+
+
+def page_title(text):
+    """Primo titolo di livello 1 del contenuto, esclusa l'intestazione del crawler."""
+    match = _TITLE_RE.search(text)
+    return match.group(1).strip() if match else None
+
+
+def _token_close(token, query_tokens, cutoff):
+    if token in query_tokens:
+        return True
+    if len(token) < 4:
+        return False
+    for candidate in query_tokens:
+        matcher = SequenceMatcher(None, token, candidate)
+        if matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff and matcher.ratio() >= cutoff:
+            return True
+    return False
+
+
+def match_title(query, titles, cutoff=0.75):
+    """
+    Titolo di `titles` citato nella domanda, tollerando errori di battitura
+    (similarità dei token >= `cutoff`). Tra più titoli vince quello con più
+    token; None se nessun titolo è citato.
+    """
+    query_tokens = set(tokenize(query))
+    best, best_key = None, None
+    for title in titles:
+        title_tokens = tokenize(title)
+        if not title_tokens or not all(_token_close(t, query_tokens, cutoff) for t in title_tokens):
+            continue
+        key = (len(title_tokens), sum(t in query_tokens for t in title_tokens))
+        if best_key is None or key > best_key:
+            best, best_key = title, key
+    return best
+
+
+def lexical_index_path(vectorstore_path):
+    return os.path.join(vectorstore_path, LEXICAL_INDEX_FILENAME)
+
+
+class BM25Index:
+    """Indice invertito BM25 con posting list compatte [doc, tf, doc, tf, ...]."""
+
+    def __init__(self, ids, lengths, titles, postings, k1=1.5, b=0.75):
+        self.ids = ids
+        self.lengths = lengths
+        self.titles = titles  # titolo normalizzato (tuple di token) per documento, o None
+        self.postings = postings
+        self.k1 = k1
+        self.b = b
+        self.avg_length = (sum(lengths) / len(lengths)) if lengths else 0.0
+
+    @classmethod
+    def build(cls, documents, ids, **params):
+        postings = {}
+        lengths = []
+        titles = []
+        for position, doc in enumerate(documents):
+            tokens = tokenize(doc.page_content)
+            lengths.append(len(tokens))
+            title = page_title(doc.page_content)
+            titles.append(tuple(tokenize(title)) if title else None)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                postings.setdefault(token, []).extend((position, tf))
+        return cls(list(ids), lengths, titles, postings, **params)
+
+    def save(self, path):
+        data = {
+            "version": LEXICAL_INDEX_VERSION,
+            "k1": self.k1,
+            "b": self.b,
+            "ids": self.ids,
+            "lengths": self.lengths,
+            "titles": [list(t) if t else None for t in self.titles],
+            "postings": self.postings,
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != LEXICAL_INDEX_VERSION:
+            raise ValueError(f"Versione dell'indice BM25 non supportata: {data.get('version')}")
+        titles = [tuple(t) if t else None for t in data["titles"]]
+        return cls(data["ids"], data["lengths"], titles, data["postings"], data["k1"], data["b"])
+
+    def scores(self, query_tokens):
+        """Punteggi BM25 {posizione: punteggio} dei documenti che contengono i token."""
+        n_docs = len(self.ids)
+        scores = {}
+        for token in set(query_tokens):
+            posting = self.postings.get(token)
+            if not posting:
+                continue
+            df = len(posting) // 2
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for i in range(0, len(posting), 2):
+                position, tf = posting[i], posting[i + 1]
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[position] / self.avg_length)
+                scores[position] = scores.get(position, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query, k=10):
+        """Lista di (id del docstore, punteggio) in ordine decrescente."""
+        scores = self.scores(tokenize(query))
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.ids[position], score) for position, score in best]
+
+    def title_matches(self, query):
+        """
+        Posizioni dei documenti il cui titolo (almeno due token) compare per
+        intero nella domanda.
+        """
+        query_tokens = set(tokenize(query))
+        return [
+            position for position, title in enumerate(self.titles)
+            if title and len(title) >= 2 and query_tokens.issuperset(title)
+        ]
+
+
+def load_lexical_index(vectorstore_path):
+    """Carica l'indice BM25 salvato accanto all'indice FAISS, o None se assente."""
+    path = lexical_index_path(vectorstore_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        return BM25Index.load(path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Indice BM25 non utilizzabile ({e}): uso solo il recupero vettoriale.")
+        return None
+
+
+def embedding_free(lexical_index, query, mode="hybrid"):
+    """True se HybridRetriever serve `query` senza embedding (modalità lessicale o titolo citato)."""
+    return mode == "lexical" or bool(lexical_index.title_matches(query))
+
+
+class HybridRetriever:
+    """
+    Retriever con la stessa interfaccia `invoke(query)` di quello di FAISS.
+
+    Modalità:
+    - "hybrid": fusione RRF dei primi `candidates` risultati BM25 e vettoriali,
+      con il percorso solo lessicale se la domanda contiene un titolo di pagina
+    - "lexical": solo BM25
+    """
+
+    def __init__(self, vectorstore, lexical_index, k=10, mode="hybrid", candidates=30, rrf_k=60):
+        self.vectorstore = vectorstore
+        self.lexical_index = lexical_index
+        self.k = k
+        self.mode = mode
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.lexical_only = 0  # query servite senza chiamare l'API degli embedding
+
+    def _documents(self, ids):
+        docs = []
+        for doc_id in ids:
+            doc = self.vectorstore.docstore.search(doc_id)
+            if not isinstance(doc, str):  # il docstore restituisce un messaggio se l'id manca
+                docs.append(doc)
+        return docs
+
+    def _vector_ids(self, query, n):
+        vector = np.asarray([self.vectorstore.embeddings.embed_query(query)], dtype=np.float32)
+        _, positions = self.vectorstore.index.search(vector, n)
+        return [self.vectorstore.index_to_docstore_id[p] for p in positions[0] if p != -1]
+
+    def _title_fast_path(self, query):
+        """Id dei chunk per una domanda che cita un titolo di pagina, o None."""
+        matches = self.lexical_index.title_matches(query)
+        if not matches:
+            return None
+        # Prima i chunk delle pagine citate, poi gli altri risultati BM25
+        scores = self.lexical_index.scores(tokenize(query))
+        ranked = sorted(matches, key=lambda position: scores.get(position, 0.0), reverse=True)
+        ids = [self.lexical_index.ids[position] for position in ranked[:self.k]]
+        for doc_id, _ in self.lexical_index.search(query, self.k):
+            if len(ids) >= self.k:
+                break
+            if doc_id not in ids:
+                ids.append(doc_id)
+        return ids
+
+    def invoke(self, query):
+        if self.mode == "lexical":
+            self.lexical_only += 1
+            return self._documents([doc_id for doc_id, _ in self.lexical_index.search(query, self.k)])
+        ids = self._title_fast_path(query)
+        if ids is not None:
+            self.lexical_only += 1
+            return self._documents(ids)
+        fused = {}
+        lexical_ids = [doc_id for doc_id, _ in self.lexical_index.search(query, self.candidates)]
+        for ranking in (lexical_ids, self._vector_ids(query, self.candidates)):
+            for rank, doc_id in enumerate(ranking):
+                fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        best = sorted(fused, key=fused.get, reverse=True)[:self.k]
+        return self._documents(best)
@@ -10,8 +10,6 @@ import os
 from datetime import datetime
 from typing import Dict, List, Any
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.prompts import ChatPromptTemplate
 
 # Carica le variabili d'ambiente
 load_dotenv()
@@ -50,8 +48,10 @@ def load_evaluation_data(json_file: str) -> List[Dict[str, Any]]:
         print(f"Errore nel caricamento del file JSON: {e}")
         return []
 
-def create_judge_prompt() -> ChatPromptTemplate:
+def create_judge_prompt() -> "ChatPromptTemplate":
     """Crea il prompt per il giudizio LLM."""
+    # Import rimandato: LangChain serve solo quando si valuta davvero
+    from langchain.prompts import ChatPromptTemplate
     
     system_message = """Sei un giudice esperto che valuta la qualità e correttezza delle risposte di un chatbot universitario.
 
@@ -107,6 +107,7 @@ Valuta se le due risposte sono semanticamente equivalenti e rispondi in formato
 def initialize_llm():
     """Inizializza il modello LLM."""
     try:
+        from langchain_google_genai import ChatGoogleGenerativeAI
         llm = ChatGoogleGenerativeAI(
             model=MODEL_NAME_LLM, 
             temperature=0.1,
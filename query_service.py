@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Servizio HTTP locale per interrogare StudentsBot senza pagare l'avvio a ogni
+domanda.
+
+Il vectorstore e la catena RAG vengono caricati una sola volta all'avvio e
+condivisi da un pool di thread che serve le richieste concorrenti.
+
+Endpoint:
+    POST   /query            {"question": "..."}  → {"answer": ..., "latency_ms": ...}
+    POST   /chat/<sessione>  {"question": "..."}  → come /query, con la storia della sessione
+    DELETE /chat/<sessione>  dimentica la storia della sessione
+    GET    /health           stato del servizio e dell'indice
+    GET    /stats            latenze (media, p50, p95, p99) per endpoint e statistiche dei cache
+
+Con `--offline` gli embedding e il modello Gemini sono sostituiti da quelli
+finti di langchain_core, per provare il servizio senza rete né chiavi API.
+"""
+
+import json
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from dotenv import load_dotenv
+
+import bot_review
+from bot_review import get_engine, new_chat_history, query_chatbot
+from chat_sessions import ChatSessions
+
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8000
+SERVICE_WORKERS = 8  # richieste servite in parallelo
+LATENCY_WINDOW = 1000  # latenze recenti tenute per endpoint
+MAX_REQUEST_BYTES = 64 * 1024
+OFFLINE_EMBEDDING_SIZE = 768  # come models/embedding-001, per usare l'indice esistente
+
+
+class LatencyStats:
+    """Latenze recenti ed errori per endpoint, aggiornabili da più thread."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._counts = {}
+
+    def record(self, endpoint, seconds, ok=True):
+        with self._lock:
+            self._samples.setdefault(endpoint, deque(maxlen=self.window)).append(seconds)
+            count, errors = self._counts.get(endpoint, (0, 0))
+            self._counts[endpoint] = (count + 1, errors + (0 if ok else 1))
+
+    def snapshot(self):
+        with self._lock:
+            samples = {endpoint: sorted(values) for endpoint, values in self._samples.items()}
+            counts = dict(self._counts)
+        report = {}
+        for endpoint, values in samples.items():
+            count, errors = counts[endpoint]
+            report[endpoint] = {
+                "requests": count,
+                "errors": errors,
+                "mean_ms": round(1000 * sum(values) / len(values), 2),
+                "p50_ms": round(1000 * _percentile(values, 50), 2),
+                "p95_ms": round(1000 * _percentile(values, 95), 2),
+                "p99_ms": round(1000 * _percentile(values, 99), 2),
+            }
+        return report
+
+
+def _percentile(sorted_values, percent):
+    index = min(len(sorted_values) - 1, int(round(percent / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class QueryService:
+    """
+    Logica del servizio, indipendente dall'HTTP.
+
+    `query_fn(question, chat_history=...)` risponde alle domande; per default
+    è query_chatbot, che usa il RAGEngine condiviso dal processo.
+    """
+
+    def __init__(self, query_fn=None, max_sessions=bot_review.MAX_CHAT_SESSIONS):
+        self.query_fn = query_fn or (lambda question, chat_history=None: query_chatbot(
+            question, chat_history=chat_history, raise_errors=True))
+        self.sessions = ChatSessions(max_sessions, lock_factory=threading.Lock, history_factory=new_chat_history)
+        self.latency = LatencyStats()
+        self.started = time.time()
+
+    def query(self, question):
+        return self.query_fn(question, chat_history=[])
+
+    def chat(self, session_id, question):
+        history, lock = self.sessions.get(session_id)
+        with lock:
+            answer = self.query_fn(question, chat_history=list(history.messages))
+            history.add_user_message(question)
+            history.add_ai_message(answer)
+        return answer
+
+    def health(self):
+        engine = get_engine()
+        signature = engine.index_signature()
+        return {
+            "status": "ok" if signature is not None else "no_index",
+            "index_path": engine.vectorstore_path,
+            "index_loaded": engine._loaded is not None,
+            "sessions": len(self.sessions),
+            "uptime_s": round(time.time() - self.started, 1),
+        }
+
+    def stats(self):
+        engine = get_engine()
+        report = {"latency": self.latency.snapshot()}
+        if engine.exact_cache is not None:
+            report["exact_cache"] = engine.exact_cache.stats()
+        if engine.answer_cache is not None:
+            report["semantic_cache"] = engine.answer_cache.stats()
+        return report
+
+
+class PooledHTTPServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer che serve le connessioni da un pool di thread di dimensione fissa."""
+
+    def __init__(self, address, handler_class, workers=SERVICE_WORKERS):
+        super().__init__(address, handler_class)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query-service")
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False)
+
+
+def make_handler(service, verbose=False):
+    """Classe di handler HTTP legata a `service`."""
+
+    class QueryHandler(BaseHTTPRequestHandler):
+        server_version = "StudentsBot/1.0"
+
+        def do_GET(self):
+            if self.path == "/health":
+                health = service.health()
+                self._send_json(200 if health["status"] == "ok" else 503, health)
+            elif self.path == "/stats":
+                self._send_json(200, service.stats())
+            else:
+                self._send_json(404, {"error": f"Endpoint sconosciuto: {self.path}"})
+
+        def do_POST(self):
+            if self.path == "/query":
+                self._answer("/query", lambda question: service.query(question))
+            elif self.path.startswith("/chat/") and len(self.path) > len("/chat/"):
+                session_id = self.path[len("/chat/"):]
+                self._answer("/chat", lambda question: service.chat(session_id, question))
+            else:
+                self._send_json(404, {"error": f"Endpoint sconosciuto: {self.path}"})
+
+        def do_DELETE(self):
+            if self.path.startswith("/chat/") and len(self.path) > len("/chat/"):
+                existed = service.sessions.reset(self.path[len("/chat/"):])
+                self._send_json(200 if existed else 404, {"reset": existed})
+            else:
+                self._send_json(404, {"error": f"Endpoint sconosciuto: {self.path}"})
+
+        def _answer(self, endpoint, answer_fn):
+            start = time.perf_counter()
+            question = self._read_question()
+            if question is None:
+                return
+            try:
+                answer = answer_fn(question)
+            except FileNotFoundError as e:
+                service.latency.record(endpoint, time.perf_counter() - start, ok=False)
+                self._send_json(503, {"error": f"Indice non disponibile: {e}"})
+                return
+            except Exception as e:
+                service.latency.record(endpoint, time.perf_counter() - start, ok=False)
+                self._send_json(500, {"error": f"Errore durante l'elaborazione della query: {e}"})
+                return
+            elapsed = time.perf_counter() - start
+            service.latency.record(endpoint, elapsed)
+            self._send_json(200, {"answer": answer, "latency_ms": round(1000 * elapsed, 2)})
+
+        def _read_question(self):
+            """Domanda dal corpo JSON della richiesta, o None dopo aver risposto con l'errore."""
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > MAX_REQUEST_BYTES:
+                self._send_json(413, {"error": "Richiesta troppo grande."})
+                return None
+            try:
+                payload = json.loads(self.rfile.read(length) or b"{}")
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                self._send_json(400, {"error": "Il corpo della richiesta deve essere JSON."})
+                return None
+            question = payload.get("question") if isinstance(payload, dict) else None
+            if not isinstance(question, str) or not question.strip():
+                self._send_json(400, {"error": "Campo 'question' mancante o vuoto."})
+                return None
+            return question.strip()
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            if verbose:
+                super().log_message(format, *args)
+
+    return QueryHandler
+
+
+def make_server(service, host=SERVICE_HOST, port=SERVICE_PORT, workers=SERVICE_WORKERS, verbose=False):
+    return PooledHTTPServer((host, port), make_handler(service, verbose), workers)
+
+
+def use_offline_backends():
+    """
+    Sostituisce embedding e LLM Gemini con quelli finti di langchain_core.
+
+    Cambiano anche i nomi dei modelli, così le risposte finte non finiscono
+    nei cache usati con i modelli veri.
+    """
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+    class OfflineEmbeddings(DeterministicFakeEmbedding):
+        def __init__(self, model=None, **kwargs):
+            super().__init__(size=OFFLINE_EMBEDDING_SIZE)
+
+    class OfflineChatModel(FakeListChatModel):
+        def __init__(self, model=None, **kwargs):
+            super().__init__(responses=["Risposta di prova del servizio in modalità offline."])
+
+    bot_review.make_embedding_model = lambda: OfflineEmbeddings()
+    bot_review.make_chat_model = lambda temperature=0.1: OfflineChatModel()
+    bot_review.MODEL_NAME_EMBEDDINGS = "offline-embedding"
+    bot_review.MODEL_NAME_LLM = "offline-llm"
+
+
+def parse_option(name, default, convert=int):
+    """Legge da sys.argv il valore dell'opzione `name`, o `default` se assente."""
+    if name not in sys.argv:
+        return default
+    option_index = sys.argv.index(name)
+    if option_index + 1 >= len(sys.argv):
+        print(f"Errore: {name} richiede un valore.")
+        sys.exit(1)
+    try:
+        return convert(sys.argv[option_index + 1])
+    except ValueError:
+        print(f"Errore: valore non valido per {name}: {sys.argv[option_index + 1]}")
+        sys.exit(1)
+
+
+def main():
+    """Funzione principale per uso da linea di comando."""
+    if '--help' in sys.argv or '-h' in sys.argv:
+        print("Servizio HTTP di StudentsBot")
+        print("\nUSO:")
+        print("  python query_service.py [--host H] [--port N] [--workers N] [--offline] [--verbose]")
+        print("\nPARAMETRI:")
+        print(f"  --host H      Indirizzo di ascolto (default: {SERVICE_HOST})")
+        print(f"  --port N      Porta di ascolto (default: {SERVICE_PORT})")
+        print(f"  --workers N   Richieste servite in parallelo (default: {SERVICE_WORKERS})")
+        print("  --offline     Usa embedding e LLM finti (nessuna chiamata a Gemini)")
+        print("  --verbose     Registra ogni richiesta HTTP")
+        print("  --help, -h    Mostra questo aiuto")
+        print("\nENDPOINT:")
+        print("  POST   /query            {\"question\": \"...\"}")
+        print("  POST   /chat/<sessione>  {\"question\": \"...\"}  (con storia della chat)")
+        print("  DELETE /chat/<sessione>  Cancella la storia della sessione")
+        print("  GET    /health           Stato del servizio")
+        print("  GET    /stats            Latenze e statistiche dei cache")
+        print("\nESEMPIO:")
+        print("  curl -s localhost:8000/query -d '{\"question\": \"Quali sono gli esami del primo anno?\"}'")
+        sys.exit(0)
+
+    load_dotenv()
+    host = parse_option('--host', SERVICE_HOST, str)
+    port = parse_option('--port', SERVICE_PORT)
+    workers = parse_option('--workers', SERVICE_WORKERS)
+    if workers <= 0:
+        print("Errore: il valore di --workers deve essere un numero positivo.")
+        sys.exit(1)
+    if '--offline' in sys.argv:
+        use_offline_backends()
+        print("Modalità offline: embedding e LLM finti.")
+
+    # Caricamento unico dell'indice prima di accettare richieste
+    start = time.perf_counter()
+    try:
+        get_engine().get()
+    except FileNotFoundError as e:
+        print(f"Errore: {e}. Eseguire prima l'indicizzazione con 'python bot_review.py --index_only'.")
+        sys.exit(1)
+    print(f"Indice caricato in {time.perf_counter() - start:.2f}s")
+
+    server = make_server(QueryService(), host, port, workers, verbose='--verbose' in sys.argv)
+    print(f"StudentsBot in ascolto su http://{host}:{port} ({workers} worker)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nArresto del servizio.")
+    finally:
+        server.server_close()
+        bot_review.print_answer_cache_stats()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Rate limiting lato client e retry con backoff esponenziale per le chiamate
+alle API Gemini.
+"""
+
+import random
+import threading
+import time
+from collections import deque
+
+# Codici HTTP per cui ha senso ritentare la chiamata
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Nomi delle eccezioni google.api_core equivalenti ai codici sopra
+RETRYABLE_ERROR_NAMES = {
+    "ResourceExhausted", "TooManyRequests", "InternalServerError",
+    "ServiceUnavailable", "BadGateway", "GatewayTimeout", "DeadlineExceeded",
+}
+
+
+class RateLimiter:
+    """
+    Limitatore a finestra mobile di 60 secondi su richieste e token al minuto.
+
+    `acquire(tokens)` blocca finché la richiesta può partire senza superare
+    né `requests_per_minute` né `tokens_per_minute`. Un limite a None è
+    disattivato. L'istanza è thread-safe e va condivisa tra tutti i worker
+    che usano la stessa quota.
+    """
+
+    WINDOW = 60.0
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._events = deque()  # (timestamp, tokens)
+        self._tokens_in_window = 0
+        self._cond = threading.Condition()
+
+    def _prune(self, now):
+        while self._events and now - self._events[0][0] >= self.WINDOW:
+            _, tokens = self._events.popleft()
+            self._tokens_in_window -= tokens
+
+    def _wait_time(self, now, tokens):
+        """Secondi da attendere prima che una richiesta da `tokens` possa partire."""
+        wait = 0.0
+        if self.requests_per_minute and len(self._events) >= self.requests_per_minute:
+            oldest = self._events[len(self._events) - self.requests_per_minute][0]
+            wait = max(wait, oldest + self.WINDOW - now)
+        if self.tokens_per_minute and self._events:
+            # Una richiesta più grande dell'intera quota passa a finestra vuota
+            budget = self.tokens_per_minute - min(tokens, self.tokens_per_minute)
+            excess = self._tokens_in_window - budget
+            for ts, event_tokens in self._events:
+                if excess <= 0:
+                    break
+                excess -= event_tokens
+                wait = max(wait, ts + self.WINDOW - now)
+        return wait
+
+    def acquire(self, tokens=0):
+        """Attende il proprio turno e registra la richiesta nella finestra."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._prune(now)
+                wait = self._wait_time(now, tokens)
+                if wait <= 0:
+                    self._events.append((now, tokens))
+                    self._tokens_in_window += tokens
+                    return
+                self._cond.wait(wait)
+
+
+def estimate_tokens(text):
+    """Stima grossolana dei token di un testo (circa 4 caratteri per token)."""
+    return len(text) // 4 + 1
+
+
+def is_retryable_error(error):
+    """True se l'errore è un rate limit (429) o un errore temporaneo del server (5xx)."""
+    for attr in ("status_code", "code", "status"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int) and value in RETRYABLE_STATUS_CODES:
+            return True
+    response = getattr(error, "response", None)
+    if getattr(response, "status_code", None) in RETRYABLE_STATUS_CODES:
+        return True
+    for cls in type(error).__mro__:
+        if cls.__name__ in RETRYABLE_ERROR_NAMES:
+            return True
+    message = str(error)
+    return "429" in message or "RESOURCE_EXHAUSTED" in message or "503" in message
+
+
+def call_with_backoff(fn, *args, max_retries=5, base_delay=1.0, max_delay=60.0,
+                      is_retryable=is_retryable_error, on_retry=None, **kwargs):
+    """
+    Esegue `fn(*args, **kwargs)` ritentando con backoff esponenziale e jitter
+    sugli errori ritentabili. Gli altri errori, o l'ultimo tentativo fallito,
+    vengono rilanciati al chiamante.
+    """
+    attempt = 0
+    while True:
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            delay = min(max_delay, base_delay * (2 ** attempt))
+            delay = delay / 2 + random.uniform(0, delay / 2)
+            if on_retry:
+                on_retry(e, attempt + 1, delay)
+            time.sleep(delay)
+            attempt += 1
+
+
+class AdaptiveRateLimiter:
+    """
+    Spaziatura minima tra richieste che si adatta alle risposte del server.
+
+    Ogni 429 moltiplica l'intervallo tra due richieste (`on_throttle`), ogni
+    successo lo riduce di un passo fisso (`on_success`), fino a
+    `min_interval`: aumento moltiplicativo e diminuzione additiva, così il
+    throughput converge appena sotto la quota del provider senza conoscerla.
+    """
+
+    def __init__(self, initial_interval=0.0, min_interval=0.0, max_interval=60.0,
+                 backoff_factor=2.0, recovery_step=0.05):
+        self.interval = initial_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff_factor = backoff_factor
+        self.recovery_step = recovery_step
+        self.throttled = 0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Attende lo slot successivo libero."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def on_success(self):
+        with self._lock:
+            self.interval = max(self.min_interval, self.interval - self.recovery_step)
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttled += 1
+            self.interval = min(self.max_interval, max(self.interval * self.backoff_factor, 0.5))
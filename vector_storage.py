@@ -0,0 +1,268 @@
+"""
+Formato su disco del vectorstore, senza pickle.
+
+`index/` contiene:
+    index-<versione>.faiss       indice FAISS (faiss.write_index)
+    docstore-<versione>.sqlite   chunk in sola lettura: posizione FAISS, id, testo, metadata JSON
+    vectorstore.json             versione corrente, cioè la coppia di file da aprire
+
+Ogni salvataggio scrive una nuova coppia di file e poi sostituisce
+`vectorstore.json` con un'unica rename atomica: chi ricarica l'indice
+mentre viene salvato apre sempre indice e docstore della stessa versione,
+mai l'indice nuovo con le posizioni del docstore vecchio. Dopo la
+sostituzione restano su disco solo la versione corrente e la precedente:
+chi ha caricato la precedente (ad esempio un thread del servizio HTTP che
+apre ora la sua connessione al docstore) la trova ancora fino al
+salvataggio successivo.
+
+In lettura l'indice è aperto con mmap: i vettori restano nella page cache
+del sistema operativo, condivisa tra i processi (batch, chat, servizio HTTP),
+e l'apertura non copia nulla in memoria. Il testo e i metadata dei chunk
+sono letti da SQLite solo per i risultati della ricerca, per id o per
+posizione nell'indice. L'indicizzazione apre invece tutto in memoria, per
+poter aggiungere e rimuovere vettori, e riscrive i file alla fine.
+
+Il vecchio formato di `FAISS.save_local` (index.pkl) non viene più letto:
+il pickle del docstore permetteva di eseguire codice arbitrario al
+caricamento. Un indice in quel formato va rigenerato.
+"""
+
+import glob
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from collections.abc import Mapping
+from urllib.parse import quote
+
+import faiss
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+CURRENT_FILENAME = "vectorstore.json"
+INDEX_FILENAME = "index-{version}.faiss"
+DOCSTORE_FILENAME = "docstore-{version}.sqlite"
+# Coppia senza versione scritta prima di vectorstore.json: ancora leggibile
+UNVERSIONED_INDEX_FILENAME = "index.faiss"
+UNVERSIONED_DOCSTORE_FILENAME = "docstore.sqlite"
+LEGACY_PICKLE_FILENAME = "index.pkl"
+MMAP_FLAGS = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+
+
+def write_docstore(path, index_to_docstore_id, docstore, version=None):
+    """
+    Scrive i chunk di `docstore` in `path` (SQLite), sostituendo il file in
+    modo atomico; `version` è registrata nella tabella `meta`.
+    """
+    tmp_path = path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute(
+            "CREATE TABLE chunks (position INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE,"
+            " content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        rows = []
+        for position, doc_id in sorted(index_to_docstore_id.items()):
+            doc = docstore.search(doc_id)
+            if not isinstance(doc, Document):
+                raise ValueError(f"Chunk {doc_id} assente dal docstore")
+            rows.append((int(position), doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False)))
+        conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)", rows)
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        if version is not None:
+            conn.execute("INSERT INTO meta VALUES ('version', ?)", (version,))
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+
+
+class SQLiteDocstore:
+    """
+    Docstore di LangChain in sola lettura su SQLite: `search(id)` legge un
+    solo chunk. Ogni thread usa la propria connessione.
+    """
+
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{quote(os.path.abspath(self.path))}?mode=ro", uri=True)
+            self._local.conn = conn
+        return conn
+
+    def search(self, search):
+        row = self._conn().execute("SELECT content, metadata FROM chunks WHERE id = ?", (search,)).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+    def id_at(self, position):
+        row = self._conn().execute("SELECT id FROM chunks WHERE position = ?", (int(position),)).fetchone()
+        return row[0] if row else None
+
+    def positions(self):
+        return [row[0] for row in self._conn().execute("SELECT position FROM chunks ORDER BY position")]
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def version(self):
+        """Versione registrata al salvataggio, o None."""
+        conn = self._conn()
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'meta'").fetchone() is None:
+            return None
+        row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row[0] if row else None
+
+    def items(self):
+        """Tutti i chunk come (posizione, id, Document), in ordine di posizione."""
+        for position, doc_id, content, metadata in self._conn().execute(
+                "SELECT position, id, content, metadata FROM chunks ORDER BY position"):
+            yield position, doc_id, Document(page_content=content, metadata=json.loads(metadata))
+
+
+class PositionMap(Mapping):
+    """`index_to_docstore_id` di LangChain letto dal docstore SQLite, una posizione alla volta."""
+
+    def __init__(self, docstore):
+        self.docstore = docstore
+        self._len = None
+
+    def __getitem__(self, position):
+        doc_id = self.docstore.id_at(position)
+        if doc_id is None:
+            raise KeyError(position)
+        return doc_id
+
+    def __len__(self):
+        if self._len is None:
+            self._len = len(self.docstore)
+        return self._len
+
+    def __iter__(self):
+        return iter(self.docstore.positions())
+
+
+def current_files(path):
+    """
+    (versione, file dell'indice, file del docstore) della versione corrente
+    in `path`, o None se non c'è un vectorstore nel formato attuale.
+    """
+    try:
+        with open(os.path.join(path, CURRENT_FILENAME), "r", encoding="utf-8") as f:
+            version = json.load(f)["version"]
+    except FileNotFoundError:
+        if os.path.exists(os.path.join(path, UNVERSIONED_DOCSTORE_FILENAME)):
+            return (None, os.path.join(path, UNVERSIONED_INDEX_FILENAME),
+                    os.path.join(path, UNVERSIONED_DOCSTORE_FILENAME))
+        return None
+    return (version, os.path.join(path, INDEX_FILENAME.format(version=version)),
+            os.path.join(path, DOCSTORE_FILENAME.format(version=version)))
+
+
+def save_vectorstore(vectorstore, path):
+    """
+    Salva indice FAISS e docstore SQLite in `path` come nuova versione e la
+    rende corrente con una sola rename; elimina poi i file delle versioni
+    più vecchie della precedente e l'eventuale pickle del vecchio formato.
+    """
+    os.makedirs(path, exist_ok=True)
+    version = uuid.uuid4().hex[:16]
+    index_path = os.path.join(path, INDEX_FILENAME.format(version=version))
+    docstore_path = os.path.join(path, DOCSTORE_FILENAME.format(version=version))
+    faiss.write_index(vectorstore.index, index_path)
+    write_docstore(docstore_path, vectorstore.index_to_docstore_id, vectorstore.docstore, version)
+    current_path = os.path.join(path, CURRENT_FILENAME)
+    try:
+        previous = current_files(path)
+    except (ValueError, KeyError):  # vectorstore.json illeggibile: la nuova versione lo sostituisce
+        previous = None
+    previous_version = previous[0] if previous else None
+    with open(current_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"version": version, "previous": previous_version}, f)
+    os.replace(current_path + ".tmp", current_path)
+
+    keep = {version, previous_version}
+    stale = []
+    for pattern in (INDEX_FILENAME, DOCSTORE_FILENAME):
+        prefix, suffix = pattern.split("{version}")
+        for stale_path in glob.glob(os.path.join(path, pattern.format(version="*"))):
+            if os.path.basename(stale_path)[len(prefix):-len(suffix)] not in keep:
+                stale.append(stale_path)
+    if previous_version is not None:
+        # La coppia senza versione resta finché è quella precedente
+        stale += [os.path.join(path, UNVERSIONED_INDEX_FILENAME), os.path.join(path, UNVERSIONED_DOCSTORE_FILENAME)]
+    stale.append(os.path.join(path, LEGACY_PICKLE_FILENAME))
+    for stale_path in stale:
+        try:
+            os.remove(stale_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:  # es. file ancora aperto da un altro processo su Windows
+            print(f"File di una versione precedente non eliminato ({stale_path}): {e}")
+
+
+def load_vectorstore(path, embeddings, writable=False):
+    """
+    Apre il vectorstore salvato in `path`.
+
+    In sola lettura (default) l'indice è mappato in memoria e i chunk restano
+    su SQLite; con `writable=True` tutto viene caricato in memoria per
+    l'aggiornamento incrementale.
+
+    Raises:
+        FileNotFoundError: se l'indice non esiste.
+        ValueError: se l'indice è nel vecchio formato con pickle.
+    """
+    while True:
+        files = current_files(path)
+        if files is None:
+            if os.path.exists(os.path.join(path, LEGACY_PICKLE_FILENAME)):
+                raise ValueError(f"Indice in {path} nel vecchio formato con pickle: rigenerarlo con "
+                                 "'python bot_review.py --index_only'")
+            raise FileNotFoundError(f"Nessun docstore in {path}")
+        try:
+            return _open_version(embeddings, writable, *files)
+        except (FileNotFoundError, RuntimeError, sqlite3.OperationalError):
+            # Salvataggi concorrenti hanno eliminato la versione appena letta: si apre quella nuova
+            if current_files(path) == files:
+                raise
+
+
+def _open_version(embeddings, writable, version, index_path, docstore_path):
+    docstore = SQLiteDocstore(docstore_path)
+    # Stessa versione per indice e docstore: una posizione FAISS non indica mai il chunk sbagliato
+    if version is not None and docstore.version() != version:
+        raise ValueError(f"Il docstore {docstore_path} non appartiene alla versione {version} dell'indice")
+    if not os.path.exists(index_path):
+        raise FileNotFoundError(index_path)
+    if writable:
+        index = faiss.read_index(index_path)
+        index_to_docstore_id, documents = {}, {}
+        for position, doc_id, doc in docstore.items():
+            index_to_docstore_id[position] = doc_id
+            documents[doc_id] = doc
+        return FAISS(embeddings, index, InMemoryDocstore(documents), index_to_docstore_id)
+    return FAISS(embeddings, read_index_readonly(index_path), docstore, PositionMap(docstore))
+
+
+def read_index_readonly(index_path):
+    """
+    Apre l'indice FAISS in sola lettura, con mmap quando il tipo lo consente.
+    FAISS non mappa le liste invertite degli indici IVF: per questi l'indice
+    è letto interamente in memoria.
+    """
+    try:
+        return faiss.read_index(index_path, MMAP_FLAGS)
+    except RuntimeError:
+        return faiss.read_index(index_path)